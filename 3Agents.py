@@ -2,65 +2,491 @@ import lmstudio as lms
 import time
 import colorama
 from colorama import Fore, Style
+import sys
+import json
+import asyncio
+import argparse
+from collections import deque
+from instrumentation import span, enable as enable_instrumentation
 
 # Initialize colorama
 colorama.init()
 
-# Multiple model initializations to avoid context mixing
-pro_nuclear_model = lms.llm()
-anti_nuclear_model = lms.llm()
-supervisor_model = lms.llm()  # Supervisor model
-
-# Configuring the three agents
-pro_nuclear_chat = lms.Chat("Tu es un fervent défenseur de l'énergie nucléaire. Tu crois que le nucléaire est propre, fiable et essentiel pour la sécurité énergétique. Tu essaies de convaincre les autres que l'énergie nucléaire est meilleure que les alternatives. Concentre tes arguments sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales. Tes réponses doivent faire moins de 20 mots. N'explique pas ton processus de réflexion - donne seulement ton argument direct.")
-
-anti_nuclear_chat = lms.Chat("Tu es un opposant convaincu à l'énergie nucléaire. Tu crois que le nucléaire est dangereux, crée des déchets durables et pose des risques inacceptables. Concentre tes arguments sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales. Tes réponses doivent faire moins de 20 mots. N'explique pas ton processus de réflexion - donne seulement ton argument direct.")
-
-supervisor_chat = lms.Chat("Tu es un superviseur neutre de débat. Ton rôle est de veiller à ce que le débat reste centré sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales liées à l'énergie nucléaire. Si le débat s'écarte de ces sujets, fournis un bref commentaire pour recentrer la discussion. Limite tes commentaires à moins de 25 mots. Sois ferme mais juste.")
-
-# Initial message to start the debate
-initial_message = "Quel est l'impact de l'énergie nucléaire sur la pollution radioactive, la santé publique et l'environnement?"
-
-print("\n=== DÉBAT SUR L'ÉNERGIE NUCLÉAIRE: FOCUS SUR LA POLLUTION, LA SANTÉ ET L'ENVIRONNEMENT ===\n")
-print(f"{Fore.CYAN}Superviseur: \"Bienvenue à ce débat sur l'énergie nucléaire. Veuillez concentrer vos arguments sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales.\"{Style.RESET_ALL}\n")
-
-# First exchange - The pro-nuclear advocate begins
-pro_nuclear_chat.add_user_message(f"Sujet du débat: '{initial_message}' - Donne ton point de vue en moins de 20 mots, en te concentrant sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales. Ne montre pas ta réflexion - énonce simplement ton argument directement.")
-pro_nuclear_response = pro_nuclear_model.respond(pro_nuclear_chat)
-pro_nuclear_chat.add_assistant_response(pro_nuclear_response)
-print(f"{Fore.BLUE}Défenseur du nucléaire: \"{pro_nuclear_response}\"{Style.RESET_ALL}\n")
-
-# Simulating 5 rounds of debate
-for i in range(5):
-    # The anti-nuclear advocate responds
-    anti_nuclear_chat.add_user_message(f"Ton adversaire vient de dire: '{pro_nuclear_response}' - Comment réponds-tu en moins de 20 mots? Concentre-toi sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales. Énonce simplement ton argument directement.")
-    anti_nuclear_response = anti_nuclear_model.respond(anti_nuclear_chat)
-    anti_nuclear_chat.add_assistant_response(anti_nuclear_response)
-    print(f"{Fore.RED}Opposant au nucléaire: \"{anti_nuclear_response}\"{Style.RESET_ALL}\n")
-    
-    # Supervisor evaluates the exchange and provides guidance if needed
-    supervisor_chat.add_user_message(f"Le défenseur du nucléaire a dit: '{pro_nuclear_response}'\nL'opposant au nucléaire a répondu: '{anti_nuclear_response}'\nÉvalue s'ils se concentrent sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales. Sinon, fournis un bref commentaire pour les recentrer. S'ils sont sur le sujet, donne une brève affirmation.")
-    supervisor_response = supervisor_model.respond(supervisor_chat)
-    supervisor_chat.add_assistant_response(supervisor_response)
-    print(f"{Fore.CYAN}Superviseur: \"{supervisor_response}\"{Style.RESET_ALL}\n")
-    time.sleep(1)  # Short pause for readability
-    
-    # The pro-nuclear advocate responds and considers supervisor feedback
-    pro_nuclear_chat.add_user_message(f"Ton adversaire vient de dire: '{anti_nuclear_response}'\nLe superviseur a commenté: '{supervisor_response}'\nContre-argumente et défends l'énergie nucléaire. Concentre-toi sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales. Réponds en moins de 20 mots. Énonce simplement ton argument directement.")
-    pro_nuclear_response = pro_nuclear_model.respond(pro_nuclear_chat)
-    pro_nuclear_chat.add_assistant_response(pro_nuclear_response)
-    print(f"{Fore.BLUE}Défenseur du nucléaire: \"{pro_nuclear_response}\"{Style.RESET_ALL}\n")
-    
-    # Supervisor evaluates again
-    supervisor_chat.add_user_message(f"L'opposant au nucléaire a dit: '{anti_nuclear_response}'\nLe défenseur du nucléaire a répondu: '{pro_nuclear_response}'\nÉvalue s'ils se concentrent sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales. Sinon, fournis un bref commentaire pour les recentrer. S'ils sont sur le sujet, donne une brève affirmation.")
-    supervisor_response = supervisor_model.respond(supervisor_chat)
-    supervisor_chat.add_assistant_response(supervisor_response)
-    print(f"{Fore.CYAN}Superviseur: \"{supervisor_response}\"{Style.RESET_ALL}\n")
-    time.sleep(1)  # Short pause for readability
-
-# Final supervisor comment
-supervisor_chat.add_user_message("Le débat est terminé. Fournis un bref commentaire de clôture résumant les points clés sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales discutés.")
-closing_remark = supervisor_model.respond(supervisor_chat)
-print(f"{Fore.CYAN}Superviseur: \"{closing_remark}\"{Style.RESET_ALL}\n")
-
-print("=== FIN DU DÉBAT ===")
\ No newline at end of file
+# Debate configuration
+DEBATE_ROUNDS = 5    # Exchanges after the opening statement
+DISPLAY_PACE = 0.0   # Seconds to pause after each supervisor comment, for reading along; 0 for none
+
+# Batch configuration
+DEBATE_CONCURRENCY = 8         # Debates run at the same time in batch mode
+MAX_REQUESTS_IN_FLIGHT = 4     # Model requests running at once, across all debates
+TRANSCRIPT_PATH = "debates.jsonl"
+TURN_MAX_ATTEMPTS = 2          # Tries per model call in batch mode before its debate is given up
+TURN_RETRY_DELAY = 1.0         # Seconds before the first retry, doubled on each attempt
+
+# History configuration
+HISTORY_MAX_EXCHANGES = 8   # Exchanges an agent's chat holds before the oldest are dropped
+HISTORY_KEEP_EXCHANGES = 4  # Exchanges left after dropping; trimming in steps keeps the prompt prefix stable in between
+CHARS_PER_TOKEN = 4         # Rough ratio used when the model does not report token counts
+
+# The original nuclear debate. A config file has the same layout: debaters speak in list order,
+# {words} is the speaker's word limit, and a reply template that uses {feedback} makes that
+# debater wait for the supervisor's evaluation of the exchange before it.
+DEFAULT_DEBATE = {
+    "title": "=== DÉBAT SUR L'ÉNERGIE NUCLÉAIRE: FOCUS SUR LA POLLUTION, LA SANTÉ ET L'ENVIRONNEMENT ===",
+    "ending": "=== FIN DU DÉBAT ===",
+    "topic": "Quel est l'impact de l'énergie nucléaire sur la pollution radioactive, la santé publique et l'environnement?",
+    "rounds": DEBATE_ROUNDS,
+    "words": 20,
+    "debaters": [
+        {
+            "name": "pro",
+            "label": "Défenseur du nucléaire",
+            "speaker": "Le défenseur du nucléaire",
+            "color": "BLUE",
+            "system_prompt": "Tu es un fervent défenseur de l'énergie nucléaire. Tu crois que le nucléaire est propre, fiable et essentiel pour la sécurité énergétique. Tu essaies de convaincre les autres que l'énergie nucléaire est meilleure que les alternatives. Concentre tes arguments sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales. Tes réponses doivent faire moins de {words} mots. N'explique pas ton processus de réflexion - donne seulement ton argument direct.",
+            "reply": "Ton adversaire vient de dire: '{previous}'\nLe superviseur a commenté: '{feedback}'\nContre-argumente et défends l'énergie nucléaire. Concentre-toi sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales. Réponds en moins de {words} mots. Énonce simplement ton argument directement.",
+        },
+        {
+            "name": "anti",
+            "label": "Opposant au nucléaire",
+            "speaker": "L'opposant au nucléaire",
+            "color": "RED",
+            "system_prompt": "Tu es un opposant convaincu à l'énergie nucléaire. Tu crois que le nucléaire est dangereux, crée des déchets durables et pose des risques inacceptables. Concentre tes arguments sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales. Tes réponses doivent faire moins de {words} mots. N'explique pas ton processus de réflexion - donne seulement ton argument direct.",
+        },
+    ],
+    "supervisor": {
+        "label": "Superviseur",
+        "color": "CYAN",
+        "words": 25,
+        "system_prompt": "Tu es un superviseur neutre de débat. Ton rôle est de veiller à ce que le débat reste centré sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales liées à l'énergie nucléaire. Si le débat s'écarte de ces sujets, fournis un bref commentaire pour recentrer la discussion. Limite tes commentaires à moins de {words} mots. Sois ferme mais juste.",
+        "welcome": "Bienvenue à ce débat sur l'énergie nucléaire. Veuillez concentrer vos arguments sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales.",
+    },
+    "prompts": {
+        "opening": "Sujet du débat: '{topic}' - Donne ton point de vue en moins de {words} mots, en te concentrant sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales. Ne montre pas ta réflexion - énonce simplement ton argument directement.",
+        "reply": "Ton adversaire vient de dire: '{previous}' - Comment réponds-tu en moins de {words} mots? Concentre-toi sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales. Énonce simplement ton argument directement.",
+        "evaluation": "{first_speaker} a dit: '{first}'\n{second_speaker} a répondu: '{second}'\nÉvalue s'ils se concentrent sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales. Sinon, fournis un bref commentaire pour les recentrer. S'ils sont sur le sujet, donne une brève affirmation.",
+        "closing": "Le débat est terminé. Fournis un bref commentaire de clôture résumant les points clés sur la pollution radioactive, les impacts sur la santé et les préoccupations environnementales discutés.",
+    },
+}
+
+def load_debates(path):
+    """Read debate configs from a JSON file holding one debate or {"debates": [...]}
+    
+    Keys a debate leaves out are taken from DEFAULT_DEBATE.
+    """
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    debates = config.get("debates", [config])
+    return [{**DEFAULT_DEBATE, **debate, "prompts": {**DEFAULT_DEBATE["prompts"], **debate.get("prompts", {})}}
+            for debate in debates]
+
+class DebateAgent:
+    """A debater or the supervisor: a model, its own history and how it is displayed
+    
+    Agents can share one model handle, since each keeps its own history and
+    builds the chat it sends from it. The history is a window of recent
+    exchanges after the system prompt. It only grows until it holds
+    max_exchanges, then drops back to keep_exchanges at once, so between
+    trims every request repeats the previous one word for word and adds to
+    the end: a prefix the server can reuse from its cache. Prompt tokens
+    per turn are counted to show the prompt stays bounded.
+    """
+    
+    def __init__(self, label, model, system_prompt, color,
+                 max_exchanges=HISTORY_MAX_EXCHANGES, keep_exchanges=HISTORY_KEEP_EXCHANGES):
+        self.label = label
+        self.model = model
+        self.system_prompt = system_prompt
+        self.color = color
+        self.max_exchanges = max_exchanges
+        self.keep_exchanges = keep_exchanges
+        self.exchanges = deque()
+        self.turns = 0
+        self.trims = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.last_prompt_tokens = 0
+    
+    def chat_for(self, prompt):
+        """Return the chat to send for a new prompt: system prompt, recent exchanges, then the prompt"""
+        chat = lms.Chat(self.system_prompt)
+        for question, answer in self.exchanges:
+            chat.add_user_message(question)
+            chat.add_assistant_response(answer)
+        chat.add_user_message(prompt)
+        return chat
+    
+    def remember(self, prompt, answer, prompt_tokens=None):
+        """Add an exchange to the history, trimming it when it is full, and count its prompt tokens
+        
+        Returns the prompt token count, estimated when the model did not report it.
+        """
+        if prompt_tokens is None:
+            characters = len(self.system_prompt) + len(prompt) + sum(len(q) + len(a) for q, a in self.exchanges)
+            prompt_tokens = characters // CHARS_PER_TOKEN
+        self.turns += 1
+        self.prompt_tokens += prompt_tokens
+        self.max_prompt_tokens = max(self.max_prompt_tokens, prompt_tokens)
+        self.last_prompt_tokens = prompt_tokens
+        
+        self.exchanges.append((prompt, answer))
+        if self.max_exchanges is not None and len(self.exchanges) > self.max_exchanges:
+            while len(self.exchanges) > self.keep_exchanges:
+                self.exchanges.popleft()
+            self.trims += 1
+        return prompt_tokens
+    
+    def report(self):
+        """Print prompt tokens per turn for this agent"""
+        if self.turns:
+            print(f"{self.color}{self.label}: {self.turns} turns, prompt tokens per turn: "
+                  f"{self.prompt_tokens / self.turns:.0f} average, {self.max_prompt_tokens} max, "
+                  f"{self.last_prompt_tokens} last, history trimmed {self.trims} times{Style.RESET_ALL}")
+
+def make_agents(debate, model):
+    """Create the debaters and the supervisor of a debate config, all on one model handle"""
+    def agent(persona):
+        words = persona.get("words", debate["words"])
+        return DebateAgent(persona["label"], model, persona["system_prompt"].format(words=words),
+                           getattr(Fore, persona.get("color", "WHITE").upper(), Fore.WHITE))
+    
+    debaters = [agent(persona) for persona in debate["debaters"]]
+    supervisor = agent(debate["supervisor"]) if debate.get("supervisor") else None
+    return debaters, supervisor
+
+class DebateTurn:
+    """One model call in the debate, from a prompt template
+    
+    values fill the template's fields directly; needs maps other fields to
+    the turns whose answers fill them.
+    """
+    
+    def __init__(self, name, agent, template, values=None, needs=None):
+        self.name = name
+        self.agent = agent
+        self.template = template
+        self.values = values or {}
+        self.fields = needs or {}
+        self.needs = list(dict.fromkeys(self.fields.values()))
+    
+    def prompt(self, said):
+        return self.template.format(**self.values, **{field: said[name] for field, name in self.fields.items()})
+
+def build_debate(debate, debaters, supervisor):
+    """Return the turns of a debate, in display order
+    
+    After the opening statement, each debater in turn answers the statement
+    before theirs, for the given number of rounds. The supervisor evaluates
+    every exchange and closes the debate. A debater only waits for the
+    supervisor when its reply template uses {feedback}; in the default
+    debate the anti-nuclear reply does not, so it runs at the same time as
+    the supervisor's evaluation of the previous exchange. Each agent's turns
+    still run one after the other, since they share a history.
+    """
+    prompts = debate["prompts"]
+    personas = debate["debaters"]
+    statements = 1 + debate["rounds"] * len(debaters)
+    turns = []
+    
+    for k in range(statements):
+        speaker = k % len(debaters)
+        persona = personas[speaker]
+        words = persona.get("words", debate["words"])
+        name = f"{persona['name']} {k}"
+        
+        if k == 0:
+            turns.append(DebateTurn(name, debaters[speaker], prompts["opening"], {"topic": debate["topic"], "words": words}))
+        else:
+            before = personas[(k - 1) % len(debaters)]
+            previous = f"{before['name']} {k - 1}"
+            template = persona.get("reply", prompts["reply"])
+            needs = {"previous": previous}
+            if "{feedback}" in template:
+                if supervisor is not None and k >= 2:
+                    needs["feedback"] = f"supervisor {k - 1}"
+                else:
+                    template = prompts["reply"]
+            turns.append(DebateTurn(name, debaters[speaker], template, {"topic": debate["topic"], "words": words}, needs))
+            
+            # Supervisor evaluates the exchange and provides guidance if needed
+            if supervisor is not None:
+                turns.append(DebateTurn(
+                    f"supervisor {k}", supervisor, prompts["evaluation"],
+                    {"topic": debate["topic"], "first_speaker": before.get("speaker", before["label"]),
+                     "second_speaker": persona.get("speaker", persona["label"])},
+                    {"first": previous, "second": name}
+                ))
+    
+    # Final supervisor comment
+    if supervisor is not None:
+        turns.append(DebateTurn("closing", supervisor, prompts["closing"], {"topic": debate["topic"]}))
+    return turns
+
+class OrderedPrinter:
+    """Streams turns to the terminal in debate order
+    
+    The turn at the head of the order is printed as its fragments arrive;
+    fragments of turns running ahead of it are held back and printed as
+    soon as its turn comes. With pace, the display pauses after each
+    supervisor comment without holding up the model calls.
+    """
+    
+    def __init__(self, turns, supervisor, pace=DISPLAY_PACE, out=None):
+        self.turns = turns
+        self.supervisor = supervisor
+        self.pace = pace
+        self.out = out or sys.stdout
+        self.events = asyncio.Queue()
+        self.held = {turn.name: [] for turn in turns}
+        self.finished = set()
+        self.position = 0
+        self.opened = False
+    
+    def write(self, name, text):
+        self.events.put_nowait((name, text))
+    
+    def finish(self, name):
+        self.events.put_nowait((name, None))
+    
+    async def run(self):
+        while self.position < len(self.turns):
+            name, text = await self.events.get()
+            if text is None:
+                self.finished.add(name)
+            else:
+                self.held[name].append(text)
+            
+            # Print everything the head turn has so far, then move on while it is complete
+            while self.position < len(self.turns):
+                turn = self.turns[self.position]
+                if not self.opened:
+                    self.out.write(f"{turn.agent.color}{turn.agent.label}: \"")
+                    self.opened = True
+                if self.held[turn.name]:
+                    self.out.write("".join(self.held[turn.name]))
+                    self.held[turn.name] = []
+                if turn.name not in self.finished:
+                    break
+                self.out.write(f"\"{Style.RESET_ALL}\n\n")
+                self.out.flush()
+                self.opened = False
+                self.position += 1
+                if self.pace and turn.agent is self.supervisor:
+                    await asyncio.sleep(self.pace)  # Short pause for readability
+            self.out.flush()
+
+class SilentPrinter:
+    """Stands in for OrderedPrinter when debates run in batch, without a display"""
+    
+    def write(self, name, text):
+        pass
+    
+    def finish(self, name):
+        pass
+    
+    async def run(self):
+        pass
+
+async def run_turn(turn, waits, said, uses, done, printer, limit=None, on_turn=None, attempts=1):
+    """Wait for the turns this one comes after, then stream its answer, trying the model call up to attempts times"""
+    for name in waits:
+        await done[name].wait()
+    
+    prompt = turn.prompt(said)
+    # Answers no later prompt needs are dropped, so a long debate does not pile them up
+    for name in turn.needs:
+        uses[name] -= 1
+        if not uses[name]:
+            del said[name]
+    
+    agent = turn.agent
+    chat = agent.chat_for(prompt)
+    loop = asyncio.get_running_loop()
+    
+    def respond():
+        # Runs in a worker thread; fragments are handed back to the event loop
+        with span("turn", "model", turn=turn.name, agent=agent.label) as call:
+            stream = agent.model.respond_stream(chat)
+            for fragment in stream:
+                loop.call_soon_threadsafe(printer.write, turn.name, fragment.content)
+            result = stream.result()
+            call.record_stats(getattr(result, "stats", None))
+        return result
+    
+    start_time = time.perf_counter()
+    for attempt in range(attempts):
+        try:
+            if limit is None:
+                result = await asyncio.to_thread(respond)
+            else:
+                async with limit:
+                    result = await asyncio.to_thread(respond)
+            break
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+            await asyncio.sleep(TURN_RETRY_DELAY * (2 ** attempt))
+    seconds = time.perf_counter() - start_time
+    
+    stats = getattr(result, "stats", None)
+    prompt_tokens = agent.remember(prompt, result.content, getattr(stats, "prompt_tokens_count", None))
+    predicted_tokens = getattr(stats, "predicted_tokens_count", None)
+    if predicted_tokens is None:
+        predicted_tokens = len(result.content) // CHARS_PER_TOKEN
+    if on_turn is not None:
+        on_turn(turn, result.content, prompt_tokens, predicted_tokens, seconds)
+    
+    if turn.name in uses:
+        said[turn.name] = result.content
+    printer.finish(turn.name)
+    done[turn.name].set()
+
+async def run_debate(turns, supervisor, pace=DISPLAY_PACE, sequential=False, out=None, limit=None, on_turn=None, display=True,
+                     attempts=1):
+    """Run the debate graph, with independent turns at the same time
+    
+    With sequential, each turn also waits for the one before it, as in a
+    plain loop. limit is a semaphore shared by every debate running at
+    once, and on_turn(turn, answer, prompt_tokens, predicted_tokens,
+    seconds) is called as each turn finishes. A model call that still fails
+    after attempts tries cancels the debate's other turns and is raised.
+    """
+    said = {}
+    uses = {}
+    done = {turn.name: asyncio.Event() for turn in turns}
+    waits = {}
+    last_turn = {}
+    for position, turn in enumerate(turns):
+        waits[turn.name] = list(turn.needs)
+        for name in turn.needs:
+            uses[name] = uses.get(name, 0) + 1
+        # An agent's turns share its history, so they always run in order
+        if turn.agent in last_turn:
+            waits[turn.name].append(last_turn[turn.agent])
+        if sequential and position > 0:
+            waits[turn.name].append(turns[position - 1].name)
+        last_turn[turn.agent] = turn.name
+    
+    printer = OrderedPrinter(turns, supervisor, pace, out) if display else SilentPrinter()
+    printing = asyncio.create_task(printer.run())
+    # Turn tasks and their worker threads inherit the span, so their model calls count for this debate
+    with span("debate", "task", turns=len(turns)):
+        tasks = [asyncio.ensure_future(run_turn(turn, waits[turn.name], said, uses, done, printer, limit, on_turn, attempts))
+                 for turn in turns]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Turns waiting on the failed one would otherwise wait forever
+            for task in tasks + [printing]:
+                task.cancel()
+            await asyncio.gather(*tasks, printing, return_exceptions=True)
+            raise
+    await printing
+
+async def run_debates(debates, model, repeat=1, concurrency=DEBATE_CONCURRENCY, max_in_flight=MAX_REQUESTS_IN_FLIGHT,
+                      transcript_path=TRANSCRIPT_PATH, sequential=False):
+    """Run every debate config repeat times, several at once, writing each turn to a JSON lines transcript
+    
+    At most concurrency debates and max_in_flight model requests run at the
+    same time. Each model call is tried TURN_MAX_ATTEMPTS times; a debate
+    whose call still fails is recorded as one "error" line in the
+    transcript and counted as failed, and the other debates carry on.
+    Returns the totals used for the throughput report.
+    """
+    limit = asyncio.Semaphore(max_in_flight)
+    slots = asyncio.Semaphore(concurrency)
+    totals = {"debates": 0, "failed": 0, "turns": 0, "prompt_tokens": 0, "predicted_tokens": 0}
+    jobs = [(debate, run) for run in range(repeat) for debate in debates]
+    
+    with open(transcript_path, "a", encoding="utf-8") as transcript:
+        async def one(index, debate, run):
+            async with slots:
+                debate_id = f"{index:05d}"
+                debaters, supervisor = make_agents(debate, model)
+                turns = build_debate(debate, debaters, supervisor)
+                
+                def record(turn, answer, prompt_tokens, predicted_tokens, seconds):
+                    transcript.write(json.dumps({
+                        "debate": debate_id, "run": run, "topic": debate["topic"], "turn": turn.name,
+                        "agent": turn.agent.label, "content": answer, "prompt_tokens": prompt_tokens,
+                        "predicted_tokens": predicted_tokens, "seconds": round(seconds, 3), "time": time.time(),
+                    }, ensure_ascii=False) + "\n")
+                    transcript.flush()
+                    totals["turns"] += 1
+                    totals["prompt_tokens"] += prompt_tokens
+                    totals["predicted_tokens"] += predicted_tokens
+                
+                start_time = time.perf_counter()
+                try:
+                    await run_debate(turns, supervisor, sequential=sequential, limit=limit, on_turn=record, display=False,
+                                     attempts=TURN_MAX_ATTEMPTS)
+                except Exception as e:
+                    totals["failed"] += 1
+                    transcript.write(json.dumps({
+                        "debate": debate_id, "run": run, "topic": debate["topic"],
+                        "error": f"{type(e).__name__}: {e}", "time": time.time(),
+                    }, ensure_ascii=False) + "\n")
+                    transcript.flush()
+                    print(f"{Fore.RED}Debate {debate_id} failed after {time.perf_counter() - start_time:.1f} seconds: {e}{Style.RESET_ALL}")
+                    return
+                totals["debates"] += 1
+                print(f"{Fore.GREEN}Debate {debate_id} ({totals['debates']}/{len(jobs)}) finished in "
+                      f"{time.perf_counter() - start_time:.1f} seconds{Style.RESET_ALL}")
+        
+        await asyncio.gather(*(one(index, debate, run) for index, (debate, run) in enumerate(jobs)))
+    return totals
+
+def print_throughput(totals, elapsed):
+    """Print debates per hour and tokens per second for a batch run"""
+    elapsed = max(elapsed, 1e-9)
+    print(f"{Fore.MAGENTA}{totals['debates']} debates ({totals['failed']} failed), {totals['turns']} turns in {elapsed:.1f} seconds: "
+          f"{totals['debates'] / elapsed * 3600:.1f} debates per hour, "
+          f"{totals['predicted_tokens'] / elapsed:.1f} generated tokens per second, "
+          f"{totals['prompt_tokens'] / elapsed:.1f} prompt tokens per second{Style.RESET_ALL}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Debate between agents with different viewpoints, moderated by a supervisor.")
+    parser.add_argument("--config", help="JSON debate config, or {\"debates\": [...]}; the nuclear debate by default")
+    parser.add_argument("--rounds", type=int, help="exchanges after the opening statement, overriding the config")
+    parser.add_argument("--repeat", type=int, default=1, help="times each debate is run; more than one debate runs in batch mode")
+    parser.add_argument("--concurrency", type=int, default=DEBATE_CONCURRENCY, help="debates run at the same time in batch mode")
+    parser.add_argument("--max-in-flight", type=int, default=MAX_REQUESTS_IN_FLIGHT, help="model requests running at once in batch mode")
+    parser.add_argument("--transcript", default=TRANSCRIPT_PATH, help="JSON lines file batch transcripts are appended to")
+    parser.add_argument("--pace", type=float, default=DISPLAY_PACE, help="seconds to pause after each supervisor comment")
+    parser.add_argument("--sequential", action="store_true", help="run one model call at a time within a debate")
+    parser.add_argument("--trace", metavar="PATH", help="record a span per debate and per model call and write a Chrome/Perfetto trace on exit")
+    parser.add_argument("--prometheus", metavar="PATH", help="write counters and latency histograms in the Prometheus text format on exit")
+    args = parser.parse_args()
+    
+    if args.trace or args.prometheus:
+        enable_instrumentation(args.trace, args.prometheus)
+    
+    debates = load_debates(args.config) if args.config else [DEFAULT_DEBATE]
+    if args.rounds is not None:
+        debates = [{**debate, "rounds": args.rounds} for debate in debates]
+    
+    # One model handle for every agent; each agent keeps its own history
+    model = lms.llm()
+    start_time = time.perf_counter()
+    
+    if len(debates) * args.repeat > 1:
+        totals = asyncio.run(run_debates(debates, model, args.repeat, args.concurrency, args.max_in_flight,
+                                         args.transcript, args.sequential))
+        print_throughput(totals, time.perf_counter() - start_time)
+    else:
+        debate = debates[0]
+        debaters, supervisor = make_agents(debate, model)
+        
+        print(f"\n{debate.get('title', '=== ' + debate['topic'] + ' ===')}\n")
+        if supervisor is not None and debate["supervisor"].get("welcome"):
+            print(f"{supervisor.color}{supervisor.label}: \"{debate['supervisor']['welcome']}\"{Style.RESET_ALL}\n")
+        
+        turns = build_debate(debate, debaters, supervisor)
+        asyncio.run(run_debate(turns, supervisor, args.pace, args.sequential))
+        elapsed = time.perf_counter() - start_time
+        
+        print(debate.get("ending", "==="))
+        print(f"{Fore.MAGENTA}{len(turns)} model calls in {elapsed:.1f} seconds ({elapsed / max(1, debate['rounds']):.1f} s per round){Style.RESET_ALL}")
+        for agent in debaters + ([supervisor] if supervisor else []):
+            agent.report()
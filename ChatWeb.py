@@ -3,118 +3,1194 @@ import time
 import colorama
 from colorama import Fore, Style
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from html.parser import HTMLParser
+import codecs
 import numpy as np
+import os
+import re
+import hashlib
+import argparse
+import json
+import sys
+import sqlite3
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from instrumentation import span, traced, count, enable as enable_instrumentation
 
 # Initialize colorama
 colorama.init()
 
-# Initialize LLM model
-chat_model = lms.llm() # Initializes the language model from LM Studio.
-
-# Try to initialize embedding model
-try:
-    embedding_model = lms.embedding_model("nomic-embed-text-v1.5") # Initializes the embedding model.
-    embeddings_available = True
-    print(f"{Fore.GREEN}Embedding model initialized successfully{Style.RESET_ALL}")
-except Exception as e:
-    embeddings_available = False
-    print(f"{Fore.YELLOW}Unable to initialize embedding model: {str(e)}{Style.RESET_ALL}")
-    print(f"{Fore.YELLOW}You can install an embedding model with: lms get nomic-ai/nomic-embed-text-v1.5{Style.RESET_ALL}")
-
-def fetch_webpage_content(url):
-    """Fetch and parse webpage content using BeautifulSoup"""
+# Page fetch configuration
+FETCH_TIMEOUT = 15                    # Seconds to wait for the server to connect or send more data
+FETCH_MAX_BYTES = 5 * 1024 * 1024     # Pages are truncated after this many bytes
+FETCH_READ_SIZE = 64 * 1024           # Bytes read from the connection at a time
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Chunking configuration
+CHUNK_MAX_TOKENS = 1024     # Upper bound on chunk size, in embedding model tokens
+CHUNK_OVERLAP_TOKENS = 128  # Trailing sentences carried over into the next chunk
+CHARS_PER_TOKEN = 4         # Used to approximate token counts without a tokenizer round-trip
+
+# Embedding pipeline configuration
+EMBED_BATCH_SIZE = 32      # Most chunks per embed() call; smaller pages are split so every worker gets a batch
+EMBED_MAX_IN_FLIGHT = 4    # Embedding calls allowed to run concurrently
+EMBED_MAX_RETRIES = 3      # Attempts per batch before it is given up
+EMBED_RETRY_DELAY = 0.5    # Seconds before the first retry, doubled on each attempt
+
+# Persistent embedding cache configuration
+EMBEDDING_MODEL_KEY = "nomic-embed-text-v1.5"
+EMBED_CACHE_DIR = ".embedding_cache"
+EMBED_CACHE_MAX_ENTRIES = 100000  # Vectors kept on disk before the least recently used are evicted
+EMBED_CACHE_GROW_ENTRIES = 4096   # Slots added to the vector file each time it fills up (12 MB at 768 dimensions)
+
+# Corpus index configuration
+INDEX_MODE = "ivf"            # "ivf" for approximate search, "exact" for brute force
+IVF_MIN_VECTORS = 4096        # Below this many chunks the index always searches exactly
+IVF_LISTS_PER_SQRT = 4        # Inverted lists per square root of the number of chunks
+IVF_PROBE_FRACTION = 1 / 16   # Share of inverted lists scanned per query
+IVF_TRAIN_ITERATIONS = 8      # k-means iterations when (re)building the lists
+IVF_RETRAIN_GROWTH = 0.25     # Rebuild once untrained chunks exceed this share of the index
+CORPUS_FETCH_WORKERS = 4      # Pages downloaded at the same time when loading a corpus
+
+# Chat history configuration
+HISTORY_TOKEN_BUDGET = 3072  # Approximate tokens of past questions and answers re-sent each turn
+HISTORY_SUMMARIZE = False    # Fold turns that no longer fit into a rolling digest instead of dropping them
+
+# In-memory memoization of repeated questions
+QUERY_EMBED_MEMO_SIZE = 256  # Query embeddings remembered per session
+ANSWER_CACHE_ENABLED = True  # Reuse answers to a question already asked with the same context
+ANSWER_CACHE_SIZE = 128      # Answers remembered per session
+
+# Retrieval configuration
+RETRIEVAL_MODE = "hybrid"     # "hybrid" fuses BM25 and embedding scores, "vector" uses embeddings only, "lexical" uses BM25 only, with no model call
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+BM25_K1 = 1.2                 # Term frequency saturation
+BM25_B = 0.75                 # Chunk length normalization
+HYBRID_CANDIDATES = 50        # Best chunks taken from each side before fusing
+HYBRID_LEXICAL_WEIGHT = 0.3   # Share of the fused score given to the BM25 score, scaled to the best one
+LEXICAL_PREFILTER = False     # In hybrid mode, only score the BM25 candidates by similarity instead of also running a vector search
+TERM_PATTERN = re.compile(r"\w+")
+
+chat_model = None
+embedding_model = None
+embeddings_available = False
+embedding_cache = None
+chunk_max_tokens = CHUNK_MAX_TOKENS
+
+class LRUCache:
+    """Small bounded mapping that forgets its least recently used entries"""
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        """Return the value stored under key, or None"""
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def put(self, key, value):
+        """Store value under key, evicting the oldest entry when full"""
+        if self.max_size <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+query_embedding_memo = LRUCache(QUERY_EMBED_MEMO_SIZE)
+answer_cache = LRUCache(ANSWER_CACHE_SIZE)
+
+def normalize_query(query):
+    """Normalize a question so trivially different spellings share cache entries"""
+    return ' '.join(query.casefold().split())
+
+def init_models():
+    """Initialize the chat model and, if possible, the embedding model"""
+    global chat_model, embedding_model, embeddings_available, embedding_cache, chunk_max_tokens
+    
+    # Initialize LLM model
+    chat_model = lms.llm() # Initializes the language model from LM Studio.
+    
+    # Try to initialize embedding model
     try:
-        print(f"{Fore.CYAN}Retrieving page content: {url}{Style.RESET_ALL}")
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        response = requests.get(url, headers=headers)
+        embedding_model = lms.embedding_model(EMBEDDING_MODEL_KEY) # Initializes the embedding model.
+        embeddings_available = True
+        embedding_cache = EmbeddingCache(EMBED_CACHE_DIR, EMBEDDING_MODEL_KEY)
+        try:
+            # Keep a margin because chunk sizes are only approximated
+            chunk_max_tokens = min(CHUNK_MAX_TOKENS, embedding_model.get_context_length() * 3 // 4)
+        except Exception:
+            chunk_max_tokens = CHUNK_MAX_TOKENS
+        print(f"{Fore.GREEN}Embedding model initialized successfully{Style.RESET_ALL}")
+    except Exception as e:
+        embeddings_available = False
+        print(f"{Fore.YELLOW}Unable to initialize embedding model: {str(e)}{Style.RESET_ALL}")
+        print(f"{Fore.YELLOW}You can install an embedding model with: lms get nomic-ai/nomic-embed-text-v1.5{Style.RESET_ALL}")
+        print(f"{Fore.YELLOW}Falling back to keyword (BM25) search{Style.RESET_ALL}")
+
+# One pooled session so repeated fetches reuse their connections
+http_session = requests.Session()
+http_session.headers['User-Agent'] = USER_AGENT
+http_session.mount('http://', HTTPAdapter(pool_connections=8, pool_maxsize=8))
+http_session.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=8))
+
+class TextExtractor(HTMLParser):
+    """Incremental HTML parser that collects the page title and content text
+    
+    Text is kept when it sits inside a paragraph, heading, list item, article
+    or section, and is emitted exactly once however deeply those are nested.
+    Text inside scripts, styles and similar elements is skipped.
+    
+    Block elements are tracked on a stack of open elements. An end tag also
+    closes whatever was left open inside its element, and a <p> or <li> whose
+    end tag is omitted, as HTML5 allows, is closed when a sibling or another
+    block starts, so the text after it is not taken for content. A table
+    only breaks a <p> into separate fragments: the paragraph resumes after it.
+    """
+    
+    CONTENT_TAGS = {'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'article', 'section'}
+    SKIPPED_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'head'}
+    BLOCK_TAGS = CONTENT_TAGS | {'div', 'br', 'ul', 'ol', 'table', 'tr', 'td', 'th', 'blockquote', 'pre', 'main', 'header', 'footer', 'nav', 'aside'}
+    STACKED_TAGS = (BLOCK_TAGS | SKIPPED_TAGS) - {'br'}
+    P_CLOSING_TAGS = BLOCK_TAGS - {'br', 'table', 'tr', 'td', 'th'}  # Starting one of these ends an open <p>
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = None
+        self.open_tags = []
+        self.content_depth = 0
+        self.skip_depth = 0
+        self.in_title = False
+        self.title_parts = []
+        self.pending = []
+        self.fragments = []
+    
+    def find_open(self, tag, boundaries=()):
+        """Index of the innermost open tag, or None if it is not open inside the nearest boundary element"""
+        for index in range(len(self.open_tags) - 1, -1, -1):
+            if self.open_tags[index] == tag:
+                return index
+            if self.open_tags[index] in boundaries:
+                return None
+        return None
+    
+    def close_from(self, index):
+        """Close the open element at index and every element still open inside it"""
+        if index is None:
+            return
+        while len(self.open_tags) > index:
+            tag = self.open_tags.pop()
+            if tag in self.SKIPPED_TAGS:
+                self.skip_depth -= 1
+            elif tag in self.CONTENT_TAGS:
+                self.content_depth -= 1
+    
+    def handle_starttag(self, tag, attrs):
+        if tag == 'title':
+            self.in_title = True
+        if tag in self.BLOCK_TAGS:
+            self.flush()
+        if tag == 'body' and 'head' in self.open_tags:
+            self.close_from(self.find_open('head'))
+        if tag not in self.STACKED_TAGS:
+            return
+        # Membership tests first: usually nothing is left open that needs closing
+        if tag in self.P_CLOSING_TAGS and 'p' in self.open_tags:
+            self.close_from(self.find_open('p', ('table', 'td', 'th')))
+        if tag == 'li' and 'li' in self.open_tags:
+            self.close_from(self.find_open('li', ('ul', 'ol')))
+        self.open_tags.append(tag)
+        if tag in self.SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag in self.CONTENT_TAGS:
+            self.content_depth += 1
+    
+    def handle_endtag(self, tag):
+        if tag == 'title' and self.in_title:
+            self.in_title = False
+            if self.title is None:
+                self.title = ' '.join(''.join(self.title_parts).split()) or None
+        if tag in self.BLOCK_TAGS:
+            self.flush()
+        if tag in self.STACKED_TAGS and tag in self.open_tags:
+            self.close_from(self.find_open(tag))
+    
+    def handle_data(self, data):
+        if self.in_title:
+            self.title_parts.append(data)
+        elif self.content_depth and not self.skip_depth:
+            self.pending.append(data)
+    
+    def flush(self):
+        """Turn the text gathered since the last block boundary into one fragment"""
+        if self.pending:
+            text = ' '.join(''.join(self.pending).split())
+            self.pending = []
+            if text:
+                self.fragments.append(text)
+    
+    def pop_fragments(self):
+        """Return and forget the fragments extracted so far"""
+        fragments = self.fragments
+        self.fragments = []
+        return fragments
+
+def detect_encoding(content_type, head):
+    """Pick the page encoding from the Content-Type header or a <meta> charset"""
+    for source in (content_type or '', head[:4096].decode('ascii', errors='ignore')):
+        match = re.search(r'charset=["\']?([A-Za-z0-9_.:-]+)', source, re.IGNORECASE)
+        if match:
+            try:
+                return codecs.lookup(match.group(1)).name
+            except LookupError:
+                pass
+    return 'utf-8'
+
+def stream_webpage_text(url, page, max_bytes=FETCH_MAX_BYTES, timeout=FETCH_TIMEOUT):
+    """Download a page and yield its content text fragments as they are parsed
+    
+    The body is read in FETCH_READ_SIZE pieces and never held in full. Reading
+    stops after max_bytes. The page dict is filled in with the title, the
+    number of bytes read and whether the page was truncated.
+    """
+    page.update(title=None, bytes=0, truncated=False)
+    with http_session.get(url, stream=True, timeout=timeout) as response:
         response.raise_for_status()
+        extractor = TextExtractor()
+        decoder = None
+        for block in response.iter_content(chunk_size=FETCH_READ_SIZE):
+            if not block:
+                continue
+            if page['bytes'] + len(block) > max_bytes:
+                block = block[:max_bytes - page['bytes']]
+                page['truncated'] = True
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(detect_encoding(response.headers.get('Content-Type'), block))(errors='replace')
+            page['bytes'] += len(block)
+            extractor.feed(decoder.decode(block))
+            if page['title'] is None:
+                page['title'] = extractor.title
+            yield from extractor.pop_fragments()
+            if page['truncated']:
+                break
+        if decoder is not None:
+            extractor.feed(decoder.decode(b'', final=True))
+        extractor.close()
+        extractor.flush()
+        page['title'] = extractor.title
+        yield from extractor.pop_fragments()
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+def approx_token_count(text):
+    """Estimate the number of tokens in text without calling a tokenizer"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+class TextChunks:
+    """Chunks of a text, stored as (start, end) character spans into it
+    
+    Indexing returns the chunk text, which is only sliced out of the original
+    text when it is asked for (to be embedded or put into a prompt).
+    """
+    
+    def __init__(self, text, spans):
+        self.text = text
+        self.spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+        self._lexical = None
+    
+    def __len__(self):
+        return len(self.spans)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        start, end = self.spans[index]
+        return self.text[start:end]
+    
+    def __iter__(self):
+        for start, end in self.spans:
+            yield self.text[start:end]
+    
+    def lexical_index(self):
+        """The BM25 index of these chunks, built on first use"""
+        if self._lexical is None:
+            self._lexical = LexicalIndex.build(self)
+        return self._lexical
+
+def iter_sentence_spans(fragments, count_tokens=approx_token_count):
+    """Yield (start, end, tokens) for each sentence of the fragments
+    
+    Offsets refer to the fragments joined with single spaces, and the end of
+    a fragment always ends a sentence.
+    """
+    offset = 0
+    for fragment in fragments:
+        start = 0
+        for match in SENTENCE_END.finditer(fragment):
+            yield offset + start, offset + match.start(), count_tokens(fragment[start:match.start()])
+            start = match.end()
+        if start < len(fragment):
+            yield offset + start, offset + len(fragment), count_tokens(fragment[start:])
+        offset += len(fragment) + 1
+
+def split_long_sentence(start, end, tokens, max_tokens):
+    """Cut a sentence that is too long for one chunk into evenly sized pieces"""
+    pieces = -(-tokens // max_tokens)
+    step = -(-(end - start) // pieces)
+    for piece_start in range(start, end, step):
+        piece_end = min(piece_start + step, end)
+        yield piece_start, piece_end, -(-tokens * (piece_end - piece_start) // (end - start))
+
+def iter_chunk_spans(sentences, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Group sentence spans into overlapping (start, end) chunk spans of at most max_tokens
+    
+    Chunks break only between sentences, unless a single sentence is too long
+    on its own. Each chunk starts with the trailing sentences of the previous
+    one, up to overlap_tokens. Only the sentences of the current chunk are
+    held in memory.
+    """
+    window = deque()
+    window_tokens = 0
+    new_sentences = 0
+    
+    def pieces():
+        for start, end, tokens in sentences:
+            if tokens > max_tokens:
+                yield from split_long_sentence(start, end, tokens, max_tokens)
+            else:
+                yield start, end, tokens
+    
+    for sentence in pieces():
+        if window and window_tokens + sentence[2] > max_tokens:
+            yield window[0][0], window[-1][1]
+            new_sentences = 0
+            # Carry the tail of this chunk over, leaving room for the new sentence
+            carried = 0
+            keep = 0
+            for _, _, tokens in reversed(window):
+                if carried + tokens > overlap_tokens or carried + tokens + sentence[2] > max_tokens:
+                    break
+                carried += tokens
+                keep += 1
+            while len(window) > keep:
+                window_tokens -= window.popleft()[2]
+        window.append(sentence)
+        window_tokens += sentence[2]
+        new_sentences += 1
+    
+    if window and new_sentences:
+        yield window[0][0], window[-1][1]
+
+def chunk_text(text, max_tokens=None, overlap_tokens=CHUNK_OVERLAP_TOKENS, count_tokens=approx_token_count):
+    """Split text into overlapping, sentence-aligned chunks for embedding"""
+    spans = iter_chunk_spans(iter_sentence_spans([text], count_tokens), max_tokens or chunk_max_tokens, overlap_tokens)
+    return TextChunks(text, list(spans))
+
+def terms(text):
+    """Lowercased words of a text, as indexed and queried by LexicalIndex"""
+    return TERM_PATTERN.findall(text.casefold())
+
+class LexicalIndex:
+    """BM25 inverted index over chunks, with postings stored in flat arrays
+    
+    Each term maps to an id, and the postings of term t are the slices
+    offsets[t]:offsets[t + 1] of two arrays holding the chunk ids (int32) and
+    the term's count in each chunk (float32), so the index costs eight bytes
+    per distinct term in a chunk. A query gathers the postings of its terms
+    and sums their BM25 contributions per chunk with one bincount, with no
+    model call. Indexes of several pages are merged with add(); the merged
+    arrays are rebuilt on the next query.
+    """
+    
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.postings = np.empty(0, dtype=np.int32)
+        self.counts = np.empty(0, dtype=np.float32)
+        self.lengths = np.empty(0, dtype=np.float32)
+        self.pending = []
+    
+    @classmethod
+    def build(cls, chunks, k1=BM25_K1, b=BM25_B):
+        """Index an iterable of chunk texts; chunk ids are their positions"""
+        index = cls(k1, b)
+        vocabulary = index.vocabulary
+        term_ids = []
+        chunk_ids = []
+        counts = []
+        lengths = []
+        for chunk_id, chunk in enumerate(chunks):
+            chunk_terms = terms(chunk)
+            lengths.append(len(chunk_terms))
+            for term, occurrences in Counter(chunk_terms).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                chunk_ids.append(chunk_id)
+                counts.append(occurrences)
+        index._set_postings(np.asarray(term_ids, dtype=np.int64), np.asarray(chunk_ids, dtype=np.int32),
+                            np.asarray(counts, dtype=np.float32), np.asarray(lengths, dtype=np.float32))
+        return index
+    
+    def _set_postings(self, term_ids, chunk_ids, counts, lengths):
+        order = np.argsort(term_ids, kind="stable")
+        self.postings = chunk_ids[order]
+        self.counts = counts[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(self.vocabulary)))])
+        self.lengths = lengths
+    
+    def _term_ids(self):
+        """Term id of every posting, in posting order"""
+        return np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+    
+    def __len__(self):
+        return len(self.lengths) + sum(len(index) for index in self.pending)
+    
+    def add(self, other):
+        """Append another index's chunks, whose ids continue after this index's"""
+        self.pending.append(other)
+    
+    def _consolidate(self):
+        if not self.pending:
+            return
+        term_ids = [self._term_ids()]
+        chunk_ids = [self.postings]
+        counts = [self.counts]
+        lengths = [self.lengths]
+        first_chunk = len(self.lengths)
+        for other in self.pending:
+            other._consolidate()
+            # Map the other index's term ids onto this vocabulary
+            mapping = np.empty(len(other.vocabulary), dtype=np.int64)
+            for term, term_id in other.vocabulary.items():
+                mapping[term_id] = self.vocabulary.setdefault(term, len(self.vocabulary))
+            term_ids.append(mapping[other._term_ids()])
+            chunk_ids.append(other.postings + np.int32(first_chunk))
+            counts.append(other.counts)
+            lengths.append(other.lengths)
+            first_chunk += len(other.lengths)
+        self.pending = []
+        self._set_postings(np.concatenate(term_ids), np.concatenate(chunk_ids), np.concatenate(counts), np.concatenate(lengths))
+    
+    def scores(self, query):
+        """BM25 score of every chunk for the query, zero for chunks sharing no term with it"""
+        self._consolidate()
+        n = len(self.lengths)
+        term_ids = [self.vocabulary[term] for term in set(terms(query)) if term in self.vocabulary]
+        if not term_ids or not n:
+            return np.zeros(n, dtype=np.float64)
+        starts = self.offsets[term_ids]
+        ends = self.offsets[np.asarray(term_ids) + 1]
+        frequencies = ends - starts
+        idf = np.log1p((n - frequencies + 0.5) / (frequencies + 0.5))
+        chunk_ids = np.concatenate([self.postings[start:end] for start, end in zip(starts, ends)])
+        counts = np.concatenate([self.counts[start:end] for start, end in zip(starts, ends)])
+        average_length = max(float(self.lengths.mean()), 1.0)
+        norms = self.k1 * (1 - self.b + self.b * self.lengths[chunk_ids] / average_length)
+        weights = np.repeat(idf, frequencies) * counts * (self.k1 + 1) / (counts + norms)
+        return np.bincount(chunk_ids, weights=weights, minlength=n)
+    
+    def search(self, query, top_k=3):
+        """Return [(chunk_id, score)] for the top_k chunks matching the query, best first"""
+        scores = self.scores(query)
+        return [(int(i), float(scores[i])) for i in top_k_indices(scores, top_k) if scores[i] > 0]
+
+def retrieve(query, lexical, vector_search=None, vector_scores=None, top_k=3, mode=RETRIEVAL_MODE, prefilter=LEXICAL_PREFILTER):
+    """Rank chunks for a query, returning [(chunk_id, score)] best first
+    
+    vector_search(k) returns the k most similar [(chunk_id, similarity)] and
+    vector_scores(ids) the similarities of the given chunk ids; they are None
+    without embeddings, which leaves BM25 alone. In hybrid mode the best
+    HYBRID_CANDIDATES chunks of each side are fused into
+    (1 - w) * similarity + w * bm25 / best_bm25. With prefilter, only the
+    BM25 candidates are scored by similarity, as long as there are at least
+    top_k of them.
+    """
+    if mode == "lexical" or vector_search is None:
+        return lexical.search(query, top_k)
+    if mode == "vector":
+        return vector_search(top_k)
+    
+    # BM25 runs once; its candidates are the best matching chunks of the same scores used for fusion
+    lexical_scores = lexical.scores(query)
+    lexical_ids = top_k_indices(lexical_scores, HYBRID_CANDIDATES)
+    lexical_ids = lexical_ids[lexical_scores[lexical_ids] > 0]
+    if prefilter and len(lexical_ids) >= top_k:
+        ids = lexical_ids
+    else:
+        vector_ids = [chunk_id for chunk_id, _ in vector_search(HYBRID_CANDIDATES)]
+        ids = np.union1d(lexical_ids, np.asarray(vector_ids, dtype=np.intp))
+    if not len(ids):
+        return []
+    
+    candidate_lexical = lexical_scores[ids]
+    best_lexical = candidate_lexical.max()
+    if best_lexical > 0:
+        candidate_lexical = candidate_lexical / best_lexical
+    fused = (1 - HYBRID_LEXICAL_WEIGHT) * vector_scores(ids) + HYBRID_LEXICAL_WEIGHT * candidate_lexical
+    return [(int(ids[i]), float(fused[i])) for i in top_k_indices(fused, top_k)]
+
+def load_webpage(url):
+    """Fetch a page and chunk it as it streams in, returning (title, content, chunks)"""
+    try:
+        print(f"{Fore.CYAN}Retrieving page content: {url}{Style.RESET_ALL}")
+        page = {}
+        fragments = []
         
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Extract title
-        title = soup.title.string if soup.title else "Untitled page"
-        
-        # Extract text from paragraphs, headers and other content elements
-        content_elements = soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'article', 'section'])
-        content = ' '.join([elem.get_text().strip() for elem in content_elements])
+        def collect():
+            for fragment in stream_webpage_text(url, page):
+                fragments.append(fragment)
+                yield fragment
         
-        # Clean up content (remove extra spaces, newlines)
-        content = ' '.join(content.split())
+        # Chunk boundaries are found while the page is still downloading
+        with span("fetch", "fetch", url=url) as fetch:
+            spans = list(iter_chunk_spans(iter_sentence_spans(collect()), chunk_max_tokens))
+            fetch.set(bytes=page['bytes'], chunks=len(spans))
+        content = ' '.join(fragments)
+        chunks = TextChunks(content, spans)
+        chunks.lexical_index() # Indexed for BM25 along with chunking, on the loading thread.
+        title = page['title'] or "Untitled page"
         
+        if page['truncated']:
+            print(f"{Fore.YELLOW}Page truncated after {page['bytes']} bytes{Style.RESET_ALL}")
         print(f"{Fore.GREEN}Content retrieved: {len(content)} characters{Style.RESET_ALL}")
-        return title, content
-        
+        return title, content, chunks
+    
     except Exception as e:
         print(f"{Fore.RED}Error retrieving the page: {e}{Style.RESET_ALL}")
-        return None, None
+        return None, None, None
+
+def normalize_rows(matrix):
+    """Scale each row of a float32 matrix to unit length, in place"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
 
-def chunk_text(text, chunk_size=1000, overlap=200):
-    """Split text into overlapping chunks for embedding"""
-    words = text.split()
-    chunks = []
+def build_similarity_matrix(embeddings):
+    """Stack embeddings into a contiguous, row-normalized float32 matrix"""
+    matrix = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32))
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(embeddings), -1)
     
-    if len(words) <= chunk_size:
-        return [text]
+    # Normalize once here so a query only needs one matrix-vector product
+    return normalize_rows(matrix)
+
+class EmbeddingCache:
+    """On-disk, content-addressed store of normalized chunk embeddings
     
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk = ' '.join(words[i:i + chunk_size])
-        chunks.append(chunk)
+    Vectors live in a memory-mapped float32 file with one slot per entry, so
+    a lookup only pages in the rows it asks for. The file grows
+    EMBED_CACHE_GROW_ENTRIES slots at a time, up to max_entries, so it only
+    takes the space of the vectors stored. A small SQLite index maps
+    each key (a hash of the model name and the chunk text) to its slot and
+    records when it was last used, which drives LRU eviction once the cache
+    holds max_entries vectors.
+    """
     
-    return chunks
+    def __init__(self, cache_dir, model_name, max_entries=EMBED_CACHE_MAX_ENTRIES):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        
+        os.makedirs(cache_dir, exist_ok=True)
+        base_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name)
+        self.vectors_path = os.path.join(cache_dir, base_name + ".f32")
+        self.index = sqlite3.connect(os.path.join(cache_dir, base_name + ".sqlite"))
+        self.index.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.index.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.index.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.index.commit()
+        
+        meta = dict(self.index.execute("SELECT name, value FROM meta"))
+        self.dim = meta.get("dim")
+        self.next_slot = meta.get("next_slot", 0)
+        self.vectors = None
+        if self.dim is not None and os.path.exists(self.vectors_path):
+            self._open_vectors()
+    
+    def _open_vectors(self, slots=0):
+        """Map the vector file, first growing it to hold at least slots vectors"""
+        row_bytes = self.dim * np.dtype(np.float32).itemsize
+        capacity = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        if slots > capacity:
+            capacity = min(max(slots, capacity + EMBED_CACHE_GROW_ENTRIES), self.max_entries)
+            if self.vectors is not None:
+                self.vectors.flush()
+                self.vectors = None
+            with open(self.vectors_path, 'ab') as f:
+                f.truncate(capacity * row_bytes)
+        if capacity:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+    
+    def key(self, text):
+        """Return the cache key of a chunk of text for this cache's model"""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+    
+    def get_many(self, keys):
+        """Look up keys, returning {position in keys: vector} for every hit"""
+        found = {}
+        if self.vectors is not None:
+            wanted = {}
+            for position, key in enumerate(keys):
+                wanted.setdefault(key, []).append(position)
+            unique_keys = list(wanted)
+            slots = {}
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                slots.update(self.index.execute(f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", batch))
+            
+            # One fancy-indexed read pages in only the rows that were hit
+            hit_keys = list(slots)
+            rows = self.vectors[np.fromiter((slots[key] for key in hit_keys), dtype=np.int64, count=len(hit_keys))]
+            for key, vector in zip(hit_keys, rows):
+                for position in wanted[key]:
+                    found[position] = vector
+            
+            now = time.time()
+            self.index.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in hit_keys])
+            self.index.commit()
+        
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+    
+    def put_many(self, keys, vectors):
+        """Store normalized vectors under keys, evicting the least recently used entries if full"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[-1]
+            self.index.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('dim', ?)", (self.dim,))
+        elif vectors.shape[-1] != self.dim:
+            return
+        
+        new_items = {}
+        for key, vector in zip(keys, vectors):
+            new_items.setdefault(key, vector)
+        existing = set()
+        unique_keys = list(new_items)
+        for start in range(0, len(unique_keys), 500):
+            batch = unique_keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            existing.update(key for (key,) in self.index.execute(f"SELECT key FROM entries WHERE key IN ({placeholders})", batch))
+        new_keys = [key for key in unique_keys if key not in existing][:self.max_entries]
+        if not new_keys:
+            return
+        
+        # Fresh slots first, then the slots of the least recently used entries
+        slots = list(range(self.next_slot, min(self.next_slot + len(new_keys), self.max_entries)))
+        self.next_slot += len(slots)
+        shortfall = len(new_keys) - len(slots)
+        if shortfall:
+            evicted = self.index.execute("SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (shortfall,)).fetchall()
+            self.index.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+            slots.extend(slot for _, slot in evicted)
+        if self.vectors is None or self.next_slot > len(self.vectors):
+            self._open_vectors(self.next_slot)
+        
+        now = time.time()
+        for key, slot in zip(new_keys, slots):
+            self.vectors[slot] = new_items[key]
+        self.vectors.flush()
+        self.index.executemany("INSERT INTO entries (key, slot, last_used) VALUES (?, ?, ?)", [(key, slot, now) for key, slot in zip(new_keys, slots)])
+        self.index.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('next_slot', ?)", (self.next_slot,))
+        self.index.commit()
 
-def create_embeddings(chunks):
-    """Create embeddings for each text chunk"""
-    if not embeddings_available:
+def embed_batch(model, batch, max_retries=EMBED_MAX_RETRIES, retry_delay=EMBED_RETRY_DELAY):
+    """Embed a list of texts in one embed() call, retrying the whole batch on failure"""
+    for attempt in range(max_retries):
+        try:
+            with span("embed_batch", "model", texts=len(batch), attempt=attempt):
+                vectors = model.embed(batch) # Generates one embedding per text in the batch.
+            if len(vectors) != len(batch):
+                raise ValueError(f"expected {len(batch)} embeddings, got {len(vectors)}")
+            return vectors
+        except Exception:
+            if attempt == max_retries - 1:
+                raise
+            time.sleep(retry_delay * (2 ** attempt))
+
+@traced("embedding")
+def create_embeddings(chunks, model=None, batch_size=EMBED_BATCH_SIZE, max_in_flight=EMBED_MAX_IN_FLIGHT, max_retries=EMBED_MAX_RETRIES, cache=None):
+    """Create embeddings for the text chunks, returned as a similarity matrix
+    
+    Chunks already in the embedding cache are read from it; the rest are sent
+    in batches, with at most max_in_flight batches running at once. The
+    lmstudio SDK still sends one request per text of a batch, one after the
+    other, so batches are made no larger than an even share of the missing
+    chunks: a small page is then spread over every worker instead of running
+    as a single batch. Each batch is written into its rows of the matrix (and
+    the cache) as soon as it arrives. A batch that still fails after its retries leaves zero rows
+    behind, which never rank above a real match, instead of losing the page.
+    """
+    if model is None:
+        if not embeddings_available:
+            return None
+        model = embedding_model
+        if cache is None:
+            cache = embedding_cache
+    if not chunks:
         return None
     
-    embeddings = []
+    matrix = None
+    missing = list(range(len(chunks)))
+    keys = None
+    if cache is not None:
+        keys = [cache.key(chunk) for chunk in chunks]
+        cached = cache.get_many(keys)
+        if cached:
+            matrix = np.zeros((len(chunks), cache.dim), dtype=np.float32)
+            for position, vector in cached.items():
+                matrix[position] = vector
+            missing = [i for i in range(len(chunks)) if i not in cached]
+        print(f"{Fore.CYAN}Embedding cache: {len(cached)} hits, {len(missing)} misses{Style.RESET_ALL}")
+    if not missing:
+        return matrix
+    
+    max_in_flight = max(1, max_in_flight)
+    batch_size = max(1, min(batch_size, -(-len(missing) // max_in_flight)))
+    batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+    failed_batches = 0
+    
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        futures = {
+            pool.submit(embed_batch, model, [chunks[i] for i in batch], max_retries): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                vectors = np.asarray(future.result(), dtype=np.float32)
+            except Exception as e:
+                failed_batches += 1
+                print(f"{Fore.YELLOW}Error creating embeddings for chunks {batch[0]}-{batch[-1]}: {str(e)}{Style.RESET_ALL}")
+                continue
+            
+            if matrix is None:
+                # The first batch to arrive tells us the embedding dimension
+                matrix = np.zeros((len(chunks), vectors.shape[-1]), dtype=np.float32)
+            rows = normalize_rows(vectors.reshape(len(batch), -1))
+            matrix[batch] = rows
+            if cache is not None:
+                cache.put_many([keys[i] for i in batch], rows)
+    
+    if failed_batches:
+        print(f"{Fore.YELLOW}{failed_batches} of {len(futures)} embedding batches failed{Style.RESET_ALL}")
+    return matrix
+
+def top_k_indices(scores, top_k):
+    """Return the indices of the top_k highest scores, best first"""
+    k = min(top_k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < len(scores):
+        # argpartition is O(n); only the k selected scores get fully sorted
+        candidates = np.argpartition(scores, len(scores) - k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+class VectorIndex:
+    """Shared vector index over the chunks of many pages
+    
+    Every chunk keeps a reference to the page it came from. In "ivf" mode the
+    vectors are clustered with spherical k-means into inverted lists stored
+    contiguously, and a query scans only the lists whose centroids are
+    closest to it. Chunks added after the lists were built are scanned
+    exactly until there are enough of them to justify a rebuild. "exact" mode
+    scores every chunk and is the baseline the approximate search is
+    measured against.
+    
+    Without an embedding model, pages are added without embeddings and the
+    index is lexical_only: it is searched through its BM25 index alone.
+    """
+    
+    def __init__(self, mode=INDEX_MODE, probe_fraction=IVF_PROBE_FRACTION, seed=0):
+        if mode not in ("ivf", "exact"):
+            raise ValueError(f"unknown index mode: {mode}")
+        self.mode = mode
+        self.probe_fraction = probe_fraction
+        self.rng = np.random.default_rng(seed)
+        self.pages = []
+        self.blocks = []
+        self.vectors = None
+        self.chunk_page = np.empty(0, dtype=np.int32)
+        self.chunk_local = np.empty(0, dtype=np.int32)
+        self.centroids = None
+        self.list_vectors = None
+        self.list_ids = None
+        self.list_offsets = None
+        self.trained_count = 0
+        self.lexical = LexicalIndex()
+        self.lexical_pages = 0
+        self.lexical_only = False
+    
+    def __len__(self):
+        return len(self.chunk_page)
+    
+    def lexical_index(self):
+        """The BM25 index of every chunk, under the same chunk ids, extended with the pages added since the last call"""
+        for page in self.pages[self.lexical_pages:]:
+            chunks = page["chunks"]
+            self.lexical.add(chunks.lexical_index() if isinstance(chunks, TextChunks) else LexicalIndex.build(chunks))
+        self.lexical_pages = len(self.pages)
+        return self.lexical
+    
+    def scores(self, query_vector, chunk_ids):
+        """Similarity of the query to each of the given chunks"""
+        self._consolidate()
+        return self.vectors[chunk_ids] @ query_vector
+    
+    def add_page(self, url, title, chunks, embeddings):
+        """Add a page's chunks and their normalized embedding matrix, or None in a lexical_only index"""
+        if self.pages and (embeddings is None) != self.lexical_only:
+            raise ValueError("pages with and without embeddings cannot share an index")
+        self.lexical_only = embeddings is None
+        page_id = len(self.pages)
+        self.pages.append({"url": url, "title": title, "chunks": chunks})
+        if embeddings is not None:
+            self.blocks.append(np.asarray(embeddings, dtype=np.float32))
+        self.chunk_page = np.concatenate([self.chunk_page, np.full(len(chunks), page_id, dtype=np.int32)])
+        self.chunk_local = np.concatenate([self.chunk_local, np.arange(len(chunks), dtype=np.int32)])
+        return page_id
+    
+    def chunk(self, chunk_id):
+        """Return (text, url, title) for a chunk id returned by search"""
+        page = self.pages[self.chunk_page[chunk_id]]
+        return page["chunks"][self.chunk_local[chunk_id]], page["url"], page["title"]
+    
+    def _consolidate(self):
+        if self.blocks:
+            parts = ([self.vectors] if self.vectors is not None else []) + self.blocks
+            self.vectors = np.ascontiguousarray(np.concatenate(parts))
+            self.blocks = []
+    
+    def _assign(self, vectors, centroids):
+        # Blocked so the score matrix never gets large
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), 16384):
+            assignment[start:start + 16384] = np.argmax(vectors[start:start + 16384] @ centroids.T, axis=1)
+        return assignment
+    
+    def build(self):
+        """Cluster every vector into inverted lists (ivf mode only)"""
+        self._consolidate()
+        if self.mode != "ivf" or self.vectors is None or len(self.vectors) < IVF_MIN_VECTORS:
+            return
+        n = len(self.vectors)
+        n_lists = max(1, int(IVF_LISTS_PER_SQRT * np.sqrt(n)))
+        
+        # Train on a sample; assigning everything afterwards is one blocked pass
+        sample = self.vectors[self.rng.choice(n, size=min(n, n_lists * 32), replace=False)]
+        centroids = sample[self.rng.choice(len(sample), size=n_lists, replace=False)].copy()
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            assignment = self._assign(sample, centroids)
+            order = np.argsort(assignment, kind="stable")
+            counts = np.bincount(assignment, minlength=n_lists)
+            filled = counts > 0
+            sums = np.empty_like(centroids)
+            sums[filled] = np.add.reduceat(sample[order], (np.cumsum(counts) - counts)[filled])
+            sums[~filled] = sample[self.rng.choice(len(sample), size=int((~filled).sum()))]
+            centroids = normalize_rows(sums)
+        
+        assignment = self._assign(self.vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        self.centroids = centroids
+        self.list_ids = order
+        self.list_vectors = np.ascontiguousarray(self.vectors[order])
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+        self.trained_count = n
+    
+    def search(self, query_vector, top_k=3, exact=None):
+        """Return [(chunk_id, score)] for the top_k chunks, best first"""
+        self._consolidate()
+        if self.vectors is None or len(self.vectors) == 0:
+            return []
+        if exact is None:
+            exact = self.mode == "exact"
+        if not exact and self.mode == "ivf":
+            untrained = len(self.vectors) - self.trained_count
+            if len(self.vectors) >= IVF_MIN_VECTORS and untrained > IVF_RETRAIN_GROWTH * max(self.trained_count, 1):
+                self.build()
+            exact = self.centroids is None
+        
+        if exact:
+            scores = self.vectors @ query_vector
+            best = top_k_indices(scores, top_k)
+            return [(int(i), float(scores[i])) for i in best]
+        
+        n_probe = max(1, int(round(len(self.centroids) * self.probe_fraction)))
+        probes = top_k_indices(self.centroids @ query_vector, n_probe)
+        ids = [self.list_ids[self.list_offsets[p]:self.list_offsets[p + 1]] for p in probes]
+        scores = [self.list_vectors[self.list_offsets[p]:self.list_offsets[p + 1]] @ query_vector for p in probes]
+        
+        # Chunks added since the last build are not in any list yet
+        if self.trained_count < len(self.vectors):
+            ids.append(np.arange(self.trained_count, len(self.vectors)))
+            scores.append(self.vectors[self.trained_count:] @ query_vector)
+        ids = np.concatenate(ids)
+        scores = np.concatenate(scores)
+        best = top_k_indices(scores, top_k)
+        return [(int(ids[i]), float(scores[i])) for i in best]
+
+def embed_query(query, timings=None):
+    """Return the normalized embedding of a query, memoized by its normalized text"""
+    start = time.perf_counter()
+    key = normalize_query(query)
+    query_vector = query_embedding_memo.get(key)
+    if query_vector is None:
+        with span("embed_query", "model"):
+            query_embedding = embedding_model.embed(query) # Generates the embedding for the query.
+        query_vector = np.asarray(query_embedding, dtype=np.float32).ravel()
+        query_norm = np.linalg.norm(query_vector)
+        if query_norm > 0:
+            query_vector = query_vector / query_norm
+        query_embedding_memo.put(key, query_vector)
+    if timings is not None:
+        timings["query_embedding_s"] = time.perf_counter() - start
+    return query_vector
+
+def lazy_query_vector(query, timings=None):
+    """Return a function embedding the query on its first call, so BM25-only searches make no model call"""
+    query_vector = None
+    
+    def embedded():
+        nonlocal query_vector
+        if query_vector is None:
+            query_vector = embed_query(query, timings)
+            if not query_vector.any():
+                raise ValueError("the query embedding is empty")
+        return query_vector
+    return embedded
+
+def find_relevant_chunk_ids(query, chunks, embeddings, top_k=3, timings=None, mode=None):
+    """Return the indices of the chunks most relevant to the query, best first
+    
+    Chunks are ranked as RETRIEVAL_MODE (or mode) says. Without embeddings,
+    or when the query cannot be embedded, BM25 ranks them; the first chunks
+    only stand in when none shares a word with the query.
+    """
+    mode = mode or RETRIEVAL_MODE
+    fallback = list(range(min(top_k, len(chunks))))
+    lexical = chunks.lexical_index() if isinstance(chunks, TextChunks) else LexicalIndex.build(chunks)
+    if mode != "lexical" and embeddings_available and embeddings is not None and len(embeddings):
+        query_vector = lazy_query_vector(query, timings)
+        
+        # Rows are pre-normalized, so one product gives every cosine similarity
+        def vector_search(k):
+            similarities = embeddings @ query_vector()
+            return [(int(i), float(similarities[i])) for i in top_k_indices(similarities, k)]
+        
+        def vector_scores(ids):
+            return embeddings[ids] @ query_vector()
+    else:
+        vector_search = vector_scores = None
+    
     try:
-        for chunk in chunks:
-            embedding = embedding_model.embed(chunk) # Generates the embedding for the chunk.
-            embeddings.append(embedding)
-        return embeddings
+        ranked = retrieve(query, lexical, vector_search, vector_scores, top_k, mode, LEXICAL_PREFILTER)
     except Exception as e:
-        print(f"{Fore.YELLOW}Error creating embeddings: {str(e)}{Style.RESET_ALL}")
-        return None
+        print(f"{Fore.YELLOW}Error finding relevant chunks: {str(e)}, using keyword search{Style.RESET_ALL}")
+        ranked = lexical.search(query, top_k)
+    return [chunk_id for chunk_id, _ in ranked] or fallback
+
+def search_corpus(index, query, top_k=3, timings=None, mode=None):
+    """Return [(chunk_id, score)] for the chunks of a VectorIndex most relevant to the query, best first
+    
+    A lexical_only index is always searched by BM25, whatever the mode.
+    """
+    query_vector = lazy_query_vector(query, timings)
+    lexical = index.lexical_index()
+    mode = "lexical" if index.lexical_only else mode or RETRIEVAL_MODE
+    try:
+        return retrieve(query, lexical, lambda k: index.search(query_vector(), k),
+                        lambda ids: index.scores(query_vector(), ids), top_k, mode, LEXICAL_PREFILTER)
+    except Exception as e:
+        print(f"{Fore.YELLOW}Error finding relevant chunks: {str(e)}, using keyword search{Style.RESET_ALL}")
+        return lexical.search(query, top_k)
 
 def find_relevant_chunks(query, chunks, embeddings, top_k=3):
     """Find the most relevant chunks to the query using embedding similarity"""
-    if not embeddings_available or not embeddings:
-        # If embeddings are not available, use the first chunks
-        return chunks[:min(top_k, len(chunks))]
+    return [chunks[i] for i in find_relevant_chunk_ids(query, chunks, embeddings, top_k)]
+
+class ChatHistory:
+    """Token-budgeted chat history for the web agent
     
-    try:
-        # Create embedding for the query
-        query_embedding = embedding_model.embed(query) # Generates the embedding for the query.
+    Only the current question is sent with its retrieved page content. Older
+    turns keep just the question and the answer, and the oldest of them are
+    dropped (or folded into a rolling digest) once they no longer fit in
+    token_budget. The prompt sent each turn therefore stays roughly the same
+    size however long the session runs.
+    """
+    
+    def __init__(self, system_prompt, token_budget=HISTORY_TOKEN_BUDGET, summarize=None):
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.turns = deque()
+        self.turn_tokens = 0
+        self.digest = None
+    
+    def build_chat(self, prompt):
+        """Return an lms.Chat with the compacted history followed by prompt"""
+        system_prompt = self.system_prompt
+        if self.digest:
+            system_prompt += f"\n\nSummary of the earlier conversation: {self.digest}"
+        chat = lms.Chat(system_prompt)
+        for question, answer, _ in self.turns:
+            chat.add_user_message(question)
+            chat.add_assistant_response(answer)
+        chat.add_user_message(prompt)
+        return chat
+    
+    def history_tokens(self):
+        """Approximate tokens of everything except the current prompt"""
+        return approx_token_count(self.system_prompt) + approx_token_count(self.digest or "") + self.turn_tokens
+    
+    def add_turn(self, question, answer):
+        """Record a finished turn, without its retrieved context, and compact"""
+        tokens = approx_token_count(question) + approx_token_count(answer)
+        self.turns.append((question, answer, tokens))
+        self.turn_tokens += tokens
         
-        # Calculate similarity with each chunk
-        similarities = []
-        for emb in embeddings:
-            # Convert to numpy arrays
-            query_array = np.array(query_embedding).reshape(1, -1)
-            chunk_array = np.array(emb).reshape(1, -1)
+        evicted = []
+        while len(self.turns) > 1 and self.history_tokens() > self.token_budget:
+            evicted.append(self.turns.popleft())
+            self.turn_tokens -= evicted[-1][2]
+        if evicted and self.summarize is not None:
+            try:
+                self.digest = self.summarize(self.digest, [(question, answer) for question, answer, _ in evicted])
+            except Exception as e:
+                print(f"{Fore.YELLOW}Could not summarize earlier turns: {str(e)}{Style.RESET_ALL}")
+
+def summarize_turns(digest, turns):
+    """Fold dropped turns into the rolling digest with one model call"""
+    transcript = "\n".join(f"Q: {question}\nA: {answer}" for question, answer in turns)
+    chat = lms.Chat("You condense conversations into short factual summaries.")
+    chat.add_user_message(f"""Current summary: {digest or "(none)"}
+
+Add the key facts from these exchanges to the summary. Reply with the updated summary only, in at most 150 words.
+
+{transcript}""")
+    with span("summarize", "model") as call:
+        result = chat_model.respond(chat)
+        call.record_stats(result.stats)
+    return result.content.strip()
+
+def new_chat_history(system_prompt):
+    """Create the history used by the chat loops, honoring HISTORY_SUMMARIZE"""
+    return ChatHistory(system_prompt, summarize=summarize_turns if HISTORY_SUMMARIZE else None)
+
+def answer_question(web_chat, user_query, relevant_context, answer_key, turn):
+    """Ask the question with its retrieved context and stream the answer to the terminal
+    
+    Returns the full response text. The turn dict receives the estimated
+    prompt size, time to first token, generation speed and token counts.
+    """
+    # Create the prompt with the relevant context
+    prompt = f"""To answer this question, use the following content extracted from the web page:
             
-            # Calculate cosine similarity
-            dot_product = np.dot(query_array, chunk_array.T)[0][0]
-            query_norm = np.linalg.norm(query_array)
-            chunk_norm = np.linalg.norm(chunk_array)
-            similarity = dot_product / (query_norm * chunk_norm)
+            {relevant_context}
             
-            similarities.append(similarity)
-        
-        # Get top k chunks
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
-        return [chunks[i] for i in top_indices]
+            Question: {user_query}"""
     
-    except Exception as e:
-        print(f"{Fore.YELLOW}Error finding relevant chunks: {str(e)}{Style.RESET_ALL}")
-        return chunks[:min(top_k, len(chunks))]
+    # The same question over the same retrieved context gets the same answer
+    response = answer_cache.get(answer_key) if ANSWER_CACHE_ENABLED else None
+    turn["cache_hit"] = response is not None
+    count("answer_cache_total", result="hit" if turn["cache_hit"] else "miss")
+    
+    # Get the agent's response
+    chat = web_chat.build_chat(prompt) # Compacted history plus this question and its context.
+    turn["history_tokens"] = web_chat.history_tokens()
+    turn["prompt_tokens_estimate"] = turn["history_tokens"] + approx_token_count(prompt)
+    print(f"{Fore.BLUE}Web Agent: {Style.RESET_ALL}", end="", flush=True)
+    if response is None:
+        start = time.perf_counter()
+        first_token = None
+        with span("respond", "model") as call:
+            stream = chat_model.respond_stream(chat) # Streams the response from the LM Studio model.
+            for fragment in stream:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                sys.stdout.write(fragment.content)
+                sys.stdout.flush()
+            generation_s = time.perf_counter() - start - (first_token or 0)
+            result = stream.result()
+            call.record_stats(result.stats)
+            call.set(time_to_first_token_s=first_token)
+        response = result.content
+        
+        stats = result.stats
+        turn["time_to_first_token_s"] = first_token
+        turn["prompt_tokens"] = stats.prompt_tokens_count
+        turn["predicted_tokens"] = stats.predicted_tokens_count
+        if stats.tokens_per_second is not None:
+            turn["tokens_per_second"] = stats.tokens_per_second
+        elif stats.predicted_tokens_count and generation_s > 0:
+            turn["tokens_per_second"] = stats.predicted_tokens_count / generation_s
+        if ANSWER_CACHE_ENABLED:
+            answer_cache.put(answer_key, response)
+    else:
+        sys.stdout.write(response)
+    print("\n")
+    web_chat.add_turn(user_query, response) # Keeps the question and answer, but not the retrieved context.
+    return response
+
+def print_turn_metrics(turn):
+    """Print the timing breakdown of one question"""
+    parts = [f"total {turn['total_s']:.2f}s", f"retrieval {turn['retrieval_s']:.3f}s"]
+    if turn.get("query_embedding_s") is not None:
+        parts.append(f"query embedding {turn['query_embedding_s']:.3f}s")
+    if turn.get("time_to_first_token_s") is not None:
+        parts.append(f"first token {turn['time_to_first_token_s']:.2f}s")
+    if turn.get("tokens_per_second") is not None:
+        parts.append(f"{turn['tokens_per_second']:.1f} tokens/s")
+    cache_status = "cache hit" if turn["cache_hit"] else "cache miss"
+    print(Fore.MAGENTA + f"Response time: {' | '.join(parts)} ({cache_status})" + Style.RESET_ALL + "\n")
 
-def chat_with_web_agent():
+def summarize_session(turns):
+    """Aggregate per-turn metrics into a session summary"""
+    summary = {"questions": len(turns), "cache_hits": sum(1 for turn in turns if turn["cache_hit"])}
+    for name in ("retrieval_s", "query_embedding_s", "time_to_first_token_s", "tokens_per_second", "total_s"):
+        values = [turn[name] for turn in turns if turn.get(name) is not None]
+        if values:
+            summary[name] = {
+                "mean": float(np.mean(values)),
+                "p50": float(np.percentile(values, 50)),
+                "p95": float(np.percentile(values, 95)),
+            }
+    return summary
+
+def finish_session(turns, metrics_path=None):
+    """Print the session summary and export the metrics if a path was given"""
+    if not turns:
+        return
+    summary = summarize_session(turns)
+    print(Fore.MAGENTA + f"Session: {summary['questions']} questions, {summary['cache_hits']} answered from cache" + Style.RESET_ALL)
+    for name in ("retrieval_s", "time_to_first_token_s", "total_s"):
+        if name in summary:
+            print(Fore.MAGENTA + f"  {name}: mean {summary[name]['mean']:.3f}, p50 {summary[name]['p50']:.3f}, p95 {summary[name]['p95']:.3f}" + Style.RESET_ALL)
+    if metrics_path:
+        with open(metrics_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "turns": turns}, f, indent=2)
+        print(Fore.MAGENTA + f"Session metrics written to {metrics_path}" + Style.RESET_ALL)
+
+def chat_with_web_agent(metrics_path=None):
     """
     Interactive chat with a web-aware agent that can discuss webpage content.
     """
+    init_models()
+    
     print(Fore.GREEN + "=== CHAT WITH WEB AGENT ===" + Style.RESET_ALL)
     print(Fore.YELLOW + "To begin, enter a URL to analyze." + Style.RESET_ALL)
     print(Fore.YELLOW + "Type 'exit' to quit or 'new' to load a new URL." + Style.RESET_ALL)
@@ -124,12 +1200,15 @@ def chat_with_web_agent():
     chunks = None
     embeddings = None
     web_chat = None
+    page_hash = None
+    turns = []
     
     while True:
         if not url:
             user_input = input(Fore.CYAN + "URL: " + Style.RESET_ALL)
             
             if user_input.lower() == "exit":
+                finish_session(turns, metrics_path)
                 print(Fore.GREEN + "\nThank you for using the web agent. Goodbye!" + Style.RESET_ALL)
                 break
             
@@ -138,18 +1217,17 @@ def chat_with_web_agent():
             
             # Try to fetch the webpage
             url = user_input
-            title, content = fetch_webpage_content(url) # Fetches the content of the webpage.
+            title, content, chunks = load_webpage(url) # Fetches and chunks the content of the webpage.
             
             if not content:
                 url = None
                 continue
             
-            # Create chunks and embeddings
-            print(f"{Fore.CYAN}Preparing content for analysis...{Style.RESET_ALL}")
-            chunks = chunk_text(content) # Divides the content into smaller chunks.
+            page_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
             print(f"{Fore.CYAN}Content divided into {len(chunks)} segments{Style.RESET_ALL}")
             
-            if embeddings_available:
+            # Create embeddings, unless BM25 alone ranks the chunks
+            if embeddings_available and RETRIEVAL_MODE != "lexical":
                 print(f"{Fore.CYAN}Creating embeddings...{Style.RESET_ALL}")
                 embeddings = create_embeddings(chunks) # Creates embeddings for each chunk.
                 print(f"{Fore.CYAN}Embeddings created successfully{Style.RESET_ALL}")
@@ -160,7 +1238,7 @@ def chat_with_web_agent():
             Provide accurate and helpful information based solely on the available content.
             If you cannot find the information in the content, be honest about it."""
             
-            web_chat = lms.Chat(system_prompt) # Initializes the chat session with a system prompt.
+            web_chat = new_chat_history(system_prompt) # Initializes the chat session with a system prompt.
             
             # Welcome message
             print(f"{Fore.GREEN}Web page loaded: \"{title}\"{Style.RESET_ALL}")
@@ -171,6 +1249,7 @@ def chat_with_web_agent():
             user_query = input(Fore.CYAN + "You: " + Style.RESET_ALL)
             
             if user_query.lower() == "exit":
+                finish_session(turns, metrics_path)
                 print(Fore.GREEN + "\nThank you for using the web agent. Goodbye!" + Style.RESET_ALL)
                 break
             
@@ -180,35 +1259,138 @@ def chat_with_web_agent():
                 chunks = None
                 embeddings = None
                 web_chat = None
+                page_hash = None
                 print(Fore.YELLOW + "Enter a new URL to analyze:" + Style.RESET_ALL)
                 continue
             
             # Find relevant chunks based on the query
-            start_time = time.time()
-            
-            # Get relevant context based on the query
-            relevant_chunks = find_relevant_chunks(user_query, chunks, embeddings) # Finds the most relevant chunks for the user query.
-            relevant_context = "\n\n".join(relevant_chunks)
-            
-            # Create the prompt with the relevant context
-            prompt = f"""To answer this question, use the following content extracted from the web page:
-            
-            {relevant_context}
-            
-            Question: {user_query}"""
+            turn = {"question": user_query}
+            start_time = time.perf_counter()
             
-            # Get the agent's response
-            web_chat.add_user_message(prompt) # Adds the user's message to the chat session.
-            response = chat_model.respond(web_chat) # Gets the response from the LM Studio model.
-            web_chat.add_assistant_response(response) # Adds the assistant's response to the chat session.
-            
-            end_time = time.time()
-            
-            # Print the agent's response
-            print(f"{Fore.BLUE}Web Agent: {Style.RESET_ALL}{response}\n")
+            with span("question", "task"):
+                # Get relevant context based on the query
+                relevant_ids = find_relevant_chunk_ids(user_query, chunks, embeddings, timings=turn) # Finds the most relevant chunks for the user query.
+                relevant_context = "\n\n".join(chunks[i] for i in relevant_ids)
+                turn["retrieval_s"] = time.perf_counter() - start_time
+                
+                answer_key = (page_hash, tuple(relevant_ids), normalize_query(user_query))
+                answer_question(web_chat, user_query, relevant_context, answer_key, turn)
             
             # Print the response time
-            print(Fore.MAGENTA + f"Response time: {end_time - start_time:.2f} seconds" + Style.RESET_ALL + "\n")
+            turn["total_s"] = time.perf_counter() - start_time
+            turns.append(turn)
+            print_turn_metrics(turn)
+
+def read_url_list(sources):
+    """Expand a mix of URLs and URL list files (one URL per line, # for comments)"""
+    urls = []
+    for source in sources:
+        if os.path.isfile(source):
+            with open(source, encoding="utf-8") as f:
+                urls.extend(line.strip() for line in f if line.strip() and not line.lstrip().startswith("#"))
+        else:
+            urls.append(source)
+    return list(dict.fromkeys(urls))
+
+def add_pages_to_index(index, urls):
+    """Fetch, chunk and embed pages concurrently, adding each one to the index
+    
+    Without an embedding model, or in "lexical" retrieval mode, pages are
+    added unembedded, for BM25 search only.
+    """
+    embed = embeddings_available and RETRIEVAL_MODE != "lexical"
+    added = 0
+    with ThreadPoolExecutor(max_workers=CORPUS_FETCH_WORKERS) as pool:
+        for url, (title, content, chunks) in zip(urls, pool.map(load_webpage, urls)):
+            if not content:
+                continue
+            embeddings = create_embeddings(chunks) if embed else None # Creates embeddings for each chunk.
+            if embeddings is None and embed:
+                print(f"{Fore.YELLOW}Skipping {url}: no embeddings{Style.RESET_ALL}")
+                continue
+            index.add_page(url, title, chunks, embeddings)
+            added += 1
+    # Once the lists exist, new chunks are scanned exactly until search() finds they justify a retrain
+    if index.centroids is None:
+        index.build()
+    return added
+
+def chat_with_corpus(sources, index_mode=INDEX_MODE, metrics_path=None):
+    """
+    Interactive chat over a corpus of many webpages sharing one vector index.
+    """
+    init_models()
+    
+    print(Fore.GREEN + "=== CHAT WITH WEB CORPUS ===" + Style.RESET_ALL)
+    if not embeddings_available:
+        print(f"{Fore.YELLOW}No embedding model: pages will be searched by keyword (BM25) only{Style.RESET_ALL}")
+    
+    index = VectorIndex(index_mode)
+    add_pages_to_index(index, read_url_list(sources))
+    if not len(index):
+        print(f"{Fore.RED}No pages could be loaded.{Style.RESET_ALL}")
+        return
+    
+    system_prompt = """You are an intelligent web assistant that has analyzed a collection of web pages.
+    You answer user questions about the content of these web pages, citing the title and URL of the pages you use.
+    Provide accurate and helpful information based solely on the available content.
+    If you cannot find the information in the content, be honest about it."""
+    web_chat = new_chat_history(system_prompt) # Initializes the chat session with a system prompt.
+    
+    index_label = "BM25 index" if index.lexical_only else f"{index_mode} index"
+    print(f"{Fore.GREEN}Corpus loaded: {len(index.pages)} pages, {len(index)} segments ({index_label}){Style.RESET_ALL}")
+    print(f"{Fore.YELLOW}Ask your questions about these pages. Type 'add <url or file>' to add pages or 'exit' to quit.{Style.RESET_ALL}")
+    
+    turns = []
+    while True:
+        user_query = input(Fore.CYAN + "You: " + Style.RESET_ALL)
+        
+        if user_query.lower() == "exit":
+            finish_session(turns, metrics_path)
+            print(Fore.GREEN + "\nThank you for using the web agent. Goodbye!" + Style.RESET_ALL)
+            break
+        
+        if user_query.lower().startswith("add "):
+            added = add_pages_to_index(index, read_url_list(user_query[4:].split()))
+            print(f"{Fore.GREEN}{added} pages added, corpus now has {len(index.pages)} pages and {len(index)} segments{Style.RESET_ALL}")
+            continue
+        
+        turn = {"question": user_query}
+        start_time = time.perf_counter()
+        
+        with span("question", "task"):
+            # Retrieve the best chunks across every page, with their sources
+            hits = search_corpus(index, user_query, timings=turn)
+            relevant_context = "\n\n".join(
+                f"[{title} - {url}]\n{text}" for text, url, title in (index.chunk(chunk_id) for chunk_id, _ in hits)
+            )
+            turn["retrieval_s"] = time.perf_counter() - start_time
+            
+            corpus_key = tuple(page["url"] for page in index.pages)
+            answer_key = (corpus_key, tuple(chunk_id for chunk_id, _ in hits), normalize_query(user_query))
+            answer_question(web_chat, user_query, relevant_context, answer_key, turn)
+        
+        turn["total_s"] = time.perf_counter() - start_time
+        turns.append(turn)
+        print_turn_metrics(turn)
 
 if __name__ == "__main__":
-    chat_with_web_agent()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Chat with a web page, or with a corpus of pages.")
+    parser.add_argument("--corpus", nargs="+", metavar="URL_OR_FILE", help="URLs or URL list files to load into one shared index")
+    parser.add_argument("--index", choices=["ivf", "exact"], default=INDEX_MODE, help="corpus index type")
+    parser.add_argument("--retrieval", choices=RETRIEVAL_MODES, default=RETRIEVAL_MODE, help="how chunks are ranked: BM25 and embeddings fused, embeddings only, or BM25 only")
+    parser.add_argument("--prefilter", action="store_true", default=LEXICAL_PREFILTER, help="in hybrid mode, only score the BM25 candidates by embedding similarity")
+    parser.add_argument("--metrics-out", metavar="PATH", help="write per-question timings and a session summary as JSON on exit")
+    parser.add_argument("--trace", metavar="PATH", help="record spans for every fetch and model call and write a Chrome/Perfetto trace on exit")
+    parser.add_argument("--prometheus", metavar="PATH", help="write counters and latency histograms in the Prometheus text format on exit")
+    args = parser.parse_args()
+    
+    if args.trace or args.prometheus:
+        enable_instrumentation(args.trace, args.prometheus)
+    RETRIEVAL_MODE = args.retrieval
+    LEXICAL_PREFILTER = args.prefilter
+    
+    if args.corpus:
+        chat_with_corpus(args.corpus, args.index, args.metrics_out)
+    else:
+        chat_with_web_agent(args.metrics_out)
\ No newline at end of file
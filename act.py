@@ -4,24 +4,52 @@ import colorama
 from colorama import Fore, Style
 import json
 import re
+import time
+import argparse
+import functools
+import threading
+from message_renderer import MessageRenderer
+from instrumentation import span, traced, record_round, enable as enable_instrumentation
+from tool_runner import ToolRunner, pure
 
 # Initialize colorama
 colorama.init()
 
+# Game configuration
+NUMBERS = (25, 100, 1, 7, 5, 2, 8)
+TARGET = 254
+SOLVER_MODE = "precheck"     # "precheck": solve locally, the model only verifies; "tool": the model may call the solver; "off": the model searches alone
+SOLVER_MODES = ("precheck", "tool", "off")
+
+# Budget configuration
+MAX_PREDICTION_ROUNDS = 8    # Model round-trips act() may use, None for no limit
+MAX_TOOL_CALLS = 16          # Tool calls answered before the tools refuse, None for no limit
+MAX_PARALLEL_TOOL_CALLS = 4  # Tool calls of one round run at the same time
+
+MESSAGE_OUTPUT = "text"  # How agent messages are shown: "text", "quiet", or "jsonl" for logs
+
+@pure
+@traced("tool")
 def addition(a: int, b: int) -> int:
     """Given two integer values a and b as input parameters, this function computes and returns their arithmetic sum (a + b) as an integer value."""
     return a + b
 
+@pure
+@traced("tool")
 def substraction(a: int, b: int) -> int:
     """Given two integer values a and b as input parameters, this function computes and returns their arithmetic difference (a - b) as an integer value."""
     if a < b:
         raise ValueError("substraction result is negative")
     return a - b
 
+@pure
+@traced("tool")
 def multiplication(a: int, b: int) -> int:
     """Given two integer values a and b as input parameters, this function computes and returns their arithmetic product (a * b) as an integer value."""
     return a * b
 
+@pure
+@traced("tool")
 def division(a: int, b: int) -> int:
     """Given two integer values a and b as input parameters, this function computes and returns their arithmetic quotient (a / b) as an integer value. If b equals zero, a ValueError exception is raised to prevent division by zero. If the division does not result in an integer value, a ValueError exception is raised."""
     if b == 0:
@@ -30,60 +58,226 @@ def division(a: int, b: int) -> int:
         raise ValueError("Division must result in an integer")
     return a // b
 
-def format_message(message):
-    """Format the message in a more readable way"""
-    try:
-        # Simple string representation for any message type
-        if hasattr(message, 'role'):
-            role = message.role
-            if role == 'assistant':
-                print(f"{Fore.CYAN}Assistant thinking:{Style.RESET_ALL}")
-                # Try to get text content
-                if hasattr(message, 'content') and len(message.content) > 0:
-                    for item in message.content:
-                        if hasattr(item, 'text') and item.text:
-                            print(f"{item.text}\n")
-            
-            elif role == 'tool':
-                print(f"{Fore.YELLOW}Tool result:{Style.RESET_ALL}")
-                if hasattr(message, 'content') and len(message.content) > 0:
-                    print(message.content[0].content)
+OPERATION_TOOLS = {"+": "addition", "-": "substraction", "*": "multiplication", "/": "division"}
+
+class NumbersSolution:
+    """The expression a solver found, and the steps to compute it"""
+    
+    def __init__(self, target, value, expression, steps, numbers_used):
+        self.target = target
+        self.value = value
+        self.expression = expression
+        self.steps = steps
+        self.numbers_used = numbers_used
+    
+    @property
+    def exact(self):
+        return self.value == self.target
+    
+    def __str__(self):
+        if self.exact:
+            return f"{self.expression} = {self.value}"
+        return f"{self.expression} = {self.value} (closest to {self.target}, off by {abs(self.value - self.target)})"
+
+@functools.lru_cache(maxsize=64)
+def _solve_numbers(numbers, target):
+    count = len(numbers)
+    # reachable[mask] maps each value the numbers in mask can make to how it was made:
+    # None for a number itself, else (operator, mask, value, mask, value) of the two halves
+    reachable = [None] * (1 << count)
+    best = None
+    
+    # Smaller subsets first, so every split of a subset is already known and an exact
+    # answer uses as few numbers as possible
+    for mask in sorted(range(1, 1 << count), key=lambda mask: bin(mask).count("1")):
+        if mask & (mask - 1) == 0:
+            values = {numbers[mask.bit_length() - 1]: None}
         else:
-            # Print any other message types in a simplified way
-            print(f"{Fore.WHITE}Message: {message}{Style.RESET_ALL}")
+            values = {}
+            part = (mask - 1) & mask
+            while part:
+                rest = mask ^ part
+                if part < rest:  # Each split once; both operand orders are tried below
+                    for a in reachable[part]:
+                        for b in reachable[rest]:
+                            if a < b:
+                                made = (rest, b, part, a)
+                                big, small = b, a
+                            else:
+                                made = (part, a, rest, b)
+                                big, small = a, b
+                            values.setdefault(big + small, ("+",) + made)
+                            values.setdefault(big * small, ("*",) + made)
+                            if big != small:
+                                values.setdefault(big - small, ("-",) + made)
+                            if small and big % small == 0:
+                                values.setdefault(big // small, ("/",) + made)
+                part = (part - 1) & mask
+        reachable[mask] = values
+        
+        for value in values:
+            if best is None or abs(value - target) < abs(best[1] - target):
+                best = (mask, value)
+        if best[1] == target:
+            break
     
-    except Exception as e:
-        print(f"{Fore.RED}Error formatting message: {str(e)}{Style.RESET_ALL}")
-        print(f"{Fore.WHITE}Raw message: {str(message)[:100]}...{Style.RESET_ALL}")
+    steps = []
+    
+    def expression(mask, value, top=False):
+        made = reachable[mask][value]
+        if made is None:
+            return str(value)
+        operator, left_mask, left, right_mask, right = made
+        text = f"{expression(left_mask, left)} {operator} {expression(right_mask, right)}"
+        steps.append((OPERATION_TOOLS[operator], left, right, value))
+        return text if top else f"({text})"
+    
+    mask, value = best
+    text = expression(mask, value, top=True)
+    return NumbersSolution(target, value, text, steps, bin(mask).count("1"))
+
+def solve_numbers(numbers, target):
+    """Find how to make target from numbers, each used at most once, or the closest value that can be made
     
-    # Return None to prevent default printing
-    return None
+    Every subset of the numbers is solved once, from the values its two
+    halves can make, so the search covers all expressions without repeating
+    work. Results are cached per game.
+    """
+    return _solve_numbers(tuple(numbers), target)
 
-print(f"\n{Fore.MAGENTA}=== NUMBERS GAME CHALLENGE ==={Style.RESET_ALL}")
-print(f"{Fore.BLUE}Target: 254, Using numbers: 25, 100, 1, 7, 5, 2, 8{Style.RESET_ALL}\n")
+@pure
+@traced("tool")
+def solve_numbers_game(numbers: list[int], target: int) -> str:
+    """Given a list of integer numbers and an integer target, this function searches every way of combining the numbers with addition, substraction, multiplication and division, each number used at most once, and returns the expression that makes the target, or the closest one it found, with the steps to compute it."""
+    solution = solve_numbers(numbers, target)
+    steps = "; ".join(f"{name}({a}, {b}) = {value}" for name, a, b, value in solution.steps)
+    return f"{solution}. Steps: {steps}"
 
-# Create model and set up functions
-model = lms.llm()
+class ToolBudget:
+    """Counts tool calls and refuses them once max_calls is used up
+    
+    Wrapped tools keep their name, docstring and parameters, so act() sees
+    the same tools. A refused call raises, which act() reports back to the
+    model as the tool's result, telling it to answer with what it has.
+    """
+    
+    def __init__(self, max_calls=MAX_TOOL_CALLS):
+        self.max_calls = max_calls
+        self.calls = 0
+        self.refused = 0
+        self.lock = threading.Lock()  # act() runs the calls of one round on parallel threads
+    
+    def wrap(self, tool):
+        @functools.wraps(tool)
+        def limited(*args, **kwargs):
+            with self.lock:
+                if self.max_calls is not None and self.calls >= self.max_calls:
+                    self.refused += 1
+                    raise RuntimeError(f"Tool call budget of {self.max_calls} calls is used up, give your final answer now")
+                self.calls += 1
+            return tool(*args, **kwargs)
+        return limited
 
-try:
-    # Use a more specific prompt that works better with the current model
-    prompt = """
-    The Numbers Game: I need to get exactly 254 using these numbers: 25, 100, 1, 7, 5, 2, and 8.
+def build_prompt(numbers, target, solution=None):
+    """Return the game prompt, asking the model to verify the solution when there is one"""
+    listed = ", ".join(str(number) for number in numbers[:-1]) + f", and {numbers[-1]}"
+    prompt = f"""
+    The Numbers Game: I need to get exactly {target} using these numbers: {listed}.
     I can use addition, substraction, multiplication, and division.
     Each number can only be used once, but I don't have to use all numbers.
-    Think step by step and use tools to verify calculations.
     """
+    if solution is None:
+        return prompt + "Think step by step and use tools to verify calculations.\n"
     
-    result = model.act(
-        prompt,
-        [addition, substraction, multiplication, division],
-        on_message=format_message
-    )
+    steps = "\n".join(f"    - {name}({a}, {b}) = {value}" for name, a, b, value in solution.steps)
+    found = "reaches the target" if solution.exact else f"is the closest reachable value, {solution.value}"
+    return prompt + f"""A solver found that {solution.expression} {found}, in these steps:
+{steps}
+    Verify the steps with the tools, requesting them all at once, then state the final expression and its value.
+    Do not search for another solution.
+    """
+
+# Every tool is pure, so results are shared across rounds and games; a round's calls run in parallel
+tool_runner = ToolRunner(max_workers=MAX_PARALLEL_TOOL_CALLS)
+
+def play(model, numbers=NUMBERS, target=TARGET, solver_mode=SOLVER_MODE, max_rounds=MAX_PREDICTION_ROUNDS,
+         max_tool_calls=MAX_TOOL_CALLS, max_parallel_tool_calls=MAX_PARALLEL_TOOL_CALLS, on_message=None):
+    """Play one game with act() and return its counters: rounds, tool calls, tokens and time"""
+    if solver_mode not in SOLVER_MODES:
+        raise ValueError(f"Unknown solver mode '{solver_mode}', expected one of {', '.join(SOLVER_MODES)}")
+    counters = {"rounds": 0, "tool_calls": 0, "refused_tool_calls": 0, "prompt_tokens": 0, "predicted_tokens": 0}
     
-    print(f"\n{Fore.GREEN}Final result: {result}{Style.RESET_ALL}")
+    start_time = time.perf_counter()
+    with span("solve", "solver", numbers=str(numbers), target=target):
+        solution = solve_numbers(numbers, target) if solver_mode == "precheck" else None
+    counters["solver_ms"] = round((time.perf_counter() - start_time) * 1000, 3)
+    if solution is not None:
+        counters["solution"] = str(solution)
+    
+    tools = [addition, substraction, multiplication, division]
+    if solver_mode == "tool":
+        tools.append(solve_numbers_game)
+    budget = ToolBudget(max_tool_calls)
+    
+    def completed(round_result):
+        stats = round_result.stats
+        counters["prompt_tokens"] += stats.prompt_tokens_count or 0
+        counters["predicted_tokens"] += stats.predicted_tokens_count or 0
+        record_round(stats)
+    
+    with span("game", "task", solver_mode=solver_mode) as game:
+        result = model.act(
+            build_prompt(numbers, target, solution),
+            [budget.wrap(tool_runner.wrap(tool)) for tool in tools],
+            max_prediction_rounds=max_rounds,
+            max_parallel_tool_calls=max_parallel_tool_calls,
+            on_message=on_message,
+            on_prediction_completed=completed
+        )
+        game.set(rounds=result.rounds, tool_calls=budget.calls)
+    counters["rounds"] = result.rounds
+    counters["tool_calls"] = budget.calls
+    counters["refused_tool_calls"] = budget.refused
+    counters["seconds"] = round(time.perf_counter() - start_time, 3)
+    return counters
 
-except Exception as e:
-    print(f"\n{Fore.RED}An error occurred: {str(e)}{Style.RESET_ALL}")
-    print(f"{Fore.YELLOW}Try using a different model or updating the LMStudio SDK.{Style.RESET_ALL}")
 
-print(f"\n{Fore.MAGENTA}=== CALCULATION COMPLETE ==={Style.RESET_ALL}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve a Numbers Game with act() and arithmetic tools.")
+    parser.add_argument("--numbers", type=int, nargs="+", default=list(NUMBERS))
+    parser.add_argument("--target", type=int, default=TARGET)
+    parser.add_argument("--solver", choices=SOLVER_MODES, default=SOLVER_MODE, help="how the local solver is used")
+    parser.add_argument("--max-rounds", type=int, default=MAX_PREDICTION_ROUNDS, help="model round-trips act() may use")
+    parser.add_argument("--max-tool-calls", type=int, default=MAX_TOOL_CALLS, help="tool calls answered before the tools refuse")
+    parser.add_argument("--trace", metavar="PATH", help="record spans for the game, model rounds and tool calls and write a Chrome/Perfetto trace on exit")
+    parser.add_argument("--prometheus", metavar="PATH", help="write counters and latency histograms in the Prometheus text format on exit")
+    args = parser.parse_args()
+    
+    if args.trace or args.prometheus:
+        enable_instrumentation(args.trace, args.prometheus)
+    
+    render_message = MessageRenderer(MESSAGE_OUTPUT)
+    
+    print(f"\n{Fore.MAGENTA}=== NUMBERS GAME CHALLENGE ==={Style.RESET_ALL}")
+    print(f"{Fore.BLUE}Target: {args.target}, Using numbers: {', '.join(str(number) for number in args.numbers)}{Style.RESET_ALL}\n")
+    
+    # Create model and set up functions
+    model = lms.llm()
+    
+    try:
+        counters = play(model, args.numbers, args.target, args.solver, args.max_rounds, args.max_tool_calls,
+                        on_message=render_message)
+        render_message.flush()
+        
+        if "solution" in counters:
+            print(f"\n{Fore.GREEN}Solver: {counters['solution']} (found in {counters['solver_ms']} ms){Style.RESET_ALL}")
+        print(f"{Fore.MAGENTA}{counters['rounds']} model round-trips, {counters['tool_calls']} tool calls "
+              f"({counters['refused_tool_calls']} refused), {counters['prompt_tokens']} prompt tokens, "
+              f"{counters['predicted_tokens']} generated tokens in {counters['seconds']} seconds{Style.RESET_ALL}")
+        tool_runner.report()
+    
+    except Exception as e:
+        print(f"\n{Fore.RED}An error occurred: {str(e)}{Style.RESET_ALL}")
+        print(f"{Fore.YELLOW}Try using a different model or updating the LMStudio SDK.{Style.RESET_ALL}")
+    
+    print(f"\n{Fore.MAGENTA}=== CALCULATION COMPLETE ==={Style.RESET_ALL}")
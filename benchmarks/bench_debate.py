@@ -0,0 +1,161 @@
+"""Time a 3Agents.py debate run one call at a time against the concurrent graph.
+
+The three agents talk to a fake model that streams a short answer after a
+configured time to first token, with a limited number of requests served
+at once (LM Studio's parallel slots). The original script also slept two
+seconds per round; that is reported separately, since neither run sleeps.
+
+A second, longer debate with no latency compares prompt size per call and
+peak Python memory with windowed agent histories against histories that
+keep every exchange, as the original script did.
+
+A batch run then plays --debates debates at once, with model requests
+capped at --slots, and reports debates per hour and generated tokens per
+second; the transcript goes to a temporary file.
+
+    python benchmarks/bench_debate.py --rounds 5 --latency 0.2 --slots 2 --history-rounds 50 --debates 20
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+spec = importlib.util.spec_from_file_location("three_agents", os.path.join(ROOT, "3Agents.py"))
+three_agents = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(three_agents)
+
+ORIGINAL_SLEEP_PER_ROUND = 2.0
+
+
+class FakeStream:
+    """Yields an answer word by word, then returns it from result()"""
+
+    def __init__(self, model, words):
+        self.model = model
+        self.words = words
+
+    def __iter__(self):
+        with self.model.slots:
+            time.sleep(self.model.latency)
+            for i, word in enumerate(self.words):
+                time.sleep(1 / self.model.words_per_second)
+                yield SimpleNamespace(content=(" " if i else "") + word)
+
+    def result(self):
+        return SimpleNamespace(content=" ".join(self.words),
+                               stats=SimpleNamespace(prompt_tokens_count=None, predicted_tokens_count=len(self.words)))
+
+
+class FakeModel:
+    """Streams a fixed-length answer after a time to first token"""
+
+    def __init__(self, latency, words_per_second, words, slots):
+        self.latency = latency
+        self.words_per_second = words_per_second
+        self.words = words
+        self.slots = threading.Semaphore(slots)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = []
+
+    def respond_stream(self, chat):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+            # Characters of the serialized chat, as a rough token count
+            self.prompt_tokens.append(len(str(chat)) // 4)
+        return FakeStream(self, [f"mot{call}-{i}" for i in range(self.words)])
+
+
+def run(args, sequential):
+    model = FakeModel(args.latency, args.words_per_second, args.words, args.slots)
+    debate = {**three_agents.DEFAULT_DEBATE, "rounds": args.rounds}
+    debaters, supervisor = three_agents.make_agents(debate, model)
+    turns = three_agents.build_debate(debate, debaters, supervisor)
+    out = io.StringIO()
+    start = time.perf_counter()
+    asyncio.run(three_agents.run_debate(turns, supervisor, sequential=sequential, out=out))
+    elapsed = time.perf_counter() - start
+    return {"mode": "sequential" if sequential else "concurrent", "calls": model.calls, "seconds": round(elapsed, 3),
+            "seconds_per_round": round(elapsed / args.rounds, 3)}, out.getvalue()
+
+
+def run_history(args, windowed):
+    """Run a long debate with no latency and measure prompt size and peak memory"""
+    model = FakeModel(0.0, 1e9, args.words, 3)
+    debate = {**three_agents.DEFAULT_DEBATE, "rounds": args.history_rounds}
+    debaters, supervisor = three_agents.make_agents(debate, model)
+    if not windowed:
+        for agent in debaters + [supervisor]:
+            agent.max_exchanges = None
+    turns = three_agents.build_debate(debate, debaters, supervisor)
+    tracemalloc.start()
+    asyncio.run(three_agents.run_debate(turns, supervisor, out=io.StringIO()))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tokens = model.prompt_tokens
+    per_round = 4
+    return {"history": "windowed" if windowed else "unbounded", "calls": model.calls,
+            "prompt_tokens_first_rounds": round(sum(tokens[1:1 + 5 * per_round]) / (5 * per_round)),
+            "prompt_tokens_last_rounds": round(sum(tokens[-1 - 5 * per_round:-1]) / (5 * per_round)),
+            "prompt_tokens_max": max(tokens), "prompt_tokens_total": sum(tokens), "peak_kb": peak // 1024}
+
+
+def run_batch(args):
+    """Run many debates at once and report throughput"""
+    model = FakeModel(args.latency, args.words_per_second, args.words, args.slots)
+    debate = {**three_agents.DEFAULT_DEBATE, "rounds": args.rounds}
+    with tempfile.TemporaryDirectory() as folder:
+        transcript = os.path.join(folder, "debates.jsonl")
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # Progress lines would break the JSON report
+            totals = asyncio.run(three_agents.run_debates([debate], model, repeat=args.debates, concurrency=args.debates,
+                                                          max_in_flight=args.slots, transcript_path=transcript))
+        elapsed = time.perf_counter() - start
+        with open(transcript, encoding="utf-8") as f:
+            lines = sum(1 for _ in f)
+    return {"debates": totals["debates"], "failed_debates": totals["failed"], "turns": totals["turns"], "transcript_lines": lines,
+            "seconds": round(elapsed, 3), "debates_per_hour": round(totals["debates"] / elapsed * 3600),
+            "generated_tokens_per_second": round(totals["predicted_tokens"] / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake time to first token (s)")
+    parser.add_argument("--words-per-second", type=float, default=100.0)
+    parser.add_argument("--words", type=int, default=20, help="words per answer")
+    parser.add_argument("--slots", type=int, default=2, help="requests the fake server handles at once")
+    parser.add_argument("--history-rounds", type=int, default=50, help="rounds of the prompt size and memory run")
+    parser.add_argument("--debates", type=int, default=20, help="debates of the batch run")
+    args = parser.parse_args()
+
+    sequential, sequential_output = run(args, sequential=True)
+    concurrent, concurrent_output = run(args, sequential=False)
+    print(json.dumps({
+        "rounds": args.rounds,
+        "results": [sequential, concurrent],
+        "original_sleep_seconds": ORIGINAL_SLEEP_PER_ROUND * args.rounds,
+        "speedup": round(sequential["seconds"] / concurrent["seconds"], 2),
+        "speedup_vs_original": round((sequential["seconds"] + ORIGINAL_SLEEP_PER_ROUND * args.rounds) / concurrent["seconds"], 2),
+        "same_transcript_order": [line.split(":")[0] for line in sequential_output.split("\n\n")]
+                                 == [line.split(":")[0] for line in concurrent_output.split("\n\n")],
+        "history_rounds": args.history_rounds,
+        "history": [run_history(args, windowed=False), run_history(args, windowed=True)],
+        "batch": run_batch(args),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
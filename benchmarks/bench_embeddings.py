@@ -0,0 +1,123 @@
+"""Benchmark ChatWeb.create_embeddings against a local fake embedding server.
+
+The fake server is a small HTTP endpoint that answers every request after a
+fixed round-trip latency plus a per-text cost, which is roughly how an
+embedding model behind LM Studio behaves. Like the lmstudio SDK, the fake
+client sends one request per text, one after the other, even when embed()
+is given a list, so batching alone saves no round trips. No LM Studio
+instance is needed.
+
+    python benchmarks/bench_embeddings.py --chunks 512 --latency 0.02
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ChatWeb  # noqa: E402
+
+
+def make_handler(latency, per_text, dim):
+    class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            texts = json.loads(body)["input"]
+            time.sleep(latency + per_text * len(texts))
+            vectors = []
+            for text in texts:
+                seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:4], "little")
+                vectors.append(np.random.default_rng(seed).standard_normal(dim).round(6).tolist())
+            payload = json.dumps({"data": vectors}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeEmbeddingHandler
+
+
+class FakeEmbeddingClient:
+    """Minimal stand-in for lms.embedding_model() that talks to the fake server
+
+    A list is embedded the way the SDK does it: one request per text, in order.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def _embed_text(self, text):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({"input": [text]}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            vector = json.loads(response.read())["data"][0]
+        with self.lock:
+            self.requests += 1
+        return vector
+
+    def embed(self, input):
+        if isinstance(input, str):
+            return self._embed_text(input)
+        return [self._embed_text(text) for text in input]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=512)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--latency", type=float, default=0.02, help="round-trip latency per request (s)")
+    parser.add_argument("--per-text", type=float, default=0.0005, help="server cost per text (s)")
+    parser.add_argument("--in-flight", type=int, default=ChatWeb.EMBED_MAX_IN_FLIGHT)
+    parser.add_argument("--chunks-small", type=int, default=30, help="chunks of a short page, fewer than one default batch")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(args.latency, args.per_text, args.dim))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/embed"
+    results = []
+    for page_chunks in (args.chunks, args.chunks_small):
+        chunks = [f"chunk {i} " + "lorem ipsum " * 50 for i in range(page_chunks)]
+
+        # Baseline: the original one-request-per-chunk loop
+        client = FakeEmbeddingClient(url)
+        start = time.perf_counter()
+        for chunk in chunks:
+            client.embed(chunk)
+        elapsed = time.perf_counter() - start
+        results.append({"chunks": page_chunks, "mode": "sequential", "batch_size": 1, "in_flight": 1,
+                        "requests": client.requests, "seconds": round(elapsed, 3),
+                        "chunks_per_second": round(len(chunks) / elapsed, 1)})
+
+        for batch_size in args.batch_sizes:
+            client = FakeEmbeddingClient(url)
+            start = time.perf_counter()
+            matrix = ChatWeb.create_embeddings(chunks, model=client, batch_size=batch_size, max_in_flight=args.in_flight)
+            elapsed = time.perf_counter() - start
+            assert matrix.shape == (len(chunks), args.dim)
+            results.append({"chunks": page_chunks, "mode": "pipeline", "batch_size": batch_size,
+                            "in_flight": args.in_flight, "requests": client.requests, "seconds": round(elapsed, 3),
+                            "chunks_per_second": round(len(chunks) / elapsed, 1)})
+
+    server.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
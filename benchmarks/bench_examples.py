@@ -0,0 +1,280 @@
+"""Run all four examples end to end against the fake LM Studio server and time them.
+
+Every example talks to benchmarks/fake_lmstudio.py through the real lmstudio
+client, so the whole path is measured: the websocket protocol, streaming,
+tool calls and the examples' own code. Nothing waits for the keyboard:
+ChatWeb's questions are scripted, sorting_agent sorts generated images in a
+temporary folder, act.py plays a fixed game, and 3Agents.py runs a batch of
+short debates.
+
+For each example the report gives the wall time, its throughput, p50/p95
+of its unit of work (game, question, debate turn, image) and the round
+trips the server saw per endpoint. Compare two runs' JSON to spot
+regressions. The exit status is 1 if an example raised, or if
+sorting_agent.py left an image unsorted.
+
+    python benchmarks/bench_examples.py --latency 0.05 --tokens-per-second 200 --failure-rate 0.0
+    python benchmarks/bench_examples.py --examples act debate
+"""
+import argparse
+import asyncio
+import builtins
+import contextlib
+import importlib.util
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCHMARKS)
+import lmstudio as lms  # noqa: E402
+import act  # noqa: E402
+import instrumentation  # noqa: E402
+from fake_lmstudio import FakeLMStudio, FakeReply, default_responder, percentile  # noqa: E402
+
+EXAMPLES = ("act", "chatweb", "debate", "sorting")
+QUESTIONS = ["What does the page say about solar panels?", "How much energy does a wind turbine produce?",
+             "What does the page say about solar panels?", "Which storage options are mentioned?"]
+PAGE_TOPICS = ["solar panels convert sunlight into electricity on rooftops and in large farms",
+               "a wind turbine produces energy when the wind turns its blades",
+               "batteries and pumped hydro are storage options for renewable energy"]
+
+
+def tool_result(content):
+    """Tool results arrive JSON-encoded"""
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content
+
+
+def responder(request):
+    """Plays the model's part for each example, recognized by the tools it offers"""
+    names = request.tool_names
+    calls = request.tool_calls_made
+    results = [tool_result(content) for content in request.tool_results]
+
+    if "addition" in names:
+        # act.py: verify the solver's steps listed in the prompt, all in one round
+        if not calls:
+            steps = re.findall(r"(addition|substraction|multiplication|division)\((\d+), (\d+)\)", request.prompt)
+            return FakeReply("Let me verify each step.", [(name, {"a": int(a), "b": int(b)}) for name, a, b in steps])
+        return FakeReply(f"All steps check out: {', '.join(str(result) for result in results)}.")
+
+    if "move_image" in names:
+        # sorting_agent.py: list, describe and move each image in turn
+        categories = next(tool["function"]["parameters"]["properties"]["category"]["enum"]
+                          for tool in request.tools if tool["function"]["name"] == "move_image")
+        last = calls[-1][0] if calls else None
+        if last is None or last == "move_image":
+            if "list_images_to_process" in names:
+                return FakeReply("Next image.", [("list_images_to_process", {})])
+            return FakeReply("Done.")
+        if last == "list_images_to_process":
+            image_name = results[-1]
+            if not image_name or image_name.startswith("There are no more"):
+                return FakeReply("Every image is sorted. Each tool worked as expected.")
+            return FakeReply("Let me look at it.", [("get_image_description", {"image_name": image_name})])
+        if last == "get_image_description":
+            image_name = calls[-1][1]["image_name"]
+            category = categories[sum(map(ord, image_name)) % len(categories)]
+            return FakeReply("Moving it.", [("move_image", {"image_name": image_name, "category": category})])
+        return FakeReply("Done.")
+
+    return default_responder(request)
+
+
+def load_script(name):
+    spec = importlib.util.spec_from_file_location(name.replace(".py", "").lower(), os.path.join(ROOT, name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def summary(values):
+    return {"p50": round(percentile(values, 0.5), 4), "p95": round(percentile(values, 0.95), 4)} if values else None
+
+
+def bench_act(args):
+    model = lms.llm()
+    games = []
+    rounds = []
+    tool_calls = []
+    for _ in range(args.games):
+        counters = act.play(model)
+        games.append(counters["seconds"])
+        rounds.append(counters["rounds"])
+        tool_calls.append(counters["tool_calls"])
+    return {"units": "games", "count": args.games, "per_unit_s": summary(games),
+            "model_rounds_per_game": sum(rounds) / len(rounds), "tool_calls_per_game": sum(tool_calls) / len(tool_calls)}
+
+
+def serve_page():
+    """Serve a small HTML page for ChatWeb to fetch"""
+    paragraphs = "".join(f"<p>{topic}. {' '.join([topic] * 20)}.</p>" for topic in PAGE_TOPICS)
+    page = f"<html><head><title>Renewable energy</title></head><body>{paragraphs}</body></html>".encode("utf-8")
+
+    class PageHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_chatweb(args, folder):
+    chat_web = load_script("ChatWeb.py")
+    chat_web.EMBED_CACHE_DIR = os.path.join(folder, "embedding_cache")
+    page_server = serve_page()
+    script = iter([f"http://127.0.0.1:{page_server.server_address[1]}/energy.html"]
+                  + QUESTIONS * args.question_rounds + ["exit"])
+    metrics_path = os.path.join(folder, "chatweb_metrics.json")
+    real_input = builtins.input
+    builtins.input = lambda prompt="": next(script)
+    try:
+        chat_web.chat_with_web_agent(metrics_path)
+    finally:
+        builtins.input = real_input
+        page_server.shutdown()
+    with open(metrics_path, encoding="utf-8") as f:
+        turns = json.load(f)["turns"]
+    return {"units": "questions", "count": len(turns), "per_unit_s": summary([turn["total_s"] for turn in turns]),
+            "cache_hits": sum(1 for turn in turns if turn["cache_hit"]),
+            "time_to_first_token_s": summary([turn["time_to_first_token_s"] for turn in turns
+                                              if turn.get("time_to_first_token_s") is not None])}
+
+
+def bench_debate(args, folder):
+    three_agents = load_script("3Agents.py")
+    debate = {**three_agents.DEFAULT_DEBATE, "rounds": args.debate_rounds}
+    transcript = os.path.join(folder, "debates.jsonl")
+    totals = asyncio.run(three_agents.run_debates([debate], lms.llm(), repeat=args.debates, concurrency=args.debates,
+                                                  max_in_flight=args.parallel, transcript_path=transcript))
+    with open(transcript, encoding="utf-8") as f:
+        turns = [line for line in map(json.loads, f) if "error" not in line]
+    return {"units": "debate turns", "count": len(turns), "debates": args.debates, "failed_debates": totals["failed"],
+            "per_unit_s": summary([turn["seconds"] for turn in turns]),
+            "generated_tokens": sum(turn["predicted_tokens"] for turn in turns)}
+
+
+def make_images(folder, prefix, count, shade):
+    """Write distinct JPEGs, so the sort journal never recognizes one as already sorted"""
+    from PIL import Image
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        color = i % 256, i // 256 % 256, shade
+        Image.new("RGB", (1200, 900), color).save(os.path.join(folder, f"{prefix}_{i:04d}.jpg"), quality=90)
+
+
+def bench_sorting(args, folder):
+    import sorting_agent
+    previous = os.getcwd()
+    os.chdir(folder)
+    try:
+        sorting_agent.create_folders()
+        sorting_agent.sort_journal = sorting_agent.SortJournal(os.path.join(folder, "journal.sqlite"))
+        classify_seconds = []
+
+        def timed_classify(image_name, image_model, preparer=None):
+            start = time.perf_counter()
+            try:
+                return sorting_agent.classify_image(image_name, image_model, preparer)
+            finally:
+                classify_seconds.append(time.perf_counter() - start)
+
+        with sorting_agent.model_registry:
+            make_images(sorting_agent.source_folder, "batch", args.images, 0)
+            sorting_agent.image_queue = sorting_agent.ImageQueue(sorting_agent.source_folder)
+            start = time.perf_counter()
+            sorting_agent.sort_images_batch(sorting_agent.image_model, workers=args.parallel, classify=timed_classify)
+            batch_seconds = time.perf_counter() - start
+
+            make_images(sorting_agent.source_folder, "agent", args.agent_images, 255)
+            sorting_agent.image_queue = sorting_agent.ImageQueue(sorting_agent.source_folder)
+            start = time.perf_counter()
+            sorting_agent.run_agent(sorting_agent.agent_model)
+            agent_seconds = time.perf_counter() - start
+        left = len(os.listdir(sorting_agent.source_folder))
+    finally:
+        os.chdir(previous)
+    return {"units": "images", "count": args.images + args.agent_images, "per_unit_s": summary(classify_seconds),
+            "batch_images_per_s": round(args.images / batch_seconds, 2),
+            "agent_images_per_s": round(args.agent_images / agent_seconds, 2), "left_unsorted": left}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--examples", nargs="+", choices=EXAMPLES, default=list(EXAMPLES))
+    parser.add_argument("--latency", type=float, default=0.05, help="fake time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--parallel", type=int, default=4, help="predictions the fake server runs at once")
+    parser.add_argument("--games", type=int, default=5, help="act.py games")
+    parser.add_argument("--question-rounds", type=int, default=2, help="times ChatWeb's question list is asked")
+    parser.add_argument("--debates", type=int, default=4, help="3Agents.py debates run at once")
+    parser.add_argument("--debate-rounds", type=int, default=2)
+    parser.add_argument("--images", type=int, default=24, help="sorting_agent.py images sorted in batch mode")
+    parser.add_argument("--agent-images", type=int, default=4, help="sorting_agent.py images sorted by the agent loop")
+    parser.add_argument("--trace", metavar="PATH", help="also record spans in every example and write a Chrome/Perfetto trace")
+    parser.add_argument("--prometheus", metavar="PATH", help="also write the examples' counters and histograms in the Prometheus text format")
+    args = parser.parse_args()
+
+    if args.trace or args.prometheus:
+        instrumentation.enable(args.trace, args.prometheus)
+
+    server = FakeLMStudio(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                          failure_rate=args.failure_rate, parallel=args.parallel, responder=responder).start()
+    lms.configure_default_client(server.api_host)
+    runners = {"act": lambda folder: bench_act(args), "chatweb": lambda folder: bench_chatweb(args, folder),
+               "debate": lambda folder: bench_debate(args, folder), "sorting": lambda folder: bench_sorting(args, folder)}
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for name in args.examples:
+            before = len(server.requests)
+            start = time.perf_counter()
+            try:
+                # The examples print as they go; only the JSON report goes to standard output
+                with contextlib.redirect_stdout(open(os.devnull, "w")):
+                    result = runners[name](folder)
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}"}
+            elapsed = time.perf_counter() - start
+            requests = server.requests[before:]
+            result["seconds"] = round(elapsed, 3)
+            if result.get("count"):
+                result["throughput_per_s"] = round(result["count"] / elapsed, 3)
+            result["round_trips"] = {}
+            for endpoint, _, _ in requests:
+                result["round_trips"][endpoint] = result["round_trips"].get(endpoint, 0) + 1
+            result["failed_requests"] = sum(1 for _, _, ok in requests if not ok)
+            results[name] = result
+
+    lms.get_default_client().close()
+    server.stop()
+    print(json.dumps({"server": {"latency": args.latency, "tokens_per_second": args.tokens_per_second,
+                                 "failure_rate": args.failure_rate, "parallel": args.parallel},
+                      "examples": results, "endpoints": server.report()}, indent=2))
+    failed = [name for name, result in results.items() if "error" in result or result.get("left_unsorted")]
+    if failed:
+        print(f"Failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
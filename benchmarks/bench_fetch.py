@@ -0,0 +1,133 @@
+"""Benchmark ChatWeb page fetching and extraction on large HTML fixtures.
+
+Fixtures are served from a local HTTP server. Pass saved pages with
+--fixtures, or let the script generate nested article/section/p pages of
+the requested sizes. The original BeautifulSoup extraction is timed too when
+beautifulsoup4 is installed.
+
+    python benchmarks/bench_fetch.py --sizes 1 4 16
+    python benchmarks/bench_fetch.py --fixtures saved/page1.html saved/page2.html
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ChatWeb  # noqa: E402
+
+
+def generate_fixture(path, size_mb):
+    """Write a page of roughly size_mb megabytes with nested content elements"""
+    paragraph = "<p>Lorem ipsum <b>dolor</b> sit amet, consectetur adipiscing elit, sed do eiusmod tempor.</p>\n"
+    section = "<section><h2>Section heading</h2>\n" + paragraph * 20 + "<ul>" + "<li>List item text</li>" * 10 + "</ul></section>\n"
+    target = int(size_mb * 1024 * 1024)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("<html><head><title>Fixture page</title><script>var x = 1;</script></head><body>\n")
+        written = 0
+        while written < target:
+            block = "<article>" + section * 4 + "</article>\n"
+            f.write(block)
+            written += len(block)
+        f.write("</body></html>\n")
+
+
+def legacy_extract(url):
+    """The original fetch_webpage_content body: buffer, build a tree, find_all"""
+    from bs4 import BeautifulSoup
+
+    response = requests.get(url)
+    soup = BeautifulSoup(response.content, "html.parser")
+    title = soup.title.string if soup.title else "Untitled page"
+    content_elements = soup.find_all(["p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "article", "section"])
+    content = " ".join([elem.get_text().strip() for elem in content_elements])
+    return title, " ".join(content.split())
+
+
+def streaming_extract(url):
+    page = {}
+    first_fragment = None
+    start = time.perf_counter()
+    fragments = []
+    for fragment in ChatWeb.stream_webpage_text(url, page, max_bytes=1 << 40):
+        if first_fragment is None:
+            first_fragment = time.perf_counter() - start
+        fragments.append(fragment)
+    return page["title"], " ".join(fragments), first_fragment
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(func, *args):
+    """Time one run, then trace a second run for peak memory (tracing slows it down)"""
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures", nargs="*", default=[])
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16], help="generated fixture sizes in MB")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        fixtures = []
+        for path in args.fixtures:
+            name = os.path.basename(path)
+            with open(path, "rb") as src, open(os.path.join(root, name), "wb") as dst:
+                dst.write(src.read())
+            fixtures.append(name)
+        if not fixtures:
+            for size in args.sizes:
+                name = f"fixture_{size:g}mb.html"
+                generate_fixture(os.path.join(root, name), size)
+                fixtures.append(name)
+
+        handler = functools.partial(QuietHandler, directory=root)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}/"
+
+        try:
+            import bs4  # noqa: F401
+            have_bs4 = True
+        except ImportError:
+            have_bs4 = False
+
+        results = []
+        for name in fixtures:
+            url = base + name
+            size = os.path.getsize(os.path.join(root, name))
+            (title, content, first), elapsed, peak = measure(streaming_extract, url)
+            row = {"fixture": name, "bytes": size,
+                   "streaming": {"seconds": round(elapsed, 3), "first_fragment_seconds": round(first or 0, 4),
+                                 "peak_mb": round(peak / 2**20, 1), "characters": len(content)}}
+            if have_bs4:
+                (title, content), elapsed, peak = measure(legacy_extract, url)
+                row["beautifulsoup"] = {"seconds": round(elapsed, 3), "peak_mb": round(peak / 2**20, 1),
+                                        "characters": len(content)}
+            results.append(row)
+        server.shutdown()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
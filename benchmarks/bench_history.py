@@ -0,0 +1,75 @@
+"""Check that ChatWeb's compacted chat history keeps per-turn prompt size flat.
+
+Simulates a long session in which every question carries three retrieved
+chunks, and compares the prompt sent each turn by ChatWeb.ChatHistory with
+the original approach of appending every full prompt to one lms.Chat. Exits
+with status 1 if the compacted prompt keeps growing.
+
+    python benchmarks/bench_history.py --turns 50
+"""
+import argparse
+import json
+import os
+import sys
+
+import lmstudio as lms
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ChatWeb  # noqa: E402
+
+
+def chat_tokens(chat):
+    """Approximate tokens of every message in an lms.Chat"""
+    return ChatWeb.approx_token_count(str(chat))
+
+
+def fake_digest(digest, turns):
+    """Summarizer stand-in: keeps the latest questions, capped in length"""
+    text = " ".join(filter(None, [digest] + [question for question, _ in turns]))
+    return text[-600:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--chunk-tokens", type=int, default=1000)
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--budget", type=int, default=ChatWeb.HISTORY_TOKEN_BUDGET)
+    args = parser.parse_args()
+
+    system_prompt = "You are an intelligent web assistant that has analyzed a web page."
+    chunk = "word " * (args.chunk_tokens * ChatWeb.CHARS_PER_TOKEN // 5)
+    answer = "answer " * (args.answer_tokens * ChatWeb.CHARS_PER_TOKEN // 7)
+
+    unbounded = lms.Chat(system_prompt)
+    compacted = ChatWeb.ChatHistory(system_prompt, token_budget=args.budget)
+    summarized = ChatWeb.ChatHistory(system_prompt, token_budget=args.budget, summarize=fake_digest)
+    sizes = {"unbounded": [], "compacted": [], "summarized": []}
+
+    for turn in range(args.turns):
+        question = f"Question number {turn} about the page?"
+        prompt = f"Use this content:\n\n{chunk}\n\n{chunk}\n\n{chunk}\n\nQuestion: {question}"
+
+        unbounded.add_user_message(prompt)
+        sizes["unbounded"].append(chat_tokens(unbounded))
+        unbounded.add_assistant_response(answer)
+
+        for name, history in (("compacted", compacted), ("summarized", summarized)):
+            sizes[name].append(chat_tokens(history.build_chat(prompt)))
+            history.add_turn(question, answer)
+
+    # Once the budget is reached, later turns must not be larger than earlier ones
+    report = {"budget": args.budget, "bounded": True}
+    for name, series in sizes.items():
+        quarter = max(1, len(series) // 4)
+        early, late = series[quarter:2 * quarter], series[-quarter:]
+        growth = (sum(late) / len(late)) / (sum(early) / len(early))
+        report[name] = {"first": series[0], "last": series[-1], "max": max(series), "late_vs_early": round(growth, 3)}
+        if name != "unbounded" and growth > 1.1:
+            report["bounded"] = False
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["bounded"] else 1)
+
+
+if __name__ == "__main__":
+    main()
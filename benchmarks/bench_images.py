@@ -0,0 +1,136 @@
+"""Measure bytes sent and latency per image for sorting_agent image preparation.
+
+Generates large photos (24 megapixels by default) and compares uploading
+the original file, which is what lms.prepare_image(path) does, with
+sorting_agent's downscale-and-cache pipeline. The upload goes to a fake
+endpoint that charges time in proportion to the bytes it receives, then
+decodes what it received and resizes it to the model's input size, as the
+model server must before the vision model sees the image.
+
+Each side reports its end-to-end time per image plus the three costs it
+is made of: local preparation (reading, hashing, decoding and re-encoding,
+zero for the original path), upload, and server-side decoding. Local
+preparation can cost as much as it saves on a fast link; the saving is in
+the bytes sent and in the server's decode.
+
+    python benchmarks/bench_images.py --images 12 --width 6000 --height 4000
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import lmstudio as lms
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sorting_agent  # noqa: E402
+
+
+class FakeUploadClient:
+    """Accepts uploads at a fixed bandwidth and counts the bytes"""
+
+    def __init__(self, megabytes_per_second, max_side=sorting_agent.IMAGE_MAX_SIDE):
+        self.bandwidth = megabytes_per_second * 1024 * 1024
+        self.max_side = max_side
+        self.bytes = 0
+        self.uploads = 0
+        self.upload_seconds = 0.0
+        self.decode_seconds = 0.0
+
+    def prepare_image(self, src, name=None):
+        if not isinstance(src, (bytes, bytearray)):
+            with open(src, "rb") as f:
+                src = f.read()
+        time.sleep(len(src) / self.bandwidth)
+        self.upload_seconds += len(src) / self.bandwidth
+        start = time.perf_counter()
+        # What the model server does with any upload: decode it in full, then resize to the model's input
+        with Image.open(io.BytesIO(src)) as image:
+            image = image.convert("RGB")
+            scale = min(1.0, self.max_side / max(image.size))
+            image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BICUBIC)
+        self.decode_seconds += time.perf_counter() - start
+        self.bytes += len(src)
+        self.uploads += 1
+        return lms.history.FileHandle(name=name or "image.jpg", identifier=f"file-{self.uploads}",
+                                      size_bytes=len(src), file_type="image")
+
+
+def make_photo(path, width, height, seed):
+    """Write a noisy gradient JPEG, which compresses about as badly as a real photo"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 24, base.shape), 0, 255).astype(np.uint8)
+    Image.fromarray(pixels).save(path, quality=92)
+
+
+def per_image(seconds, paths):
+    return round(seconds / len(paths) * 1000, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=12)
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--height", type=int, default=4000)
+    parser.add_argument("--bandwidth", type=float, default=50.0, help="fake upload speed in MB/s")
+    parser.add_argument("--prefetch", type=int, default=sorting_agent.PREFETCH_IMAGES)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        paths = []
+        for i in range(args.images):
+            path = os.path.join(root, f"photo_{i:03d}.jpg")
+            make_photo(path, args.width, args.height, seed=i)
+            paths.append(path)
+
+        # Baseline: upload every original, one after the other
+        client = FakeUploadClient(args.bandwidth)
+        start = time.perf_counter()
+        for path in paths:
+            client.prepare_image(path)
+        elapsed = time.perf_counter() - start
+        original = {"bytes_per_image": client.bytes // len(paths), "ms_per_image": per_image(elapsed, paths),
+                    "local_prepare_ms": 0.0, "upload_ms": per_image(client.upload_seconds, paths),
+                    "server_decode_ms": per_image(client.decode_seconds, paths)}
+
+        # Local preparation alone, one image after the other
+        start = time.perf_counter()
+        for path in paths:
+            with open(path, "rb") as f:
+                data = f.read()
+            hashlib.sha256(data).hexdigest()
+            sorting_agent.downscale_image(data, os.path.splitext(path)[1])
+        local_seconds = time.perf_counter() - start
+
+        # Pipeline: downscale once, prefetch ahead, then ask for every image again
+        client = FakeUploadClient(args.bandwidth)
+        preparer = sorting_agent.ImagePreparer(client, workers=args.prefetch)
+        start = time.perf_counter()
+        for i, path in enumerate(paths):
+            preparer.prefetch(paths[i + 1:i + 1 + args.prefetch])
+            preparer.get(path)
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        for path in paths:
+            preparer.get(path)
+        repeat_elapsed = time.perf_counter() - start
+        prepared = {"bytes_per_image": client.bytes // len(paths), "ms_per_image": per_image(elapsed, paths),
+                    "local_prepare_ms": per_image(local_seconds, paths), "upload_ms": per_image(client.upload_seconds, paths),
+                    "server_decode_ms": per_image(client.decode_seconds, paths),
+                    "repeat_ms_per_image": per_image(repeat_elapsed, paths), "uploads": client.uploads}
+
+    print(json.dumps({"images": args.images, "resolution": f"{args.width}x{args.height}",
+                      "max_side": sorting_agent.IMAGE_MAX_SIDE, "original": original, "prepared": prepared}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
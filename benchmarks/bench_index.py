@@ -0,0 +1,82 @@
+"""Benchmark the ChatWeb corpus index: IVF recall@k and latency against exact search.
+
+Vectors are drawn around random topic centers and normalized, which is a
+rough stand-in for chunk embeddings from many pages on a few subjects.
+
+    python benchmarks/bench_index.py --chunks 100000 --dim 768
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ChatWeb  # noqa: E402
+
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--topics", type=int, default=1000)
+    parser.add_argument("--noise", type=float, default=2.0, help="spread of chunks around their topic")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--probe-fractions", type=float, nargs="+", default=[1 / 64, 1 / 32, 1 / 16, 1 / 8])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((args.topics, args.dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, args.topics, args.chunks)]
+    vectors += rng.standard_normal(vectors.shape, dtype=np.float32) * args.noise
+    queries = centers[rng.integers(0, args.topics, args.queries)]
+    queries += rng.standard_normal(queries.shape, dtype=np.float32) * args.noise
+    vectors = ChatWeb.build_similarity_matrix(vectors)
+    queries = ChatWeb.build_similarity_matrix(queries)
+
+    index = ChatWeb.VectorIndex("ivf")
+    index.add_page("bench://corpus", "Benchmark corpus", ChatWeb.TextChunks("", np.zeros((args.chunks, 2))), vectors)
+    start = time.perf_counter()
+    index.build()
+    build_seconds = time.perf_counter() - start
+
+    def run(**kwargs):
+        latencies, results = [], []
+        for query in queries:
+            start = time.perf_counter()
+            results.append({chunk_id for chunk_id, _ in index.search(query, args.top_k, **kwargs)})
+            latencies.append(time.perf_counter() - start)
+        return results, latencies
+
+    exact_results, exact_latencies = run(exact=True)
+    report = {
+        "chunks": args.chunks,
+        "dim": args.dim,
+        "top_k": args.top_k,
+        "ivf_lists": 0 if index.centroids is None else len(index.centroids),
+        "build_seconds": round(build_seconds, 3),
+        "exact": {"p50_ms": percentile_ms(exact_latencies, 50), "p95_ms": percentile_ms(exact_latencies, 95)},
+        "ivf": [],
+    }
+    for fraction in args.probe_fractions:
+        index.probe_fraction = fraction
+        results, latencies = run(exact=False)
+        recall = np.mean([len(found & truth) / len(truth) for found, truth in zip(results, exact_results)])
+        report["ivf"].append({
+            "probe_fraction": round(fraction, 4),
+            f"recall@{args.top_k}": round(float(recall), 4),
+            "p50_ms": percentile_ms(latencies, 50),
+            "p95_ms": percentile_ms(latencies, 95),
+        })
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
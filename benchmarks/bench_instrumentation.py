@@ -0,0 +1,76 @@
+"""Measure the cost of instrumentation.py spans, disabled and enabled, and check its output formats.
+
+Each case times a million calls of a trivial function: bare, decorated with
+traced() and wrapped in a span() block, first with instrumentation disabled
+(the default) and then enabled. The enabled run's trace is checked to load
+as JSON with one complete event per span, and its Prometheus dump to have
+one span_seconds count per span.
+
+    python benchmarks/bench_instrumentation.py --calls 1000000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import instrumentation  # noqa: E402
+from instrumentation import span, traced  # noqa: E402
+
+
+def add(a, b):
+    return a + b
+
+
+traced_add = traced("tool")(add)
+
+
+def time_calls(calls):
+    """Nanoseconds per call for the bare, decorated and span-wrapped function"""
+    results = {}
+    start = time.perf_counter_ns()
+    for i in range(calls):
+        add(i, 1)
+    results["bare_ns"] = (time.perf_counter_ns() - start) / calls
+
+    start = time.perf_counter_ns()
+    for i in range(calls):
+        traced_add(i, 1)
+    results["traced_ns"] = (time.perf_counter_ns() - start) / calls
+
+    start = time.perf_counter_ns()
+    for i in range(calls):
+        with span("add", "tool"):
+            add(i, 1)
+    results["span_ns"] = (time.perf_counter_ns() - start) / calls
+    return {name: round(value, 1) for name, value in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    disabled = time_calls(args.calls)
+    recorder = instrumentation.enable()
+    enabled = time_calls(args.calls)
+    instrumentation.disable()
+
+    trace = json.loads(json.dumps(recorder.chrome_trace()))
+    spans = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    prometheus = recorder.prometheus_text()
+    counts = [line for line in prometheus.splitlines() if line.startswith("examples_span_seconds_count")]
+    print(json.dumps({
+        "calls": args.calls,
+        "disabled": dict(disabled, overhead_ns=round(disabled["span_ns"] - disabled["bare_ns"], 1)),
+        "enabled": dict(enabled, overhead_ns=round(enabled["span_ns"] - enabled["bare_ns"], 1)),
+        "trace_spans": len(spans),
+        "expected_spans": 2 * args.calls,
+        "prometheus_span_counts": {line.split("{")[1].split("}")[0]: int(line.split()[-1]) for line in counts},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Measure the time to get the next image from a large sorting_agent source folder.
+
+Fills a folder with empty image files (100k by default) and compares the
+original list_images_to_process, which lists and stats the whole folder on
+every call, with sorting_agent's ImageQueue. After each call the image is
+moved out of the folder, as the agent would do; only the lookup is timed.
+
+    python benchmarks/bench_queue.py --files 100000 --legacy-calls 20
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sorting_agent  # noqa: E402
+
+
+def legacy_next_image(folder):
+    """The original lookup: list the folder and return the first image"""
+    images = [f for f in os.listdir(folder)
+              if os.path.isfile(os.path.join(folder, f)) and f.lower().endswith(sorting_agent.IMAGE_EXTENSIONS)]
+    return images[0] if images else None
+
+
+def make_files(folder, count, per_folder):
+    for i in range(count):
+        relative = os.path.join(f"batch_{i // per_folder:04d}", f"image_{i:07d}.jpg") if per_folder else f"image_{i:07d}.jpg"
+        path = os.path.join(folder, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "wb").close()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summary(timings):
+    return {"calls": len(timings), "mean_ms": round(sum(timings) / len(timings) * 1000, 4),
+            "p50_ms": round(percentile(timings, 0.5) * 1000, 4), "p99_ms": round(percentile(timings, 0.99) * 1000, 4),
+            "max_ms": round(max(timings) * 1000, 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=100000)
+    parser.add_argument("--legacy-calls", type=int, default=20, help="calls timed for the original lookup")
+    parser.add_argument("--per-folder", type=int, default=0, help="spread files over subfolders of this size and scan recursively")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        source = os.path.join(root, "source")
+        done = os.path.join(root, "done")
+        os.makedirs(source)
+        os.makedirs(done)
+        make_files(source, args.files, args.per_folder)
+        recursive = bool(args.per_folder)
+        results = {"files": args.files, "recursive": recursive}
+
+        if not recursive:
+            timings = []
+            for _ in range(min(args.legacy_calls, args.files)):
+                start = time.perf_counter()
+                name = legacy_next_image(source)
+                timings.append(time.perf_counter() - start)
+                os.replace(os.path.join(source, name), os.path.join(done, name))
+            results["listdir"] = summary(timings)
+            for name in os.listdir(done):
+                os.replace(os.path.join(done, name), os.path.join(source, name))
+
+        queue = sorting_agent.ImageQueue(source, recursive=recursive)
+        timings = []
+        drain_start = time.perf_counter()
+        while True:
+            start = time.perf_counter()
+            name = queue.claim()
+            timings.append(time.perf_counter() - start)
+            if name is None:
+                break
+            os.replace(os.path.join(source, name), os.path.join(done, os.path.basename(name)))
+            queue.done(name)
+        results["queue"] = summary(timings[:-1])
+        results["queue"]["first_ms"] = round(timings[0] * 1000, 4)
+        results["queue"]["empty_check_ms"] = round(timings[-1] * 1000, 4)
+        results["queue"]["drain_seconds"] = round(time.perf_counter() - drain_start, 2)
+        results["queue"]["scans"] = queue.scans
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Time rendering of act() messages with large tool results.
+
+Builds assistant and tool result messages with lmstudio's own message types
+and renders them with MessageRenderer in its text, jsonl and quiet modes,
+and with the original sorting_agent format_message, which parses
+str(message) one character at a time. The part names that parser looks for
+are not in the str() of current lmstudio parts, so the original is fed
+stand-ins that print the way older SDK versions did. Output goes to an
+in-memory sink.
+
+    python benchmarks/bench_render.py --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+from colorama import Fore, Style
+from lmstudio import history
+from lmstudio._sdk_models import ToolCallRequest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from message_renderer import MessageRenderer  # noqa: E402
+
+
+def legacy_format_message(message):
+    """The original sorting_agent renderer, which parses str(message)"""
+    try:
+        msg_str = str(message)
+        
+        # Function to decode Unicode escape sequences
+        def decode_unicode(text):
+            try:
+                return bytes(text, 'utf-8').decode('unicode_escape')
+            except:
+                return text
+        
+        # Handle assistant messages
+        if hasattr(message, 'role') and message.role == 'assistant':
+            print(f"{Fore.CYAN}Assistant:{Style.RESET_ALL}")
+            
+            # Extract and display all text and tool names
+            if hasattr(message, 'content') and isinstance(message.content, list):
+                for item in message.content:
+                    item_str = str(item)
+                    
+                    # Extract text content from text parts
+                    if "ChatMessagePartTextData" in item_str:
+                        if '"text":' in item_str:
+                            text_start = item_str.find('"text": "') + 9
+                            if text_start > 8:
+                                # Handle escaped quotes in the text
+                                text_content = ""
+                                in_quotes = True
+                                i = text_start
+                                while i < len(item_str) and in_quotes:
+                                    if item_str[i:i+2] == '\\"':
+                                        text_content += '"'
+                                        i += 2
+                                    elif item_str[i] == '"' and (i == 0 or item_str[i-1] != '\\'):
+                                        in_quotes = False
+                                    else:
+                                        text_content += item_str[i]
+                                        i += 1
+                                
+                                # Clean up the text and decode Unicode
+                                text_content = text_content.replace('\\n', '\n')
+                                text_content = decode_unicode(text_content)
+                                if text_content.strip():  # Only print non-empty texts
+                                    print(f"{text_content}")
+                    
+                    # Extract tool names from tool call requests
+                    elif "ChatMessagePartToolCallRequestData" in item_str:
+                        if '"name":' in item_str:
+                            name_start = item_str.find('"name": "') + 9
+                            name_end = item_str.find('"', name_start)
+                            if name_start > 8 and name_end > name_start:
+                                tool_name = item_str[name_start:name_end]
+                                tool_name = decode_unicode(tool_name)
+                                print(f"{Fore.BLUE}Calling tool: {tool_name}{Style.RESET_ALL}")
+        
+        # Handle tool messages
+        elif hasattr(message, 'role') and message.role == 'tool':
+            print(f"{Fore.YELLOW}Tool result:{Style.RESET_ALL}")
+            
+            # Extract and display all content values
+            if hasattr(message, 'content') and isinstance(message.content, list):
+                for item in message.content:
+                    item_str = str(item)
+                    
+                    if "ChatMessagePartToolCallResultData" in item_str:
+                        if '"content":' in item_str:
+                            content_start = item_str.find('"content": "') + 12
+                            if content_start > 11:
+                                # Extract content with proper handling of quotes
+                                content_value = ""
+                                in_quotes = True
+                                i = content_start
+                                while i < len(item_str) and in_quotes:
+                                    if item_str[i:i+2] == '\\"':
+                                        content_value += '"'
+                                        i += 2
+                                    elif item_str[i] == '"' and (i == 0 or item_str[i-1] != '\\'):
+                                        in_quotes = False
+                                    else:
+                                        content_value += item_str[i]
+                                        i += 1
+                                
+                                # Clean up the content and decode Unicode
+                                content_value = content_value.replace('\\n', '\n')
+                                content_value = decode_unicode(content_value)
+                                content_value = content_value.strip('\"')
+                                print(f"{content_value}")
+        
+        # Handle string messages
+        elif isinstance(message, str):
+            print(decode_unicode(message))
+            
+    except Exception as e:
+        print(f"{Fore.RED}Error in format_message: {str(e)}{Style.RESET_ALL}")
+        import traceback
+        traceback.print_exc()
+    
+    return None
+
+
+class LegacyPart:
+    """A message part whose str() has the layout the original renderer parses"""
+
+    def __init__(self, kind, data):
+        self.kind = kind
+        self.data = data
+
+    def __str__(self):
+        return f"{self.kind}({json.dumps(self.data, indent=2)})"
+
+
+def legacy_messages(messages):
+    assistant, result = messages
+    text, call = assistant.content
+    return [
+        SimpleNamespace(role="assistant", content=[
+            LegacyPart("ChatMessagePartTextData", {"type": "text", "text": text.text}),
+            LegacyPart("ChatMessagePartToolCallRequestData", {"type": "toolCallRequest", "name": call.tool_call_request.name}),
+        ]),
+        SimpleNamespace(role="tool", content=[
+            LegacyPart("ChatMessagePartToolCallResultData", {"type": "toolCallResult", "content": result.content[0].content}),
+        ]),
+    ]
+
+
+def make_messages(size):
+    text = ("The image shows a beach at sunset, with \"quoted\" words and accents: café. " * (size // 80 + 1))[:size]
+    assistant = history.AssistantResponse(content=[
+        history.TextData(text=text),
+        history.ToolCallRequestData(tool_call_request=ToolCallRequest(
+            type="function", id="call-1", name="get_image_description", arguments={"image_name": "image_000001.jpg"})),
+    ])
+    result = history.ToolResultMessage(content=[
+        history.ToolCallResultData(content=json.dumps(text), tool_call_id="call-1"),
+    ])
+    return [assistant, result]
+
+
+def measure(render, messages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for message in messages:
+            render(message)
+    return (time.perf_counter() - start) / repeat / len(messages) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--legacy-max", type=int, default=1000000, help="largest size timed with the original renderer")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        messages = make_messages(size)
+        row = {"characters": size}
+        if size <= args.legacy_max:
+            with contextlib.redirect_stdout(io.StringIO()):
+                row["legacy_ms"] = round(measure(legacy_format_message, legacy_messages(messages), args.repeat), 3)
+        for mode in ("text", "jsonl", "quiet"):
+            renderer = MessageRenderer(mode, io.StringIO())
+            row[f"{mode}_ms"] = round(measure(renderer, messages, args.repeat), 3)
+            renderer.flush()
+        results.append(row)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Compare ChatWeb's retrieval modes for quality and latency on saved pages.
+
+Each saved HTML page is extracted and chunked the way ChatWeb chunks a
+downloaded one, then every question is answered by each retrieval mode:
+the first chunks (what ChatWeb fell back to before it had keyword search),
+BM25 alone, embeddings alone, the hybrid of both, and the hybrid with BM25
+prefiltering the chunks scored by similarity. A chunk is relevant when it
+contains the question's answer phrase. Questions are asked of their own
+page and of the corpus of all pages.
+
+The report gives hit@1, hit@k, MRR over the ranking depth, p50/p95
+latency per query (including the query embedding when the mode needs one)
+and the embedding calls each query cost.
+
+By default, questions come from benchmarks/fixtures/retrieval_questions.jsonl
+about the pages in benchmarks/fixtures/pages, and a local hashing embedder
+stands in for the embedding model. --lmstudio uses the real model instead.
+
+    python benchmarks/bench_retrieval.py
+    python benchmarks/bench_retrieval.py --lmstudio --pages saved_pages --questions my_questions.jsonl
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+import ChatWeb  # noqa: E402
+
+PAGES = os.path.join(BENCHMARKS, "fixtures", "pages")
+QUESTIONS = os.path.join(BENCHMARKS, "fixtures", "retrieval_questions.jsonl")
+MODES = {"first": None, "lexical": ("lexical", False), "vector": ("vector", False),
+         "hybrid": ("hybrid", False), "hybrid+prefilter": ("hybrid", True)}
+
+
+class HashingEmbedder:
+    """Character trigram embedding with the hashing trick, as an offline stand-in for an embedding model
+
+    Trigrams let "recycled" match "recycling", which BM25's whole words do
+    not, so the two sides of the hybrid disagree somewhat as they would with
+    a real model.
+    """
+
+    def __init__(self, dimensions=1024):
+        self.dimensions = dimensions
+        self.calls = 0
+
+    def _vector(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for term in ChatWeb.terms(text):
+            padded = f"#{term}#"
+            for i in range(len(padded) - 2):
+                vector[zlib.crc32(padded[i:i + 3].encode()) % self.dimensions] += 1.0
+        return vector
+
+    def embed(self, texts):
+        self.calls += 1
+        if isinstance(texts, str):
+            return self._vector(texts)
+        return [self._vector(text) for text in texts]
+
+
+class CountingEmbedder:
+    """Counts the requests sent to a real embedding model"""
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = 0
+
+    def embed(self, texts):
+        self.calls += 1
+        return self.model.embed(texts)
+
+
+def load_page(path, max_tokens, overlap_tokens):
+    """Extract and chunk a saved page; returns (title, chunks, chunk seconds, index seconds)"""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        html = f.read()
+    start = time.perf_counter()
+    extractor = ChatWeb.TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    extractor.flush()
+    fragments = extractor.pop_fragments()
+    spans = list(ChatWeb.iter_chunk_spans(ChatWeb.iter_sentence_spans(fragments), max_tokens, overlap_tokens))
+    chunks = ChatWeb.TextChunks(' '.join(fragments), spans)
+    chunk_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    chunks.lexical_index()
+    return extractor.title or os.path.basename(path), chunks, chunk_seconds, time.perf_counter() - start
+
+
+def load_questions(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def score(rankings, depth, top_k):
+    """hit@1, hit@k and MRR of the rank of each question's first relevant chunk (None if not retrieved)"""
+    ranks = [next((position for position, relevant in enumerate(ranking[:depth], 1) if relevant), None)
+             for ranking in rankings]
+    return {"hit@1": round(sum(rank == 1 for rank in ranks) / len(ranks), 3),
+            f"hit@{top_k}": round(sum(rank is not None and rank <= top_k for rank in ranks) / len(ranks), 3),
+            f"mrr@{depth}": round(sum(1 / rank for rank in ranks if rank) / len(ranks), 3)}
+
+
+def run_mode(name, questions, pages, index, embedder, depth, top_k):
+    """Ask every question of its own page and of the whole corpus with one retrieval mode"""
+    results = {}
+    for scope in ("page", "corpus"):
+        rankings, seconds = [], []
+        calls_before = embedder.calls
+        # Each mode starts without memoized query embeddings, so it pays for its own
+        ChatWeb.query_embedding_memo = ChatWeb.LRUCache(ChatWeb.QUERY_EMBED_MEMO_SIZE)
+        for question in questions:
+            page = pages[question["page"]]
+            answer = question["answer"].casefold()
+            start = time.perf_counter()
+            if MODES[name] is None:
+                chunk_ids = list(range(min(depth, len(page["chunks"]) if scope == "page" else len(index))))
+            else:
+                mode, ChatWeb.LEXICAL_PREFILTER = MODES[name]
+                if scope == "page":
+                    chunk_ids = ChatWeb.find_relevant_chunk_ids(question["question"], page["chunks"], page["embeddings"],
+                                                                depth, mode=mode)
+                else:
+                    chunk_ids = [chunk_id for chunk_id, _ in ChatWeb.search_corpus(index, question["question"], depth, mode=mode)]
+            seconds.append(time.perf_counter() - start)
+            if scope == "page":
+                rankings.append([answer in page["chunks"][chunk_id].casefold() for chunk_id in chunk_ids])
+            else:
+                rankings.append([url == question["page"] and answer in text.casefold()
+                                 for text, url, _ in map(index.chunk, chunk_ids)])
+        results[scope] = {**score(rankings, depth, top_k),
+                          "p50_ms": round(float(np.percentile(seconds, 50)) * 1000, 3),
+                          "p95_ms": round(float(np.percentile(seconds, 95)) * 1000, 3),
+                          "embedding_calls_per_query": round((embedder.calls - calls_before) / len(questions), 2)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", default=PAGES, help="folder of saved .html pages")
+    parser.add_argument("--questions", default=QUESTIONS, help="JSON lines of {page, question, answer}")
+    parser.add_argument("--chunk-tokens", type=int, default=64, help="small enough that each page has many chunks")
+    parser.add_argument("--top-k", type=int, default=3, help="chunks ChatWeb passes to the model")
+    parser.add_argument("--depth", type=int, default=10, help="ranking depth for MRR")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--lmstudio", action="store_true", help="embed with the real embedding model")
+    args = parser.parse_args()
+
+    if args.lmstudio:
+        import lmstudio as lms
+        embedder = CountingEmbedder(lms.embedding_model(ChatWeb.EMBEDDING_MODEL_KEY))
+    else:
+        embedder = HashingEmbedder()
+    ChatWeb.embedding_model = embedder
+    ChatWeb.embeddings_available = True
+
+    questions = load_questions(args.questions)
+    pages = {}
+    index = ChatWeb.VectorIndex(mode="exact")
+    chunk_seconds = index_seconds = embed_seconds = 0.0
+    for name in sorted(os.listdir(args.pages)):
+        if not name.lower().endswith((".html", ".htm")):
+            continue
+        title, chunks, chunked, indexed = load_page(os.path.join(args.pages, name), args.chunk_tokens, args.chunk_tokens // 8)
+        start = time.perf_counter()
+        embeddings = ChatWeb.create_embeddings(list(chunks), model=embedder)
+        embed_seconds += time.perf_counter() - start
+        chunk_seconds += chunked
+        index_seconds += indexed
+        pages[name] = {"title": title, "chunks": chunks, "embeddings": embeddings}
+        # Corpus chunks are attributed to the saved page's file name, which is what questions refer to
+        index.add_page(name, title, chunks, embeddings)
+    questions = [question for question in questions if question["page"] in pages]
+    if not questions:
+        parser.error("no question refers to a page in --pages")
+    index.build()
+    start = time.perf_counter()
+    index.lexical_index()
+    merge_seconds = time.perf_counter() - start
+
+    modes = {name: run_mode(name, questions, pages, index, embedder, args.depth, args.top_k) for name in args.modes}
+    print(json.dumps({"embedder": "lmstudio" if args.lmstudio else "hashing", "pages": len(pages),
+                      "chunks": len(index), "questions": len(questions), "chunk_tokens": args.chunk_tokens,
+                      "chunking_ms": round(chunk_seconds * 1000, 3), "bm25_index_ms": round(index_seconds * 1000, 3),
+                      "bm25_merge_ms": round(merge_seconds * 1000, 3), "embedding_ms": round(embed_seconds * 1000, 3),
+                      "modes": modes}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Measure accuracy and cost of sorting_agent's embedding router on labelled fixtures.
+
+Each labelled description is routed against the category prototypes at
+several margins. For each margin the report gives the share of images sorted
+on the fast path, how many of those were sorted correctly, and the agent
+rounds left to pay for the rest. An agent-sorted image costs about three
+agent rounds (list, describe, move); a routed one costs one embedding call.
+
+By default, descriptions come from benchmarks/fixtures/routing_descriptions.jsonl
+and are embedded by a local hashing embedder, so no LM Studio instance is
+needed. --lmstudio uses the real embedding model instead. --images DIR
+describes labelled images (DIR/<category>/<image>) with the vision model first.
+
+    python benchmarks/bench_routing.py
+    python benchmarks/bench_routing.py --lmstudio --images labelled_photos
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import zlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sorting_agent  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "routing_descriptions.jsonl")
+AGENT_ROUNDS_PER_IMAGE = 3
+STOP_WORDS = {"a", "an", "the", "of", "in", "on", "at", "and", "or", "is", "are", "with", "its", "it", "to", "by",
+              "from", "for", "as", "such", "some", "his", "her", "their", "them", "there", "no", "this", "that"}
+
+
+class HashingEmbedder:
+    """Bag-of-words embedding with the hashing trick, as an offline stand-in for an embedding model"""
+
+    def __init__(self, dimensions=512):
+        self.dimensions = dimensions
+        self.calls = 0
+
+    def _vector(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in re.findall(r"[a-z]+", text.lower()):
+            if word in STOP_WORDS:
+                continue
+            # Crude stemming so "cars" and "car" land in the same bucket
+            word = word[:-1] if len(word) > 3 and word.endswith("s") else word
+            vector[zlib.crc32(word.encode()) % self.dimensions] += 1.0
+        return vector
+
+    def embed(self, texts):
+        self.calls += 1
+        if isinstance(texts, str):
+            return self._vector(texts)
+        return [self._vector(text) for text in texts]
+
+
+def load_fixtures(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def describe_images(folder):
+    """Describe every image of a labelled folder with the vision model"""
+    import lmstudio as lms
+    image_model = lms.llm("gemma-3-4b-it")
+    sorting_agent.source_folder = folder
+    items = []
+    for category in sorted(os.listdir(folder)):
+        category_folder = os.path.join(folder, category)
+        if category not in sorting_agent.CATEGORIES or not os.path.isdir(category_folder):
+            continue
+        for name in sorted(os.listdir(category_folder)):
+            if name.lower().endswith(sorting_agent.IMAGE_EXTENSIONS):
+                description = sorting_agent.describe_image(os.path.join(category, name), image_model)
+                items.append({"category": category, "description": description})
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures", default=FIXTURES, help="JSON lines of {category, description}")
+    parser.add_argument("--images", help="folder of labelled images to describe with the vision model instead")
+    parser.add_argument("--lmstudio", action="store_true", help="embed with the LM Studio embedding model")
+    parser.add_argument("--margins", type=float, nargs="+", default=[0.0, 0.01, 0.02, 0.04, 0.08, 0.16])
+    args = parser.parse_args()
+
+    items = describe_images(args.images) if args.images else load_fixtures(args.fixtures)
+    if args.lmstudio:
+        import lmstudio as lms
+        embedder = lms.embedding_model(sorting_agent.ROUTER_EMBEDDING_MODEL)
+    else:
+        embedder = HashingEmbedder()
+
+    router = sorting_agent.CategoryRouter(embedder)
+    start = time.perf_counter()
+    decisions = [(item["category"],) + router.classify(item["description"]) for item in items]
+    embed_ms = (time.perf_counter() - start) / len(items) * 1000
+
+    results = []
+    for margin in args.margins:
+        routed = [(label, category) for label, category, lead in decisions if lead >= margin]
+        correct = sum(1 for label, category in routed if label == category)
+        deferred = len(items) - len(routed)
+        results.append({
+            "margin": margin,
+            "fast_path_rate": round(len(routed) / len(items), 3),
+            "fast_path_accuracy": round(correct / len(routed), 3) if routed else None,
+            "misrouted": len(routed) - correct,
+            "agent_images": deferred,
+            "agent_rounds": deferred * AGENT_ROUNDS_PER_IMAGE,
+            "agent_rounds_saved": len(routed) * AGENT_ROUNDS_PER_IMAGE,
+        })
+
+    print(json.dumps({"images": len(items), "embedder": "lmstudio" if args.lmstudio else "hashing",
+                      "embed_ms_per_image": round(embed_ms, 3), "margins": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Benchmark sorting_agent batch mode against the per-image agent loop.
+
+Both runs talk to a local fake vision model that answers after a configured
+latency, so no LM Studio instance is needed. The agent-loop baseline makes
+the same tool calls the act() loop makes for each image (list, describe,
+move), each behind one agent round-trip.
+
+    python benchmarks/bench_sorting.py --images 200 --latency 0.05 --workers 8
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import lmstudio as lms
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sorting_agent  # noqa: E402
+
+
+class FakeVisionModel:
+    """Answers every request after a fixed latency, like a model behind a server"""
+
+    def __init__(self, latency, ambiguous_rate=0.05, seed=0):
+        self.latency = latency
+        self.ambiguous_rate = ambiguous_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def respond(self, chat, response_format=None, **kwargs):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            category = self.random.choice(list(sorting_agent.CATEGORIES))
+            confidence = 0.3 if self.random.random() < self.ambiguous_rate else 0.9
+        answer = {"description": f"A picture that looks like {category}.", "category": category, "confidence": confidence}
+        return SimpleNamespace(parsed=answer, content=json.dumps(answer))
+
+
+class FakeClient:
+    """Stand-in for the image upload endpoint"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def prepare_image(self, src, name=None):
+        time.sleep(self.latency)
+        size = len(src) if isinstance(src, bytes) else os.path.getsize(src)
+        return lms.history.FileHandle(name=name or "image.jpg", identifier=f"file-{id(src)}",
+                                      size_bytes=size, file_type="image")
+
+
+def make_images(count):
+    for i in range(count):
+        color = (i * 37 % 256, i * 91 % 256, i * 13 % 256)
+        Image.new("RGB", (64, 48), color).save(os.path.join(sorting_agent.source_folder, f"image_{i:06d}.jpg"))
+
+
+def run_agent_loop(vision, client, agent_latency):
+    """Replay the tool calls of the act() loop, one agent round-trip per call"""
+    count = 0
+    while True:
+        time.sleep(agent_latency)
+        image_name = sorting_agent.list_images_to_process()
+        if image_name.startswith("There are no more images"):
+            return count
+        time.sleep(agent_latency)
+        answer = sorting_agent.classify_image(image_name, vision)
+        time.sleep(agent_latency)
+        sorting_agent.move_image(image_name, answer["category"])
+        count += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="vision model latency per image (s)")
+    parser.add_argument("--agent-latency", type=float, default=0.05, help="agent model latency per round (s)")
+    parser.add_argument("--upload-latency", type=float, default=0.005, help="prepare_image latency (s)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    results = []
+    devnull = open(os.devnull, "w")
+    with tempfile.TemporaryDirectory() as root:
+        os.chdir(root)
+        sorting_agent.create_folders()
+        client = FakeClient(args.upload_latency)
+
+        make_images(args.images)
+        vision = FakeVisionModel(args.latency)
+        sorting_agent.image_preparer = sorting_agent.ImagePreparer(client)
+        sorting_agent.image_queue = sorting_agent.ImageQueue(sorting_agent.source_folder)
+        start = time.perf_counter()
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            sorted_count = run_agent_loop(vision, client, args.agent_latency)
+        finally:
+            sys.stdout = stdout
+        elapsed = time.perf_counter() - start
+        results.append({"mode": "agent loop", "workers": 1, "images": sorted_count, "seconds": round(elapsed, 3),
+                        "images_per_second": round(sorted_count / elapsed, 2)})
+
+        for workers in args.workers:
+            for folder in sorting_agent.CATEGORIES.values():
+                for name in os.listdir(folder):
+                    os.replace(os.path.join(folder, name), os.path.join(sorting_agent.source_folder, name))
+            vision = FakeVisionModel(args.latency)
+            sorting_agent.image_preparer = sorting_agent.ImagePreparer(client)
+            sorting_agent.image_queue = sorting_agent.ImageQueue(sorting_agent.source_folder)
+            start = time.perf_counter()
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                ambiguous = sorting_agent.sort_images_batch(vision, workers=workers)
+            finally:
+                sys.stdout = stdout
+            elapsed = time.perf_counter() - start
+            results.append({"mode": "batch", "workers": workers, "images": args.images - len(ambiguous),
+                            "ambiguous": len(ambiguous), "seconds": round(elapsed, 3),
+                            "images_per_second": round(args.images / elapsed, 2)})
+        os.chdir(os.path.dirname(root))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
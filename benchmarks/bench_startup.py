@@ -0,0 +1,131 @@
+"""Measure sorting_agent's startup time, peak memory and model instances loaded.
+
+Each import is timed in a fresh interpreter, which also reports its peak
+resident memory. The "before" import first pulls in torch and transformers,
+as the original script did; it is skipped when they are not installed.
+
+Model loading is counted with a fake client. The original script loaded
+the vision model twice (lms.llm and load_new_instance) and only unloaded
+on success. The ModelRegistry run loads each model once, shares it between
+the agent and the vision calls, and unloads on exit. Both runs end with an
+error, to count leaked instances. Memory per instance is an estimate
+(--model-gb).
+
+    python benchmarks/bench_startup.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import sorting_agent  # noqa: E402
+
+LEGACY_IMPORTS = "import torch\nfrom transformers import AutoProcessor, AutoModelForCausalLM\n"
+IMPORT_SCRIPT = """
+import resource, sys, time
+start = time.perf_counter()
+{imports}import sorting_agent
+seconds = time.perf_counter() - start
+print(seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def time_import(imports, repeat):
+    """Median import time and peak memory over fresh interpreters, or the error if an import fails"""
+    seconds = []
+    peak_kb = []
+    for _ in range(repeat):
+        run = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT.format(imports=imports)], cwd=ROOT,
+                             capture_output=True, text=True)
+        if run.returncode:
+            return {"available": False, "error": run.stderr.strip().splitlines()[-1]}
+        elapsed, peak = run.stdout.split()
+        seconds.append(float(elapsed))
+        peak_kb.append(int(peak))
+    return {"available": True, "seconds": round(statistics.median(seconds), 3),
+            "peak_mb": round(statistics.median(peak_kb) / 1024, 1)}
+
+
+class FakeModel:
+    def __init__(self, host, key):
+        self.host = host
+        self.key = key
+
+    def unload(self):
+        self.host.loaded.remove(self)
+
+
+class FakeHost:
+    """Counts the model instances loaded on a fake LM Studio host"""
+
+    def __init__(self):
+        self.loaded = []
+        self.loads = 0
+
+    def load(self, key):
+        self.loads += 1
+        model = FakeModel(self, key)
+        self.loaded.append(model)
+        return model
+
+
+def sort_images():
+    raise RuntimeError("sorting failed")
+
+
+def legacy_models(host, key):
+    """The original flow: two instances of the same model, unloaded only on success"""
+    try:
+        model = host.load(key)        # lms.llm(key)
+        image_model = host.load(key)  # client.llm.load_new_instance(key)
+        sort_images()
+        model.unload()
+        image_model.unload()
+    except RuntimeError:
+        pass
+    return len(host.loaded)
+
+
+def registry_models(host, key):
+    """The registry flow: both users share one lazily loaded instance, unloaded on exit"""
+    registry = sorting_agent.ModelRegistry(loaders={"llm": host.load})
+    agent_model = registry.lazy(key)
+    image_model = registry.lazy(key)
+    try:
+        with registry:
+            image_model.key
+            agent_model.key
+            peak = len(host.loaded)
+            sort_images()
+    except RuntimeError:
+        pass
+    return peak, len(host.loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per import measurement")
+    parser.add_argument("--model-gb", type=float, default=3.3, help="estimated host memory per loaded model instance")
+    args = parser.parse_args()
+
+    legacy_host = FakeHost()
+    leaked = legacy_models(legacy_host, sorting_agent.IMAGE_MODEL)
+    registry_host = FakeHost()
+    peak, left = registry_models(registry_host, sorting_agent.IMAGE_MODEL)
+
+    print(json.dumps({
+        "import_before": time_import(LEGACY_IMPORTS, args.repeat),
+        "import_after": time_import("", args.repeat),
+        "models_before": {"loads": legacy_host.loads, "host_gb": round(legacy_host.loads * args.model_gb, 1),
+                          "left_loaded_after_error": leaked},
+        "models_after": {"loads": registry_host.loads, "host_gb": round(peak * args.model_gb, 1),
+                         "left_loaded_after_error": left},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
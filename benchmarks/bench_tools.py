@@ -0,0 +1,88 @@
+"""Time act() tool rounds with plain tools against tools run through tool_runner.ToolRunner.
+
+A fake LM Studio server (fake_lmstudio.py) plays the model: every round it
+asks for --calls-per-round tool calls, drawn from --distinct-arguments
+argument values, so calls repeat within a round and across rounds, as a
+model checking its work does. Each tool call sleeps --tool-seconds.
+
+The plain run passes the functions to act() as they are, one call at a time
+(the SDK default). The runner run marks the tool pure and lets act() run a
+round's calls in parallel, capped by the runner's pool. Both runs make the
+same model requests, so the difference is tool time.
+
+    python benchmarks/bench_tools.py --rounds 6 --calls-per-round 6 --distinct-arguments 8 --tool-seconds 0.05
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+sys.path.insert(0, BENCHMARKS)
+import lmstudio as lms  # noqa: E402
+from fake_lmstudio import FakeLMStudio, FakeReply  # noqa: E402
+from tool_runner import ToolRunner  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=6, help="tool rounds per run")
+    parser.add_argument("--calls-per-round", type=int, default=6)
+    parser.add_argument("--distinct-arguments", type=int, default=8, help="different argument values the calls draw from")
+    parser.add_argument("--tool-seconds", type=float, default=0.05, help="time each tool call takes")
+    parser.add_argument("--workers", type=int, default=4, help="tool calls the runner runs at once")
+    parser.add_argument("--latency", type=float, default=0.01, help="fake model time to first token (s)")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    plan = [[f"item-{rng.randrange(args.distinct_arguments)}" for _ in range(args.calls_per_round)]
+            for _ in range(args.rounds)]
+
+    def responder(request):
+        round_index = len(request.tool_results) // args.calls_per_round
+        if round_index < len(plan):
+            return FakeReply("Looking these up.", [("lookup", {"key": key}) for key in plan[round_index]])
+        return FakeReply("Done.")
+
+    def lookup(key: str) -> str:
+        """Return the stored value for a key"""
+        time.sleep(args.tool_seconds)
+        return key.upper()
+
+    server = FakeLMStudio(latency=args.latency, tokens_per_second=1e6, responder=responder).start()
+    lms.configure_default_client(server.api_host)
+    model = lms.llm()
+
+    def run(tools, max_parallel_tool_calls):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = model.act("Look up the items.", tools, max_prediction_rounds=args.rounds + 2,
+                               max_parallel_tool_calls=max_parallel_tool_calls)
+        return {"seconds": round(time.perf_counter() - start, 3), "model_rounds": result.rounds}
+
+    plain = run([lookup], 1)
+    runner = ToolRunner(max_workers=args.workers)
+    wrapped = run([runner.wrap(lookup, pure=True)], args.workers)
+    stats = runner.summary()["lookup"]
+    runner.close()
+
+    lms.get_default_client().close()
+    server.stop()
+    calls = args.rounds * args.calls_per_round
+    print(json.dumps({
+        "tool_calls": calls,
+        "distinct_calls": len({key for keys in plan for key in keys}),
+        "plain": dict(plain, tool_seconds=round(calls * args.tool_seconds, 3)),
+        "runner": dict(wrapped, tool_seconds=stats["seconds"], cache_hits=stats["hits"],
+                       hit_rate=round(stats["hit_rate"], 3), saved_seconds=stats["saved_seconds"]),
+        "speedup": round(plain["seconds"] / wrapped["seconds"], 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+"""A local stand-in for the LM Studio server, to run and time the examples offline.
+
+FakeLMStudio speaks the websocket protocol of the lmstudio client: the
+greeting probe, authentication, model get-or-load, listing and unloading,
+streamed predictions with tool calls and structured output, string
+embeddings and image uploads. Predictions wait a time to first token and
+then stream at a set number of tokens per second, with a limited number of
+predictions served at once, like LM Studio's parallel slots. A share of
+requests can be made to fail.
+
+What the model says comes from a responder: a function given a FakeRequest
+(history, tools, JSON schema) that returns a FakeReply with text and/or tool
+calls. The default one returns filler text, or JSON following the schema.
+Embeddings are hashed bags of words, so related texts are close.
+
+    with FakeLMStudio(latency=0.05, tokens_per_second=200) as server:
+        lms.configure_default_client(server.api_host)
+        print(lms.llm().respond("Hello"))
+    print(server.report())
+"""
+import asyncio
+import base64
+import json
+import random
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import AcceptConnection, CloseConnection, Ping, Request, TextMessage
+
+FILLER_WORDS = ("the", "model", "answers", "with", "a", "short", "plain", "sentence", "about", "this", "topic")
+
+
+class FakeReply:
+    """What the fake model says: text, tool calls as (name, arguments) pairs, or both"""
+
+    def __init__(self, text="", tool_calls=()):
+        self.text = text
+        self.tool_calls = list(tool_calls)
+
+
+class FakeRequest:
+    """A prediction request as the responder sees it"""
+
+    def __init__(self, model_key, messages, tools, schema):
+        self.model_key = model_key
+        self.messages = messages
+        self.tools = tools
+        self.schema = schema
+
+    @property
+    def tool_names(self):
+        return [tool["function"]["name"] for tool in self.tools]
+
+    def texts(self, role):
+        """Text of every message with this role, oldest first"""
+        return ["".join(part.get("text", "") for part in message["content"])
+                for message in self.messages if message["role"] == role]
+
+    @property
+    def prompt(self):
+        texts = self.texts("user")
+        return texts[-1] if texts else ""
+
+    @property
+    def tool_results(self):
+        """Results of the tool calls made since the last user message, oldest first"""
+        results = []
+        for message in self.messages:
+            if message["role"] == "user":
+                results = []
+            elif message["role"] == "tool":
+                results.extend(part["content"] for part in message["content"])
+        return results
+
+    @property
+    def tool_calls_made(self):
+        """(name, arguments) of the tool calls made since the last user message"""
+        calls = []
+        for message in self.messages:
+            if message["role"] == "user":
+                calls = []
+            elif message["role"] == "assistant":
+                calls.extend((part["toolCallRequest"]["name"], part["toolCallRequest"].get("arguments") or {})
+                             for part in message["content"] if part["type"] == "toolCallRequest")
+        return calls
+
+
+def value_for_schema(schema, seed):
+    """A value following a JSON schema: the first enum value or one picked by seed, 0.9 for numbers"""
+    if "enum" in schema:
+        return schema["enum"][seed % len(schema["enum"])]
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: value_for_schema(field, seed) for name, field in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [value_for_schema(schema.get("items", {}), seed)]
+    if kind in ("number", "integer"):
+        value = max(schema.get("minimum", 0.9), min(schema.get("maximum", 0.9), 0.9))
+        return int(value) if kind == "integer" else value
+    if kind == "boolean":
+        return True
+    return " ".join(FILLER_WORDS[:8])
+
+
+def default_responder(request, words=40):
+    """Filler text of a fixed length, or JSON following the requested schema"""
+    seed = zlib.crc32(request.prompt.encode("utf-8"))
+    if request.schema is not None:
+        return FakeReply(json.dumps(value_for_schema(request.schema, seed)))
+    return FakeReply(" ".join(FILLER_WORDS[(seed + i) % len(FILLER_WORDS)] for i in range(words)))
+
+
+def hashed_embedding(text, dimensions):
+    """Bag-of-words vector with the hashing trick, normalized"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        vector[zlib.crc32(word.encode("utf-8")) % dimensions] += 1.0
+    vector[zlib.crc32(text.encode("utf-8")) % dimensions] += 0.01  # Never all zeros
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+class FakeLMStudio:
+    """Serves the LM Studio websocket API from a background thread on a free local port"""
+
+    def __init__(self, latency=0.05, tokens_per_second=200.0, embed_latency=0.002, failure_rate=0.0,
+                 parallel=4, responder=None, dimensions=768, context_length=8192,
+                 llm_key="fake-llm", embedding_key="nomic-embed-text-v1.5", seed=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.embed_latency = embed_latency
+        self.failure_rate = failure_rate
+        self.parallel = parallel
+        self.responder = responder or default_responder
+        self.dimensions = dimensions
+        self.context_length = context_length
+        self.defaults = {"llm": llm_key, "embedding": embedding_key}
+        self.random = random.Random(seed)
+        self.loaded = {"llm": {}, "embedding": {}}
+        self.requests = []  # (endpoint, seconds, ok)
+        self.uploads = 0
+        self.sessions = set()
+        self.connections = set()
+        self.port = None
+        self.loop = None
+        self.thread = None
+
+    @property
+    def api_host(self):
+        return f"127.0.0.1:{self.port}"
+
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.slots = asyncio.Semaphore(self.parallel)
+            server = self.loop.run_until_complete(asyncio.start_server(self._serve, "127.0.0.1", 0))
+            self.port = server.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+            server.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._cancel_tasks(), self.loop).result(timeout=5)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=5)
+            self.loop = None
+
+    async def _cancel_tasks(self):
+        # Closing the connections lets their handlers return; only work in progress is cancelled
+        for session in list(self.sessions):
+            session.close()
+            session.writer.close()
+        if self.connections:
+            await asyncio.wait(list(self.connections), timeout=2)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    def report(self):
+        """Calls, failures and latency percentiles per endpoint"""
+        endpoints = {}
+        for endpoint, seconds, ok in list(self.requests):
+            entry = endpoints.setdefault(endpoint, {"calls": 0, "failures": 0, "seconds": []})
+            entry["calls"] += 1
+            entry["failures"] += not ok
+            entry["seconds"].append(seconds)
+        for entry in endpoints.values():
+            seconds = entry.pop("seconds")
+            entry["p50_ms"] = round(percentile(seconds, 0.5) * 1000, 2)
+            entry["p95_ms"] = round(percentile(seconds, 0.95) * 1000, 2)
+        return endpoints
+
+    def round_trips(self):
+        """Predictions and remote calls served, excluding the connection setup"""
+        return sum(1 for endpoint, _, _ in self.requests if endpoint not in ("getOrLoad", "listLoaded"))
+
+    # Connections
+
+    async def _serve(self, reader, writer):
+        connection_task = asyncio.current_task()
+        self.connections.add(connection_task)
+        try:
+            await self._serve_connection(reader, writer)
+        finally:
+            self.connections.discard(connection_task)
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        if b"upgrade: websocket" not in head.lower():
+            await self._serve_http(head, writer)
+            return
+
+        connection = WSConnection(ConnectionType.SERVER)
+        connection.receive_data(head)
+        namespace = None
+        for event in connection.events():
+            if isinstance(event, Request):
+                namespace = event.target.strip("/")
+                writer.write(connection.send(AcceptConnection()))
+        session = _Session(self, namespace, connection, writer)
+        self.sessions.add(session)
+
+        text = []
+        closed = False
+        while not closed:
+            try:
+                data = await reader.read(65536)
+            except ConnectionError:
+                data = b""
+            if not data:
+                break
+            connection.receive_data(data)
+            for event in connection.events():
+                if isinstance(event, TextMessage):
+                    text.append(event.data)
+                    if event.message_finished:
+                        session.receive(json.loads("".join(text)))
+                        text = []
+                elif isinstance(event, Ping):
+                    writer.write(connection.send(event.response()))
+                elif isinstance(event, CloseConnection):
+                    writer.write(connection.send(event.response()))
+                    closed = True
+        self.sessions.discard(session)
+        session.close()
+        writer.close()
+
+    async def _serve_http(self, head, writer):
+        path = head.split(b" ", 2)[1] if head.count(b" ") >= 2 else b"/"
+        if path.startswith(b"/lmstudio-greeting"):
+            status, body = b"200 OK", json.dumps({"lmstudio": True}).encode()
+        else:
+            status, body = b"404 Not Found", b"{}"
+        writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Type: application/json\r\nContent-Length: "
+                     + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+        await writer.drain()
+        writer.close()
+
+    # Models
+
+    def _instance_info(self, namespace, key, identifier=None):
+        identifier = identifier or key
+        info = {"type": namespace, "modelKey": key, "format": "gguf", "displayName": key, "path": f"fake/{key}",
+                "sizeBytes": 1 << 30, "identifier": identifier, "instanceReference": f"ref-{identifier}",
+                "maxContextLength": self.context_length, "contextLength": self.context_length}
+        if namespace == "llm":
+            info.update(vision=True, trainedForToolUse=True)
+        return info
+
+    def _load(self, namespace, key):
+        models = self.loaded[namespace]
+        if key not in models:
+            models[key] = self._instance_info(namespace, key)
+        return models[key]
+
+    def _fails(self):
+        return self.failure_rate and self.random.random() < self.failure_rate
+
+
+class _Session:
+    """One websocket connection: authentication, then channels and remote calls"""
+
+    def __init__(self, server, namespace, connection, writer):
+        self.server = server
+        self.namespace = namespace
+        self.connection = connection
+        self.writer = writer
+        self.authenticated = False
+        self.tasks = set()
+        self.cancelled = set()
+
+    def send(self, message):
+        if not self.writer.is_closing():
+            self.writer.write(self.connection.send(TextMessage(data=json.dumps(message))))
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+
+    def receive(self, message):
+        if not self.authenticated:
+            self.authenticated = True
+            self.send({"success": True})
+            return
+        kind = message.get("type")
+        if kind == "channelCreate":
+            self._spawn(self._channel(message["endpoint"], message["channelId"], message.get("creationParameter") or {}))
+        elif kind == "rpcCall":
+            self._spawn(self._call(message["endpoint"], message["callId"], message.get("parameter") or {}))
+        elif kind == "channelSend" and message.get("message", {}).get("type") == "cancel":
+            self.cancelled.add(message["channelId"])
+
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _channel(self, endpoint, channel_id, parameter):
+        start = time.perf_counter()
+        ok = True
+        try:
+            if endpoint in ("getOrLoad", "loadModel"):
+                key = parameter.get("modelKey") or parameter["identifier"]
+                info = self.server._load(self.namespace, key)
+                self.send({"type": "channelSend", "channelId": channel_id,
+                           "message": {"type": "success", "info": info}})
+            elif endpoint == "predict":
+                ok = await self._predict(channel_id, parameter)
+            else:
+                raise ValueError(f"Unknown channel endpoint {endpoint}")
+            self.send({"type": "channelClose", "channelId": channel_id})
+        except Exception as e:
+            ok = False
+            self.send({"type": "channelError", "channelId": channel_id, "error": {"title": str(e)}})
+        finally:
+            self.server.requests.append((endpoint, time.perf_counter() - start, ok))
+
+    async def _predict(self, channel_id, parameter):
+        server = self.server
+        fields = {field["key"]: field["value"] for layer in parameter["predictionConfigStack"]["layers"]
+                  for field in layer["config"]["fields"]}
+        tools = fields.get("llm.prediction.tools", {}).get("tools", [])
+        structured = fields.get("llm.prediction.structured") or {}
+        schema = structured.get("jsonSchema") if structured.get("type") == "json" else None
+        specifier = parameter["modelSpecifier"]
+        model_key = specifier.get("query", {}).get("identifier") or server.defaults["llm"]
+        request = FakeRequest(model_key, parameter["history"]["messages"], tools, schema)
+
+        def send(message):
+            self.send({"type": "channelSend", "channelId": channel_id, "message": message})
+
+        async with server.slots:
+            start = time.perf_counter()
+            await asyncio.sleep(server.latency)
+            if server._fails():
+                send({"type": "error", "error": {"title": "Injected failure"}})
+                return False
+            reply = server.responder(request)
+            first_token = time.perf_counter() - start
+            prompt_tokens = len(json.dumps(request.messages)) // 4
+
+            predicted = 0
+            words = reply.text.split(" ") if reply.text else []
+            for i, word in enumerate(words):
+                if channel_id in self.cancelled:
+                    break
+                await asyncio.sleep(1 / server.tokens_per_second)
+                send({"type": "fragment", "fragment": {"content": (" " if i else "") + word, "tokensCount": 1,
+                                                        "containsDrafted": False, "reasoningType": "none"}})
+                predicted += 1
+            for i, (name, arguments) in enumerate(reply.tool_calls):
+                send({"type": "toolCallGenerationStart"})
+                await asyncio.sleep(len(json.dumps(arguments)) / 4 / server.tokens_per_second)
+                send({"type": "toolCallGenerationEnd", "toolCallRequest": {
+                    "type": "function", "id": f"call-{channel_id}-{i}", "name": name, "arguments": arguments}})
+                predicted += len(json.dumps(arguments)) // 4 + 1
+
+            elapsed = time.perf_counter() - start
+            info = server._load("llm", model_key)
+            send({"type": "success",
+                  "stats": {"stopReason": "toolCalls" if reply.tool_calls else "eosFound",
+                            "tokensPerSecond": predicted / max(elapsed - first_token, 1e-6),
+                            "timeToFirstTokenSec": first_token, "promptTokensCount": prompt_tokens,
+                            "predictedTokensCount": predicted, "totalTokensCount": prompt_tokens + predicted},
+                  "modelInfo": {key: value for key, value in info.items()
+                                if key not in ("identifier", "instanceReference", "contextLength")},
+                  "loadModelConfig": {"fields": []}, "predictionConfig": {"fields": []}})
+        return True
+
+    async def _call(self, endpoint, call_id, parameter):
+        server = self.server
+        start = time.perf_counter()
+        ok = True
+        try:
+            if endpoint == "embedString":
+                await asyncio.sleep(server.embed_latency)
+            if server._fails() and endpoint not in ("listLoaded", "getModelInfo"):
+                ok = False
+                self.send({"type": "rpcError", "callId": call_id, "error": {"title": "Injected failure"}})
+                return
+            result = self._result(endpoint, parameter)
+        except Exception as e:
+            ok = False
+            self.send({"type": "rpcError", "callId": call_id, "error": {"title": str(e)}})
+            return
+        finally:
+            server.requests.append((endpoint, time.perf_counter() - start, ok))
+        message = {"type": "rpcResult", "callId": call_id}
+        if result is not None:
+            message["result"] = result
+        self.send(message)
+
+    def _result(self, endpoint, parameter):
+        server = self.server
+        namespace = self.namespace
+        if endpoint == "listLoaded":
+            if not server.loaded[namespace]:
+                server._load(namespace, server.defaults[namespace])
+            return list(server.loaded[namespace].values())
+        if endpoint == "getModelInfo":
+            specifier = parameter["specifier"]
+            key = specifier.get("query", {}).get("identifier") or server.defaults[namespace]
+            return server._load(namespace, key)
+        if endpoint == "unloadModel":
+            server.loaded[namespace].pop(parameter["identifier"], None)
+            return None
+        if endpoint == "embedString":
+            return {"embedding": hashed_embedding(parameter["inputString"], server.dimensions)}
+        if endpoint == "countTokens":
+            return {"tokenCount": len(parameter["inputString"]) // 4 + 1}
+        if endpoint == "tokenize":
+            return {"tokens": list(range(len(parameter["inputString"]) // 4 + 1))}
+        if endpoint == "uploadFileBase64":
+            server.uploads += 1
+            size = len(base64.b64decode(parameter["contentBase64"]))
+            return {"identifier": f"file-{server.uploads}", "fileType": "image", "sizeBytes": size}
+        raise ValueError(f"Unknown endpoint {endpoint}")
@@ -0,0 +1,269 @@
+import asyncio
+import atexit
+import bisect
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+# Instrumentation configuration
+TRACE_MAX_EVENTS = 1_000_000   # Trace events kept in memory; later spans only update the metrics
+PROMETHEUS_PREFIX = "examples_"
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+class NullSpan:
+    """What span() returns while instrumentation is disabled: every method does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args):
+        pass
+
+    def record_stats(self, stats):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    """A timed section of work, written as one Chrome trace event when it ends
+
+    Spans nest through a context variable, which asyncio tasks inherit, so
+    each span knows the task it runs under: the outermost span around it.
+    Ending a span observes its duration in the span_seconds histogram, and
+    spans in the "model" category also count a model call for their task.
+    """
+
+    def __init__(self, recorder, name, category, args):
+        self.recorder = recorder
+        self.name = name
+        self.category = category
+        self.args = args
+        self.task = None
+        self.start_ns = 0
+        self.token = None
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.task = parent.task if parent is not None else self.name
+        self.token = _current_span.set(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end_ns = time.perf_counter_ns()
+        _current_span.reset(self.token)
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.recorder.finish(self, end_ns)
+        return False
+
+    def set(self, **args):
+        """Attach values shown with the span in the trace viewer"""
+        self.args.update(args)
+
+    def record_stats(self, stats):
+        """Attach a prediction's token counts and add them to the token metrics"""
+        if stats is None:
+            return
+        prompt_tokens = getattr(stats, "prompt_tokens_count", None)
+        predicted_tokens = getattr(stats, "predicted_tokens_count", None)
+        self.set(prompt_tokens=prompt_tokens, predicted_tokens=predicted_tokens)
+        self.recorder.record_tokens(self.name, prompt_tokens, predicted_tokens)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class Recorder:
+    """Collects trace events, counters and histograms for one process
+
+    Counters and histograms are keyed by name and a sorted tuple of label
+    pairs, and updated under one lock. Trace events are complete ("X") events
+    with microsecond timestamps; spans running in asyncio tasks get a track
+    of their own per task, since overlapping spans on one thread track would
+    not display.
+    """
+
+    def __init__(self, max_events=TRACE_MAX_EVENTS):
+        self.max_events = max_events
+        self.lock = threading.Lock()
+        self.events = []
+        self.dropped_events = 0
+        self.counters = {}
+        self.histograms = {}
+        self.tracks = {}
+        self.origin_ns = time.perf_counter_ns()
+        self.pid = os.getpid()
+
+    def _track(self):
+        """Trace track id and name of the current asyncio task, or of the current thread"""
+        # Checking for a running loop first avoids current_task() raising outside of one
+        task = asyncio.current_task() if asyncio._get_running_loop() is not None else None
+        if task is not None:
+            key, name = id(task), f"task {task.get_name()}"
+        else:
+            key, name = threading.get_ident(), threading.current_thread().name
+        track = self.tracks.get(key)
+        if track is None:
+            with self.lock:
+                track = self.tracks.setdefault(key, (len(self.tracks) + 1, name))
+        return track[0]
+
+    def count(self, metric, value=1, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, metric, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            position = bisect.bisect_left(buckets, value)
+            if position < len(buckets):
+                histogram["counts"][position] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def record_tokens(self, name, prompt_tokens, predicted_tokens):
+        if prompt_tokens is not None:
+            self.count("model_tokens_total", prompt_tokens, call=name, kind="prompt")
+            self.observe("model_prompt_tokens", prompt_tokens, TOKEN_BUCKETS, call=name)
+        if predicted_tokens is not None:
+            self.count("model_tokens_total", predicted_tokens, call=name, kind="predicted")
+            self.observe("model_predicted_tokens", predicted_tokens, TOKEN_BUCKETS, call=name)
+
+    def finish(self, span, end_ns):
+        seconds = (end_ns - span.start_ns) / 1e9
+        self.observe("span_seconds", seconds, category=span.category, name=span.name)
+        if "error" in span.args:
+            self.count("span_errors_total", category=span.category, name=span.name)
+        if span.category == "model":
+            self.count("model_calls_total", task=span.task, call=span.name)
+        if len(self.events) >= self.max_events:
+            self.dropped_events += 1
+            return
+        self.events.append({
+            "name": span.name, "cat": span.category, "ph": "X", "pid": self.pid, "tid": self._track(),
+            "ts": (span.start_ns - self.origin_ns) / 1000, "dur": (end_ns - span.start_ns) / 1000,
+            "args": {key: value if isinstance(value, (int, float, str, bool, type(None))) else str(value)
+                     for key, value in span.args.items()},
+        })
+
+    def chrome_trace(self):
+        """The recorded spans in the Chrome trace event format, which Perfetto also opens"""
+        names = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": track, "args": {"name": name}}
+                 for track, name in list(self.tracks.values())]
+        return {"traceEvents": names + list(self.events), "displayTimeUnit": "ms",
+                "otherData": {"dropped_events": self.dropped_events}}
+
+    def prometheus_text(self, prefix=PROMETHEUS_PREFIX):
+        """The counters and histograms in the Prometheus text exposition format"""
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+            return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, dict(value, counts=list(value["counts"]))) for key, value in self.histograms.items())
+        lines = []
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {prefix}{name} counter")
+            lines.append(f"{prefix}{name}{label_text(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {prefix}{name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(histogram["buckets"], histogram["counts"]):
+                cumulative += bucket_count
+                lines.append(f"{prefix}{name}_bucket{label_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{prefix}{name}_bucket{label_text(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{prefix}{name}_sum{label_text(labels)} {histogram['sum']}")
+            lines.append(f"{prefix}{name}_count{label_text(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, trace_path=None, prometheus_path=None):
+        if trace_path:
+            with open(trace_path, "w", encoding="utf-8") as f:
+                json.dump(self.chrome_trace(), f)
+        if prometheus_path:
+            with open(prometheus_path, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+
+# The process-wide recorder, None while instrumentation is disabled
+recorder = None
+
+def enable(trace_path=None, prometheus_path=None):
+    """Start recording, and write the trace and metrics files, if given, when the process exits"""
+    global recorder
+    if recorder is None:
+        recorder = Recorder()
+    if trace_path or prometheus_path:
+        atexit.register(recorder.write, trace_path, prometheus_path)
+    return recorder
+
+def disable():
+    """Stop recording and return what was recorded"""
+    global recorder
+    recorded, recorder = recorder, None
+    return recorded
+
+def span(name, category="app", **args):
+    """Time a block of work: with span("embed_batch", "model", texts=32) as s: ..."""
+    if recorder is None:
+        return NULL_SPAN
+    return Span(recorder, name, category, args)
+
+def traced(category="app", name=None):
+    """Decorator that runs each call of the function in a span
+
+    functools.wraps keeps the name, docstring and annotations, so decorated
+    functions still describe themselves correctly as act() tools.
+    """
+    def decorate(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if recorder is None:
+                return function(*args, **kwargs)
+            with Span(recorder, span_name, category, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(metric, value=1, **labels):
+    """Add to a counter"""
+    if recorder is not None:
+        recorder.count(metric, value, **labels)
+
+def observe(metric, value, buckets=SECONDS_BUCKETS, **labels):
+    """Add a value to a histogram"""
+    if recorder is not None:
+        recorder.observe(metric, value, buckets, **labels)
+
+def record_round(stats, call="act_round"):
+    """Count one act() prediction round and its tokens under the current task
+
+    act() runs its rounds internally, so they are counted from
+    on_prediction_completed instead of being timed as spans.
+    """
+    if recorder is None:
+        return
+    current = _current_span.get()
+    recorder.count("model_calls_total", task=current.task if current is not None else call, call=call)
+    if stats is not None:
+        recorder.record_tokens(call, getattr(stats, "prompt_tokens_count", None), getattr(stats, "predicted_tokens_count", None))
@@ -0,0 +1,134 @@
+import json
+import sys
+import time
+from colorama import Fore, Style
+
+# Rendering configuration
+RENDER_MODES = ("text", "quiet", "jsonl")
+RENDER_BUFFER_BYTES = 64 * 1024  # JSON lines buffered before they are written out
+RENDER_MAX_CHARS = None          # Longest text or tool result printed in text mode, None for no limit
+
+def tool_result_text(content):
+    """Return a tool result as plain text, decoding it if the tool returned a JSON string"""
+    if content.startswith('"'):
+        try:
+            decoded = json.loads(content)
+            if isinstance(decoded, str):
+                return decoded
+        except ValueError:
+            pass
+    return content
+
+class MessageRenderer:
+    """Renders the messages act() passes to on_message
+
+    The typed parts of each message are read directly: assistant text, tool
+    call requests (name and arguments) and tool results, so the cost is
+    linear in the size of the message. Output goes to sink (standard output
+    by default) and is buffered:
+    in "text" mode each message is written with one call, in "jsonl" mode
+    one JSON object per part is buffered up to RENDER_BUFFER_BYTES, and
+    "quiet" mode writes nothing and only counts messages. Call flush() when
+    the agent is done.
+    """
+
+    def __init__(self, mode="text", sink=None, buffer_bytes=RENDER_BUFFER_BYTES, max_chars=RENDER_MAX_CHARS):
+        if mode not in RENDER_MODES:
+            raise ValueError(f"Unknown render mode '{mode}', expected one of {', '.join(RENDER_MODES)}")
+        self.mode = mode
+        self.sink = sink
+        self.buffer_bytes = buffer_bytes
+        self.max_chars = max_chars
+        self.pending = []
+        self.pending_bytes = 0
+        self.messages = 0
+        self.tool_calls = 0
+
+    def __call__(self, message):
+        self.messages += 1
+        try:
+            if self.mode == "text":
+                self._write_text(message)
+            elif self.mode == "jsonl":
+                self._write_json_lines(message)
+            else:
+                # Still read the parts, to count tool calls
+                self._records(message)
+        except Exception as e:
+            print(f"{Fore.RED}Error rendering message: {e}{Style.RESET_ALL}")
+
+        # Return None to prevent default printing
+        return None
+
+    def _records(self, message):
+        """Turn a message into a list of plain dicts, one per content part"""
+        if isinstance(message, str):
+            return [{"time": time.time(), "role": "text", "type": "text", "text": message}]
+
+        role = getattr(message, "role", None)
+        records = []
+        for part in getattr(message, "content", None) or []:
+            part_type = getattr(part, "type", None)
+            record = {"time": time.time(), "role": role}
+            if part_type == "text":
+                record.update(type="text", text=part.text)
+            elif part_type == "toolCallRequest":
+                request = part.tool_call_request
+                self.tool_calls += 1
+                record.update(type="tool_call", id=request.id, name=request.name, arguments=request.arguments)
+            elif part_type == "toolCallResult":
+                record.update(type="tool_result", tool_call_id=part.tool_call_id, content=tool_result_text(part.content))
+            else:
+                record.update(type=part_type or type(part).__name__)
+            records.append(record)
+        return records
+
+    def _output(self, text):
+        # Resolved on each write, so redirecting sys.stdout also redirects the default sink
+        sink = self.sink or sys.stdout
+        sink.write(text)
+        sink.flush()
+
+    def _clip(self, text):
+        if self.max_chars is not None and len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}... [{len(text) - self.max_chars} more characters]"
+        return text
+
+    def _write_text(self, message):
+        records = self._records(message)
+        if not records:
+            return
+
+        role = records[0]["role"]
+        lines = []
+        if role == "assistant":
+            lines.append(f"{Fore.CYAN}Assistant:{Style.RESET_ALL}")
+        elif role == "tool":
+            lines.append(f"{Fore.YELLOW}Tool result:{Style.RESET_ALL}")
+
+        for record in records:
+            if record["type"] == "text":
+                if record["text"].strip():
+                    lines.append(self._clip(record["text"]))
+            elif record["type"] == "tool_call":
+                arguments = json.dumps(record["arguments"], ensure_ascii=False) if record["arguments"] else ""
+                lines.append(f"{Fore.BLUE}Calling tool: {record['name']}({self._clip(arguments)}){Style.RESET_ALL}")
+            elif record["type"] == "tool_result":
+                lines.append(self._clip(record["content"]))
+        lines.append("")
+        self._output("\n".join(lines))
+
+    def _write_json_lines(self, message):
+        for record in self._records(message):
+            line = json.dumps(record, ensure_ascii=False) + "\n"
+            self.pending.append(line)
+            self.pending_bytes += len(line)
+        if self.pending_bytes >= self.buffer_bytes:
+            self.flush()
+
+    def flush(self):
+        """Write out buffered JSON lines"""
+        if self.pending:
+            self._output("".join(self.pending))
+            self.pending = []
+            self.pending_bytes = 0
@@ -2,16 +2,25 @@ import lmstudio as lms
 
 import os
 import shutil
-import subprocess
 import json
 import colorama
 from colorama import Fore, Style
-import torch
-from PIL import Image
-from transformers import AutoProcessor, AutoModelForCausalLM
-import warnings
+from PIL import Image, ImageOps
 import io
-from contextlib import redirect_stdout
+import time
+import hashlib
+import threading
+import argparse
+import sqlite3
+import functools
+import errno
+from typing import Literal
+import numpy as np
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from message_renderer import MessageRenderer, RENDER_MODES
+from instrumentation import span, traced, record_round, enable as enable_instrumentation
+from tool_runner import ToolRunner
 
 # Initialize colorama
 colorama.init()
@@ -23,20 +32,631 @@ vehicles_folder = "vehicles"
 animals_folder = "animals"
 other_folder = "other"
 
-# Create folders if they don't exist
-for folder in [source_folder, holidays_folder, vehicles_folder, other_folder, animals_folder]:
-    if not os.path.exists(folder):
-        os.makedirs(folder)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
 
+# Model configuration
+AGENT_MODEL = "gemma-3-4b-it"  # Model running the tool-calling loop
+IMAGE_MODEL = "gemma-3-4b-it"  # Vision model describing and classifying images; the same key shares one loaded instance
+UNLOAD_MODELS_ON_EXIT = True   # Unload the models a run loaded when it ends, whether or not it succeeded
+
+# Work queue configuration
+SCAN_RECURSIVE = False  # Also pick up images in subfolders of the source folder
+CLAIM_TIMEOUT = 600     # Seconds before an image handed out but never moved is offered again
+
+# Journal configuration
+SORT_JOURNAL_PATH = "sort_journal.sqlite"  # Decisions of earlier runs, by image content hash
+
+# Image preprocessing configuration
+IMAGE_MAX_SIDE = 896       # Longest side sent to the vision model, in pixels
+IMAGE_JPEG_QUALITY = 85    # Quality used when re-encoding downscaled images
+PREFETCH_IMAGES = 4        # Images prepared in the background ahead of the current one
+PREPARED_CACHE_SIZE = 512  # Prepared handles and descriptions kept, by image content hash
+
+# Agent tool configuration
+AGENT_PARALLEL_TOOL_CALLS = 4  # Tool calls of one agent round run at the same time
+DESCRIBE_TIMEOUT = 120.0       # Seconds get_image_description may take before the agent is told to move on
+MOVE_TIMEOUT = 30.0            # Seconds list_images_to_process and move_image may take
+
+# Batch mode configuration
+BATCH_WORKERS = 4           # Images classified at the same time
+BATCH_MOVE_EVERY = 64       # Decided moves applied together
+BATCH_MIN_CONFIDENCE = 0.6  # Below this, the image is left to the agent loop
+
+# Category registry configuration
+CATEGORIES_CONFIG = "categories.json"  # Optional registry file; the built-in categories below are used without it
+
+# Zero-shot routing configuration
+ROUTER_EMBEDDING_MODEL = "nomic-embed-text-v1.5"
+ROUTER_MIN_MARGIN = 0.04  # Lead of the best category over the runner-up needed to skip the agent
+
+CATEGORIES = {
+    "holidays": holidays_folder,
+    "vehicles": vehicles_folder,
+    "animals": animals_folder,
+    "other": other_folder,
+}
+
+# Short descriptions of each category; their mean embedding is the category's prototype
+CATEGORY_PROMPTS = {
+    "holidays": [
+        "a holiday photo of a beach, the sea and people on vacation",
+        "a travel picture of a famous landmark, a mountain view or a hotel pool",
+        "tourists sightseeing in a city abroad, with a suitcase or a map",
+    ],
+    "vehicles": [
+        "a photo of a car, a truck or a motorcycle on the road",
+        "a train, a bus, a bicycle or an airplane",
+        "a boat or a ship in a harbour",
+    ],
+    "animals": [
+        "a photo of an animal such as a dog, a cat or a bird",
+        "wild animals in nature, in a zoo or on a farm",
+        "a close-up of a pet with fur, feathers or scales",
+    ],
+    "other": [
+        "a photo of an everyday object, a document, a screenshot or food",
+        "an indoor scene, an office or a room in a house",
+        "abstract shapes, text, a chart or a diagram",
+    ],
+}
+
+CLASSIFICATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "description": {"type": "string"},
+        "category": {"type": "string", "enum": list(CATEGORIES)},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+    },
+    "required": ["description", "category", "confidence"],
+}
+
+def load_categories(path=CATEGORIES_CONFIG):
+    """Replace the built-in categories with those of a JSON registry file
+    
+    The file maps each category name to its destination folder, either as a
+    plain string or as {"folder": ..., "prompts": [...]}. Folders may be
+    nested ("animals/dogs"); prompts describe the category for the
+    embedding router and default to "a photo of <name>".
+    """
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    if not config:
+        raise ValueError(f"No categories in '{path}'")
+    
+    categories = {}
+    prompts = {}
+    for name, entry in config.items():
+        if isinstance(entry, str):
+            entry = {"folder": entry}
+        categories[name] = os.path.normpath(entry.get("folder", name))
+        prompts[name] = entry.get("prompts") or [f"a photo of {name.replace('/', ' ')}"]
+    
+    # Update in place, so everything holding these dicts sees the new registry
+    CATEGORIES.clear()
+    CATEGORIES.update(categories)
+    CATEGORY_PROMPTS.clear()
+    CATEGORY_PROMPTS.update(prompts)
+    CLASSIFICATION_SCHEMA["properties"]["category"]["enum"] = list(CATEGORIES)
+    print(f"{Fore.CYAN}Loaded {len(CATEGORIES)} categories from '{path}'.{Style.RESET_ALL}")
+
+def create_folders():
+    """Create folders if they don't exist"""
+    for folder in [source_folder, *CATEGORIES.values()]:
+        os.makedirs(folder, exist_ok=True)
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def downscale_image(original, extension, max_side=IMAGE_MAX_SIDE, quality=IMAGE_JPEG_QUALITY):
+    """Decode an image's bytes once and re-encode them at the model's input resolution
+    
+    Returns the bytes to upload and their file extension. Images that are
+    already small enough are sent unchanged, with their own extension,
+    unless re-encoding them as JPEG makes them smaller.
+    """
+    with Image.open(io.BytesIO(original)) as image:
+        # JPEG can decode straight at a reduced scale, which is much cheaper
+        image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    encoded = buffer.getvalue()
+    if len(encoded) < len(original):
+        return encoded, '.jpg'
+    return original, extension.lower()
+
+class ImagePreparer:
+    """Prepares images for the vision model ahead of time
+    
+    Each image is downscaled and uploaded once; the resulting handle (and
+    later the model's description) is cached by content hash, so the same
+    picture under another name or asked about twice costs nothing more.
+    prefetch() prepares upcoming images on a small thread pool while the
+    current one is being classified. discard() drops the prefetch of an
+    image that was sorted without being looked at.
+    """
+    
+    def __init__(self, client=lms, workers=PREFETCH_IMAGES, cache_size=PREPARED_CACHE_SIZE):
+        self.client = client
+        self.cache_size = cache_size
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.lock = threading.Lock()
+        self.handles = OrderedDict()
+        self.descriptions = OrderedDict()
+        self.pending = {}
+        self.images = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+        self.prepare_seconds = 0.0
+    
+    def _remember(self, cache, key, value):
+        with self.lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+    
+    def _prepare(self, path):
+        start = time.perf_counter()
+        # One read serves both the content hash and the decode
+        with open(path, 'rb') as f:
+            original = f.read()
+        content_hash = hashlib.sha256(original).hexdigest()
+        with self.lock:
+            handle = self.handles.get(content_hash)
+        if handle is None:
+            data, extension = downscale_image(original, os.path.splitext(path)[1])
+            with span("prepare_image", "upload", bytes=len(data)):
+                handle = self.client.prepare_image(data, name=os.path.splitext(os.path.basename(path))[0] + extension)
+            self._remember(self.handles, content_hash, handle)
+            with self.lock:
+                self.images += 1
+                self.original_bytes += len(original)
+                self.sent_bytes += len(data)
+                self.prepare_seconds += time.perf_counter() - start
+        return content_hash, handle
+    
+    def prefetch(self, paths):
+        """Start preparing images that will be needed soon
+        
+        Finished prefetches of images no longer in the folder, sorted by
+        another worker or process, are dropped first.
+        """
+        with self.lock:
+            for path in [path for path, future in self.pending.items() if future.done() and not os.path.exists(path)]:
+                del self.pending[path]
+            for path in paths:
+                if path not in self.pending:
+                    self.pending[path] = self.pool.submit(self._prepare, path)
+    
+    def get(self, path):
+        """Return (content_hash, image_handle), waiting for a prefetch if one is running"""
+        with self.lock:
+            future = self.pending.pop(path, None)
+        if future is not None:
+            return future.result()
+        return self._prepare(path)
+    
+    def discard(self, path):
+        """Forget the prefetch of an image that will not be asked for, cancelling it if it has not started"""
+        with self.lock:
+            future = self.pending.pop(path, None)
+        if future is not None:
+            future.cancel()
+    
+    def cached_description(self, content_hash):
+        with self.lock:
+            return self.descriptions.get(content_hash)
+    
+    def remember_description(self, content_hash, description):
+        self._remember(self.descriptions, content_hash, description)
+    
+    def report(self):
+        """Print bytes sent and preparation time per image"""
+        if not self.images:
+            return
+        print(f"{Fore.MAGENTA}Prepared {self.images} images: "
+              f"{self.original_bytes / self.images / 1024:.0f} KB on disk -> {self.sent_bytes / self.images / 1024:.0f} KB sent per image, "
+              f"{self.prepare_seconds / self.images * 1000:.0f} ms per image{Style.RESET_ALL}")
+
+image_preparer = ImagePreparer()
+
+class ModelRegistry:
+    """Loads models on first use and shares one handle per model
+    
+    lazy() returns a stand-in that loads its model the first time it is
+    used, so a run that never needs a model never loads it. Stand-ins for
+    the same model share one handle, counted by reference: release()
+    unloads the model once its last user lets go. Used as a context
+    manager, the registry unloads whatever is still loaded on exit, on
+    errors too.
+    """
+    
+    def __init__(self, loaders=None, unload=UNLOAD_MODELS_ON_EXIT):
+        self.loaders = loaders or {"llm": lambda key: lms.llm(key), "embedding": lambda key: lms.embedding_model(key)}
+        self.unload = unload
+        self.lock = threading.Lock()
+        self.handles = {}
+        self.references = {}
+        self.lazy_models = []
+        self.loads = 0
+        self.unloads = 0
+        self.acquired = 0
+        self.load_seconds = 0.0
+    
+    def acquire(self, model_key, kind="llm"):
+        """Return the handle of a model, loading it if needed, and count one more user"""
+        key = (kind, model_key)
+        with self.lock:
+            handle = self.handles.get(key)
+            if handle is None:
+                start = time.perf_counter()
+                with span("load_model", "load", model=model_key, kind=kind):
+                    handle = self.loaders[kind](model_key)
+                self.load_seconds += time.perf_counter() - start
+                self.loads += 1
+                self.handles[key] = handle
+            self.references[key] = self.references.get(key, 0) + 1
+            self.acquired += 1
+            return handle
+    
+    def release(self, model_key, kind="llm"):
+        """Count one user less, unloading the model when it was the last"""
+        key = (kind, model_key)
+        with self.lock:
+            if key not in self.references:
+                return
+            self.references[key] -= 1
+            if not self.references[key]:
+                del self.references[key]
+                self._unload(key)
+    
+    def _unload(self, key):
+        handle = self.handles.pop(key)
+        if not self.unload:
+            return
+        try:
+            handle.unload()
+            self.unloads += 1
+        except Exception as e:
+            print(f"{Fore.YELLOW}Could not unload model '{key[1]}': {e}{Style.RESET_ALL}")
+    
+    def lazy(self, model_key, kind="llm"):
+        """Return a stand-in for a model that acquires it on first use"""
+        model = LazyModel(self, model_key, kind)
+        self.lazy_models.append(model)
+        return model
+    
+    def close(self):
+        """Unload every model still loaded, whoever holds it"""
+        for model in self.lazy_models:
+            model.handle = None
+        with self.lock:
+            self.references.clear()
+            for key in list(self.handles):
+                self._unload(key)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+    
+    def report(self):
+        """Print how many models were loaded for how many users"""
+        print(f"{Fore.MAGENTA}Models: {self.loads} loaded for {self.acquired} users in {self.load_seconds:.2f} seconds, "
+              f"{self.unloads} unloaded{Style.RESET_ALL}")
+
+class LazyModel:
+    """Stands in for a model handle, acquiring it from a ModelRegistry on first use"""
+    
+    def __init__(self, registry, model_key, kind="llm"):
+        self.registry = registry
+        self.model_key = model_key
+        self.kind = kind
+        self.handle = None
+        self.lock = threading.Lock()
+    
+    def _load(self):
+        with self.lock:
+            if self.handle is None:
+                self.handle = self.registry.acquire(self.model_key, self.kind)
+            return self.handle
+    
+    def __getattr__(self, name):
+        # Only reached for attributes of the model itself
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+    
+    def release(self):
+        """Let go of the model; the registry unloads it if no one else uses it"""
+        with self.lock:
+            if self.handle is None:
+                return
+            self.handle = None
+        self.registry.release(self.model_key, self.kind)
+
+model_registry = ModelRegistry()
+agent_model = model_registry.lazy(AGENT_MODEL)
+image_model = model_registry.lazy(IMAGE_MODEL)
+
+class ImageQueue:
+    """Hands out the images of the source folder one at a time
+    
+    The folder is walked lazily with os.scandir, so the first image is
+    available before the whole folder has been listed, and getting the next
+    image does not depend on how many files are waiting. Each image is
+    claimed by one caller only, so several workers can share the queue.
+    When the walk runs out, the folder is scanned again and only files not
+    already queued or claimed are added; claims never finished with done()
+    are offered again after CLAIM_TIMEOUT.
+    """
+    
+    def __init__(self, folder, recursive=SCAN_RECURSIVE, claim_timeout=CLAIM_TIMEOUT):
+        self.folder = folder
+        self.recursive = recursive
+        self.claim_timeout = claim_timeout
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.queued = set()
+        self.claimed = {}
+        self.scanner = None
+        self.scans = 0
+    
+    def _walk(self):
+        """Yield image paths relative to the folder, one directory entry at a time"""
+        directories = [""]
+        while directories:
+            relative = directories.pop()
+            try:
+                with os.scandir(os.path.join(self.folder, relative)) as entries:
+                    for entry in entries:
+                        name = os.path.join(relative, entry.name) if relative else entry.name
+                        if entry.is_file():
+                            if entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                                yield name
+                        elif self.recursive and entry.is_dir(follow_symlinks=False):
+                            directories.append(name)
+            except FileNotFoundError:
+                if not relative:
+                    raise
+    
+    def _fill(self, count):
+        """Queue new images until count are pending or the folder has been scanned through
+        
+        Returns False once a rescan of the whole folder found nothing new.
+        """
+        rescanned = False
+        while len(self.pending) < count:
+            if self.scanner is None:
+                if rescanned:
+                    return False
+                self.scanner = self._walk()
+                self.scans += 1
+                rescanned = True
+            name = next(self.scanner, None)
+            if name is None:
+                self.scanner = None
+                continue
+            if name in self.queued:
+                continue
+            claimed_at = self.claimed.get(name)
+            if claimed_at is not None:
+                if time.monotonic() - claimed_at < self.claim_timeout:
+                    continue
+                del self.claimed[name]
+            self.queued.add(name)
+            self.pending.append(name)
+        return True
+    
+    def claim(self):
+        """Return the next image name and mark it as taken, or None when there are none left"""
+        with self.lock:
+            while self._fill(1):
+                name = self.pending.popleft()
+                self.queued.discard(name)
+                # The file may have been moved since the folder was scanned
+                if os.path.isfile(os.path.join(self.folder, name)):
+                    self.claimed[name] = time.monotonic()
+                    return name
+            return None
+    
+    def peek(self, count):
+        """Return up to count upcoming image names without claiming them"""
+        with self.lock:
+            self._fill(count)
+            return [self.pending[i] for i in range(min(count, len(self.pending)))]
+    
+    def done(self, name):
+        """Forget a claimed image once it has been moved out of the folder"""
+        with self.lock:
+            self.claimed.pop(name, None)
+    
+    def release(self, name):
+        """Put a claimed image back at the front of the queue"""
+        with self.lock:
+            if self.claimed.pop(name, None) is not None and name not in self.queued:
+                self.queued.add(name)
+                self.pending.appendleft(name)
+
+image_queue = ImageQueue(source_folder)
+
+class SortJournal:
+    """Append-only record of sorting decisions, kept in SQLite
+    
+    Every decision is stored with the file name, the image's content hash,
+    the category, the description and when it was made, and is committed
+    straight away, so a run that stops halfway loses nothing. Decisions are
+    looked up by content hash: an image sorted before, or a copy of one under
+    another name, is routed without asking a model again. In a dry run,
+    decisions are only written to the journal and no file is moved.
+    """
+    
+    def __init__(self, path=SORT_JOURNAL_PATH, dry_run=False):
+        self.path = path
+        self.dry_run = dry_run
+        self.lock = threading.Lock()
+        self.routed = 0
+        self.recorded = 0
+        self.hashes = {}
+        
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS decisions (
+            id INTEGER PRIMARY KEY,
+            file TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            decided_at REAL NOT NULL,
+            source TEXT NOT NULL,
+            applied INTEGER NOT NULL
+        )""")
+        
+        # Later decisions about the same content win
+        self.known = {}
+        self.journaled = set()
+        for file, content_hash, category, description, applied in self.db.execute(
+                "SELECT file, content_hash, category, description, applied FROM decisions ORDER BY id"):
+            self.known[content_hash] = (category, description)
+            self.journaled.add((file, content_hash, applied))
+    
+    def content_hash(self, image_name):
+        """Return the content hash of an image in the source folder, reusing it while the file is unchanged"""
+        path = os.path.join(source_folder, image_name)
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            cached = self.hashes.get(image_name)
+        if cached and cached[0] == signature:
+            return cached[1]
+        content_hash = file_digest(path)
+        with self.lock:
+            self.hashes[image_name] = (signature, content_hash)
+        return content_hash
+    
+    def lookup(self, image_name):
+        """Return (content hash, category, description) for an image, with None for an unknown category"""
+        content_hash = self.content_hash(image_name)
+        category, description = self.known.get(content_hash, (None, None))
+        if category not in CATEGORIES:
+            return content_hash, None, None
+        return content_hash, category, description
+    
+    def record(self, image_name, category, description=None, source="agent", content_hash=None):
+        """Append a decision for an image, unless the same file and content are already journaled in this mode"""
+        content_hash = content_hash or self.content_hash(image_name)
+        applied = 0 if self.dry_run else 1
+        with self.lock:
+            self.known[content_hash] = (category, description)
+            if (image_name, content_hash, applied) in self.journaled:
+                return
+            self.journaled.add((image_name, content_hash, applied))
+            self.db.execute(
+                "INSERT INTO decisions (file, content_hash, category, description, decided_at, source, applied) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (image_name, content_hash, category, description, time.time(), source, applied))
+            self.recorded += 1
+    
+    def report(self):
+        """Print how many images were routed from the journal and how many decisions were added"""
+        mode = " (dry run, no file moved)" if self.dry_run else ""
+        print(f"{Fore.MAGENTA}Journal '{self.path}': {self.routed} images routed from earlier decisions, "
+              f"{self.recorded} new decisions recorded{mode}{Style.RESET_ALL}")
+
+sort_journal = None
+
+def record_decision(image_name, category, description=None, source="agent"):
+    """Journal a decision for an image, returning whether the file should be moved now"""
+    if sort_journal is None:
+        return True
+    if description is None:
+        content_hash = sort_journal.content_hash(image_name)
+        description = image_preparer.cached_description(content_hash)
+    sort_journal.record(image_name, category, description, source)
+    if sort_journal.dry_run:
+        print(f"{Fore.YELLOW}Dry run: '{image_name}' would go to '{CATEGORIES[category]}'.{Style.RESET_ALL}")
+        return False
+    return True
+
+move_lock = threading.Lock()
+
+def free_destination(folder, file_name):
+    """Return a path in folder for file_name, adding _1, _2... to the name if it is taken"""
+    destination = os.path.join(folder, file_name)
+    stem, extension = os.path.splitext(file_name)
+    suffix = 0
+    while os.path.exists(destination):
+        suffix += 1
+        destination = os.path.join(folder, f"{stem}_{suffix}{extension}")
+    return destination
+
+def replace_file(source_path, destination_path):
+    """Move a file with os.replace, copying only when the destination is on another filesystem"""
+    try:
+        os.replace(source_path, destination_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(source_path, destination_path)
+
+def move_to_category(image_name, category):
+    """Move an image from the source folder to a category folder and finish its claim
+    
+    Returns the destination path, renamed if a file of that name was already there.
+    """
+    with move_lock, span("move", "file", target=category):
+        destination = free_destination(CATEGORIES[category], os.path.basename(image_name))
+        replace_file(os.path.join(source_folder, image_name), destination)
+    image_queue.done(image_name)
+    image_preparer.discard(os.path.join(source_folder, image_name))
+    return destination
+
+def route_known_image(image_name):
+    """Sort an image from the journal without asking a model, returning whether it was known"""
+    if sort_journal is None:
+        return False
+    try:
+        content_hash, category, description = sort_journal.lookup(image_name)
+        if category is None:
+            return False
+        sort_journal.record(image_name, category, description, "journal", content_hash)
+        sort_journal.routed += 1
+        image_preparer.discard(os.path.join(source_folder, image_name))
+        if not sort_journal.dry_run:
+            move_to_category(image_name, category)
+        print(f"{Fore.GREEN}Image '{image_name}' sorted to '{CATEGORIES[category]}' from the journal.{Style.RESET_ALL}")
+        return True
+    except Exception as e:
+        print(f"{Fore.YELLOW}Could not route '{image_name}' from the journal: {e}{Style.RESET_ALL}")
+        return False
+
+@traced("tool")
 def list_images_to_process() -> str:
     """Lists the name of the next image to process"""
     try:
-        images = [f for f in os.listdir(source_folder) if os.path.isfile(os.path.join(source_folder, f)) and f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif'))]
+        image_name = image_queue.claim()
+        # Images decided in an earlier run are sorted right away
+        while image_name and route_known_image(image_name):
+            image_name = image_queue.claim()
         
-        if images:
-            first_image = images[0]
-            print(f"{Fore.GREEN}First image found in '{source_folder}': {first_image}{Style.RESET_ALL}")
-            return first_image
+        if image_name:
+            # Start preparing the next images while this one is being looked at
+            upcoming = [image_name] + image_queue.peek(PREFETCH_IMAGES - 1)
+            image_preparer.prefetch([os.path.join(source_folder, f) for f in upcoming])
+            print(f"{Fore.GREEN}Next image found in '{source_folder}': {image_name}{Style.RESET_ALL}")
+            return image_name
         else:
             print(f"{Fore.YELLOW}No images found in '{source_folder}'.{Style.RESET_ALL}")
             return "There are no more images to process"
@@ -47,28 +667,16 @@ def list_images_to_process() -> str:
         print(f"{Fore.RED}An error occurred while listing images: {e}{Style.RESET_ALL}")
         return ""
 
-def move_image_to_holidays(image_name: str) -> str:
-    """Sorts and moves an image to the 'holidays' folder."""
-    try:
-        source_path = os.path.join(source_folder, image_name)
-        destination_path = os.path.join(holidays_folder, image_name)
-        shutil.move(source_path, destination_path)
-        print(f"{Fore.GREEN}Image '{image_name}' moved to '{holidays_folder}'.{Style.RESET_ALL}")
-        return "retrieve the next image to sort"
-    except FileNotFoundError:
-        print(f"{Fore.RED}Error: File '{image_name}' not found in '{source_folder}'.{Style.RESET_ALL}")
-        return "File not found"
-    except Exception as e:
-        print(f"{Fore.RED}An error occurred while moving the image: {e}{Style.RESET_ALL}")
-        return "operation error"
-    
-def move_image_to_animals(image_name: str) -> str:
-    """Sorts and moves an image to the 'animals' folder."""
+@traced("tool")
+def move_image(image_name: str, category: str) -> str:
+    """Sorts and moves an image to the folder of its category."""
+    if category not in CATEGORIES:
+        print(f"{Fore.RED}Error: Unknown category '{category}'.{Style.RESET_ALL}")
+        return f"unknown category, use one of: {', '.join(CATEGORIES)}"
     try:
-        source_path = os.path.join(source_folder, image_name)
-        destination_path = os.path.join(animals_folder, image_name)
-        shutil.move(source_path, destination_path)
-        print(f"{Fore.GREEN}Image '{image_name}' moved to '{animals_folder}'.{Style.RESET_ALL}")        
+        if record_decision(image_name, category):
+            destination_path = move_to_category(image_name, category)
+            print(f"{Fore.GREEN}Image '{image_name}' moved to '{destination_path}'.{Style.RESET_ALL}")
         return "retrieve the next image to sort"
     except FileNotFoundError:
         print(f"{Fore.RED}Error: File '{image_name}' not found in '{source_folder}'.{Style.RESET_ALL}")
@@ -77,51 +685,45 @@ def move_image_to_animals(image_name: str) -> str:
         print(f"{Fore.RED}An error occurred while moving the image: {e}{Style.RESET_ALL}")
         return "operation error"
 
-def move_image_to_vehicles(image_name: str) -> str:
-    """Sorts and moves an image to the 'vehicles' folder."""
-    try:
-        source_path = os.path.join(source_folder, image_name)
-        destination_path = os.path.join(vehicles_folder, image_name)
-        shutil.move(source_path, destination_path)
-        print(f"{Fore.GREEN}Image '{image_name}' moved to '{vehicles_folder}'.{Style.RESET_ALL}")
-        return "retrieve the next image to sort"
-    except FileNotFoundError:
-        print(f"{Fore.RED}Error: File '{image_name}' not found in '{source_folder}'.{Style.RESET_ALL}")
-        return "File not found"
-    except Exception as e:
-        print(f"{Fore.RED}An error occurred while moving the image: {e}{Style.RESET_ALL}")
-        return "operation error"
+def move_image_tool():
+    """Return move_image as a tool whose category argument only accepts registered categories
+    
+    One tool covers every category, so adding categories only adds their
+    names to the schema sent with each request.
+    """
+    return lms.ToolFunctionDef(
+        name="move_image",
+        description=move_image.__doc__,
+        parameters={"image_name": str, "category": Literal[tuple(CATEGORIES)]},
+        implementation=tool_runner.wrap(move_image, timeout=MOVE_TIMEOUT)
+    )
 
-def move_image_to_other(image_name: str) -> str:
-    """Sorts and moves an image to the 'other' folder."""
-    try:
-        source_path = os.path.join(source_folder, image_name)
-        destination_path = os.path.join(other_folder, image_name)
-        shutil.move(source_path, destination_path)
-        print(f"{Fore.GREEN}Image '{image_name}' moved to '{other_folder}'.{Style.RESET_ALL}")
-        return "retrieve the next image to sort"
-    except FileNotFoundError:
-        print(f"{Fore.RED}Error: File '{image_name}' not found in '{source_folder}'.{Style.RESET_ALL}")
-        return "File not found"
-    except Exception as e:
-        print(f"{Fore.RED}An error occurred while moving the image: {e}{Style.RESET_ALL}")
-        return "operation error"
+def describe_image(image_name, image_model, preparer=None):
+    """Return the vision model's description of an image, cached by content hash"""
+    preparer = preparer or image_preparer
+    content_hash, image_handle = preparer.get(os.path.join(source_folder, image_name))
+    prediction = preparer.cached_description(content_hash)
+    if prediction is not None:
+        return prediction
+    
+    chat = lms.Chat()
+    chat.add_user_message("describe the image in 3 sentences", images=[image_handle])
+    with span("describe", "model") as call:
+        prediction = image_model.respond(chat)
+        call.record_stats(getattr(prediction, "stats", None))
+    
+    if not isinstance(prediction, str):
+        prediction = str(prediction)
+    preparer.remember_description(content_hash, prediction)
+    return prediction
 
+@traced("tool")
 def get_image_description(image_name: str) -> str:
     """
     Provides a description of the specified image
     """
     try:
-        source_path = os.path.join(source_folder, image_name)
-        image_handle = lms.prepare_image(source_path)
-        chat = lms.Chat()
-        chat.add_user_message("describe the image in 3 sentences", images=[image_handle])
-        prediction = image_model.respond(chat)
-
-        
-        if not isinstance(prediction, str):
-            prediction = str(prediction)
-        return prediction
+        return describe_image(image_name, image_model)
         
     except FileNotFoundError:
         print(f"{Fore.RED}Error: File '{image_name}' not found in '{source_folder}'.{Style.RESET_ALL}")
@@ -131,136 +733,291 @@ def get_image_description(image_name: str) -> str:
         return "retry with another image"
        
 
-def format_message(message):
-    try:
-        msg_str = str(message)
-        
-        # Function to decode Unicode escape sequences
-        def decode_unicode(text):
+message_renderer = MessageRenderer()
+
+# No tool is cached here: describe_image already caches descriptions by content hash, and moves and listing change state
+tool_runner = ToolRunner(max_workers=AGENT_PARALLEL_TOOL_CALLS)
+
+def unit_rows(matrix):
+    """Scale each row of a float32 matrix to unit length"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class CategoryRouter:
+    """Sorts images by comparing their description with category prototypes
+    
+    Each category's prototype is the mean embedding of a few short
+    descriptions of it (CATEGORY_PROMPTS), computed once. An image's
+    description is embedded and compared with every prototype by cosine
+    similarity; when the best category leads the runner-up by at least
+    min_margin, the image is sorted without asking the agent. Counts of
+    both outcomes give the fast-path rate.
+    """
+    
+    def __init__(self, embedding_model, prompts=CATEGORY_PROMPTS, min_margin=ROUTER_MIN_MARGIN):
+        self.embedding_model = embedding_model
+        self.min_margin = min_margin
+        self.categories = [category for category in prompts if category in CATEGORIES]
+        texts = [text for category in self.categories for text in prompts[category]]
+        with span("embed_prototypes", "model", texts=len(texts)):
+            vectors = unit_rows(np.asarray(embedding_model.embed(texts), dtype=np.float32))
+        sizes = [len(prompts[category]) for category in self.categories]
+        starts = np.cumsum([0] + sizes[:-1])
+        self.prototypes = unit_rows(np.add.reduceat(vectors, starts, axis=0))
+        self.lock = threading.Lock()
+        self.fast = 0
+        self.deferred = 0
+    
+    def classify(self, description):
+        """Return the closest category and its lead over the runner-up"""
+        with span("embed_description", "model"):
+            vector = unit_rows(np.asarray([self.embedding_model.embed(description)], dtype=np.float32))[0]
+        scores = self.prototypes @ vector
+        order = np.argsort(scores)[::-1]
+        margin = float(scores[order[0]] - scores[order[1]]) if len(order) > 1 else 1.0
+        return self.categories[order[0]], margin
+    
+    def route(self, description):
+        """Return (category, margin), with category None when the margin is too small to decide"""
+        category, margin = self.classify(description)
+        with self.lock:
+            if margin >= self.min_margin:
+                self.fast += 1
+            else:
+                self.deferred += 1
+                category = None
+        return category, margin
+    
+    def report(self):
+        """Print how many images took the fast path"""
+        total = self.fast + self.deferred
+        if total:
+            print(f"{Fore.MAGENTA}Routed {self.fast} of {total} images by embedding similarity "
+                  f"({self.fast / total:.0%} fast path), {self.deferred} left for the agent{Style.RESET_ALL}")
+
+def route_image(image_name, image_model, preparer=None, router=None):
+    """Describe an image and pick its category by embedding similarity
+    
+    Returns the same fields as classify_image, with the router's margin as
+    the confidence and no category when the margin is too small.
+    """
+    description = describe_image(image_name, image_model, preparer)
+    category, margin = router.route(description)
+    return {"description": description, "category": category, "confidence": margin, "source": "router"}
+
+def classify_image(image_name, image_model, preparer=None):
+    """Describe and classify an image with one structured model call
+    
+    Returns a dict with the description, the category and the model's
+    confidence in it.
+    """
+    preparer = preparer or image_preparer
+    _, image_handle = preparer.get(os.path.join(source_folder, image_name))
+    chat = lms.Chat()
+    chat.add_user_message(
+        "describe the image in 3 sentences, then classify it into one of these categories: "
+        f"{', '.join(CATEGORIES)}. give your confidence in the category between 0 and 1.",
+        images=[image_handle]
+    )
+    with span("classify", "model") as call:
+        prediction = image_model.respond(chat, response_format=CLASSIFICATION_SCHEMA)
+        call.record_stats(getattr(prediction, "stats", None))
+    answer = prediction.parsed
+    if isinstance(answer, str):
+        answer = json.loads(answer)
+    return answer
+
+def move_images(moves):
+    """Move a batch of (image_name, category) decisions, returning how many succeeded
+    
+    The batch holds the move lock once and renames files within the same
+    filesystem, so no file content is copied.
+    """
+    moved = 0
+    finished = []
+    with move_lock, span("move_batch", "file", images=len(moves)):
+        for image_name, category in moves:
             try:
-                return bytes(text, 'utf-8').decode('unicode_escape')
-            except:
-                return text
-        
-        # Handle assistant messages
-        if hasattr(message, 'role') and message.role == 'assistant':
-            print(f"{Fore.CYAN}Assistant:{Style.RESET_ALL}")
-            
-            # Extract and display all text and tool names
-            if hasattr(message, 'content') and isinstance(message.content, list):
-                for item in message.content:
-                    item_str = str(item)
-                    
-                    # Extract text content from text parts
-                    if "ChatMessagePartTextData" in item_str:
-                        if '"text":' in item_str:
-                            text_start = item_str.find('"text": "') + 9
-                            if text_start > 8:
-                                # Handle escaped quotes in the text
-                                text_content = ""
-                                in_quotes = True
-                                i = text_start
-                                while i < len(item_str) and in_quotes:
-                                    if item_str[i:i+2] == '\\"':
-                                        text_content += '"'
-                                        i += 2
-                                    elif item_str[i] == '"' and (i == 0 or item_str[i-1] != '\\'):
-                                        in_quotes = False
-                                    else:
-                                        text_content += item_str[i]
-                                        i += 1
-                                
-                                # Clean up the text and decode Unicode
-                                text_content = text_content.replace('\\n', '\n')
-                                text_content = decode_unicode(text_content)
-                                if text_content.strip():  # Only print non-empty texts
-                                    print(f"{text_content}")
-                    
-                    # Extract tool names from tool call requests
-                    elif "ChatMessagePartToolCallRequestData" in item_str:
-                        if '"name":' in item_str:
-                            name_start = item_str.find('"name": "') + 9
-                            name_end = item_str.find('"', name_start)
-                            if name_start > 8 and name_end > name_start:
-                                tool_name = item_str[name_start:name_end]
-                                tool_name = decode_unicode(tool_name)
-                                print(f"{Fore.BLUE}Calling tool: {tool_name}{Style.RESET_ALL}")
-        
-        # Handle tool messages
-        elif hasattr(message, 'role') and message.role == 'tool':
-            print(f"{Fore.YELLOW}Tool result:{Style.RESET_ALL}")
+                destination = free_destination(CATEGORIES[category], os.path.basename(image_name))
+                replace_file(os.path.join(source_folder, image_name), destination)
+                finished.append(image_name)
+                moved += 1
+            except Exception as e:
+                print(f"{Fore.RED}An error occurred while moving '{image_name}': {e}{Style.RESET_ALL}")
+    for image_name in finished:
+        image_queue.done(image_name)
+        image_preparer.discard(os.path.join(source_folder, image_name))
+    if moves:
+        print(f"{Fore.GREEN}Moved {moved} images.{Style.RESET_ALL}")
+    return moved
+
+@traced("task")
+def sort_images_batch(image_model, preparer=None, workers=BATCH_WORKERS, min_confidence=BATCH_MIN_CONFIDENCE, queue=None,
+                      classify=classify_image):
+    """Classify every image in the source folder directly, without the agent loop
+    
+    Images are claimed from the work queue and classified on a pool of
+    workers, with at most twice that many requests queued at once, and moves
+    are applied in groups of BATCH_MOVE_EVERY. Images are prepared
+    PREFETCH_IMAGES ahead of the ones being classified. classify is
+    classify_image or route_image. Returns the names of the images whose
+    confidence was below min_confidence, which are left in place for the
+    agent loop.
+    """
+    print(f"{Fore.CYAN}Batch sorting images from '{source_folder}' with {workers} workers{Style.RESET_ALL}")
+    
+    preparer = preparer or image_preparer
+    queue = queue or image_queue
+    start_time = time.perf_counter()
+    pending_moves = []
+    ambiguous = []
+    moved = 0
+    processed = 0
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < workers * 2:
+                image_name = queue.claim()
+                if image_name is None:
+                    exhausted = True
+                    break
+                if route_known_image(image_name):
+                    processed += 1
+                    continue
+                in_flight[pool.submit(classify, image_name, image_model, preparer)] = image_name
+            ahead = queue.peek(PREFETCH_IMAGES)
+            preparer.prefetch([os.path.join(source_folder, f) for f in ahead])
+            if not in_flight:
+                break
             
-            # Extract and display all content values
-            if hasattr(message, 'content') and isinstance(message.content, list):
-                for item in message.content:
-                    item_str = str(item)
-                    
-                    if "ChatMessagePartToolCallResultData" in item_str:
-                        if '"content":' in item_str:
-                            content_start = item_str.find('"content": "') + 12
-                            if content_start > 11:
-                                # Extract content with proper handling of quotes
-                                content_value = ""
-                                in_quotes = True
-                                i = content_start
-                                while i < len(item_str) and in_quotes:
-                                    if item_str[i:i+2] == '\\"':
-                                        content_value += '"'
-                                        i += 2
-                                    elif item_str[i] == '"' and (i == 0 or item_str[i-1] != '\\'):
-                                        in_quotes = False
-                                    else:
-                                        content_value += item_str[i]
-                                        i += 1
-                                
-                                # Clean up the content and decode Unicode
-                                content_value = content_value.replace('\\n', '\n')
-                                content_value = decode_unicode(content_value)
-                                content_value = content_value.strip('\"')
-                                print(f"{content_value}")
-        
-        # Handle string messages
-        elif isinstance(message, str):
-            print(decode_unicode(message))
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                image_name = in_flight.pop(future)
+                processed += 1
+                try:
+                    answer = future.result()
+                    category = answer.get("category")
+                    confidence = float(answer.get("confidence", 0))
+                except Exception as e:
+                    print(f"{Fore.YELLOW}Could not classify '{image_name}': {e}{Style.RESET_ALL}")
+                    ambiguous.append(image_name)
+                    continue
+                
+                if category in CATEGORIES and confidence >= min_confidence:
+                    try:
+                        if record_decision(image_name, category, answer.get("description", ""), answer.get("source", "batch")):
+                            pending_moves.append((image_name, category))
+                    except Exception as e:
+                        print(f"{Fore.RED}Could not journal '{image_name}': {e}{Style.RESET_ALL}")
+                else:
+                    ambiguous.append(image_name)
             
-    except Exception as e:
-        print(f"{Fore.RED}Error in format_message: {str(e)}{Style.RESET_ALL}")
-        import traceback
-        traceback.print_exc()
+            if len(pending_moves) >= BATCH_MOVE_EVERY:
+                moved += move_images(pending_moves)
+                pending_moves = []
     
-    return None
+    moved += move_images(pending_moves)
+    elapsed = time.perf_counter() - start_time
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"{Fore.MAGENTA}Batch sorted {moved} images in {elapsed:.2f} seconds ({rate:.2f} images/s), {len(ambiguous)} left for the agent{Style.RESET_ALL}")
+    return ambiguous
 
 
 # Definition of the agent
 
-model = lms.llm("gemma-3-4b-it")
-client = lms.get_default_client()
-image_model = client.llm.load_new_instance("gemma-3-4b-it")
-
-prompt = """organize images into folders based on their categories (holidays, vehicles, animals, other)
+@traced("task")
+def run_agent(model, image_names=None):
+    """Sort images with the act() tool-calling loop, optionally limited to image_names"""
+    # Not pure: a name can point at new content, and describe_image already caches by content hash
+    describe_tool = tool_runner.wrap(get_image_description, timeout=DESCRIBE_TIMEOUT)
+    if image_names is None:
+        prompt = """organize images into folders based on their categories, using move_image with the category that fits best
 do not invent names for images, use the existing ones provided by the tool list_images_to_process
 before calling a tool, explain your thinking.
 at the end of the process, give an evaluation about each tools used."""
-tools = [
-    list_images_to_process,
-    move_image_to_holidays,
-    move_image_to_vehicles,
-    move_image_to_other,
-    move_image_to_animals,
-    get_image_description
-]
-try:    
+        tools = [
+            tool_runner.wrap(list_images_to_process, timeout=MOVE_TIMEOUT),
+            move_image_tool(),
+            describe_tool
+        ]
+    else:
+        prompt = f"""organize these images into folders based on their categories, using move_image with the category that fits best: {', '.join(image_names)}
+they were hard to classify, so look at each description carefully.
+do not invent names for images, only use the ones listed here.
+before calling a tool, explain your thinking."""
+        tools = [
+            move_image_tool(),
+            describe_tool
+        ]
+    
     result = model.act(
         prompt,
         tools,
-        on_message=format_message
+        on_message=message_renderer,
+        max_parallel_tool_calls=AGENT_PARALLEL_TOOL_CALLS,
+        on_prediction_completed=lambda round_result: record_round(round_result.stats)
     )
+    message_renderer.flush()
     print(f"\n{Fore.GREEN}Final result: {result}{Style.RESET_ALL}")
-    model.unload()
-    image_model.unload()
-    
-except Exception as e:
-    print(f"\n{Fore.RED}An error occurred: {str(e)}{Style.RESET_ALL}")
-    print(f"{Fore.YELLOW}Try using a different model or updating the LMStudio SDK.{Style.RESET_ALL}")
 
-print(f"\n{Fore.MAGENTA}=== CALCULATION COMPLETE ==={Style.RESET_ALL}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sort images from the source folder into category folders.")
+    parser.add_argument("--batch", action="store_true", help="classify images directly and only use the agent for ambiguous ones")
+    parser.add_argument("--route", action="store_true", help="sort clear-cut images by embedding similarity and only use the agent for the rest")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="images classified at the same time in batch and route modes")
+    parser.add_argument("--recursive", action="store_true", default=SCAN_RECURSIVE, help="also sort images in subfolders of the source folder")
+    parser.add_argument("--categories", default=CATEGORIES_CONFIG, help="JSON category registry, used when the file exists")
+    parser.add_argument("--messages", choices=RENDER_MODES, default="text", help="how agent messages are shown: text, quiet, or JSON lines")
+    parser.add_argument("--messages-file", help="write agent messages to this file instead of the terminal")
+    parser.add_argument("--journal", default=SORT_JOURNAL_PATH, help="SQLite file where sorting decisions are recorded and reused")
+    parser.add_argument("--dry-run", action="store_true", help="only record decisions in the journal, without moving any file")
+    parser.add_argument("--trace", metavar="PATH", help="record spans for model calls, tools, uploads and moves and write a Chrome/Perfetto trace on exit")
+    parser.add_argument("--prometheus", metavar="PATH", help="write counters and latency histograms in the Prometheus text format on exit")
+    args = parser.parse_args()
+    
+    if args.trace or args.prometheus:
+        enable_instrumentation(args.trace, args.prometheus)
+    if os.path.exists(args.categories):
+        load_categories(args.categories)
+    create_folders()
+    image_queue.recursive = args.recursive
+    sort_journal = SortJournal(args.journal, dry_run=args.dry_run)
+    messages_file = open(args.messages_file, "a", encoding="utf-8") if args.messages_file else None
+    message_renderer = MessageRenderer(args.messages, messages_file)
+    
+    # Models load on first use and are unloaded when the block exits, even after an error
+    with model_registry:
+        router = None
+        if args.route:
+            try:
+                router = CategoryRouter(model_registry.lazy(ROUTER_EMBEDDING_MODEL, "embedding"))
+            except Exception as e:
+                print(f"{Fore.YELLOW}Embedding model '{ROUTER_EMBEDDING_MODEL}' unavailable ({e}), using the agent for every image.{Style.RESET_ALL}")
+        
+        try:
+            if router is not None:
+                ambiguous = sort_images_batch(image_model, workers=args.workers, min_confidence=router.min_margin,
+                                              classify=functools.partial(route_image, router=router))
+                router.report()
+                if ambiguous:
+                    run_agent(agent_model, ambiguous)
+            elif args.batch:
+                ambiguous = sort_images_batch(image_model, workers=args.workers)
+                if ambiguous:
+                    run_agent(agent_model, ambiguous)
+            else:
+                run_agent(agent_model)
+            image_preparer.report()
+            tool_runner.report()
+            sort_journal.report()
+            
+        except Exception as e:
+            print(f"\n{Fore.RED}An error occurred: {str(e)}{Style.RESET_ALL}")
+            print(f"{Fore.YELLOW}Try using a different model or updating the LMStudio SDK.{Style.RESET_ALL}")
+    model_registry.report()
+    
+    print(f"\n{Fore.MAGENTA}=== CALCULATION COMPLETE ==={Style.RESET_ALL}")
\ No newline at end of file
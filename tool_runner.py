@@ -0,0 +1,166 @@
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from colorama import Fore, Style
+from instrumentation import count
+
+# Tool execution configuration
+TOOL_MAX_WORKERS = 4     # Tool calls running at once, across every act() round using the runner
+TOOL_TIMEOUT = 120.0     # Seconds a tool call may take before act() gets an error instead, None for no limit
+TOOL_CACHE_SIZE = 1024   # Results of pure tools kept, least recently used first out
+
+def pure(tool):
+    """Mark a tool as pure: the same arguments always give the same result, so results can be cached"""
+    tool.pure = True
+    return tool
+
+def call_key(args, kwargs):
+    """Cache key of one call's arguments; lists and dicts are keyed by their JSON text"""
+    return json.dumps([args, kwargs], sort_keys=True, default=repr)
+
+class ToolStats:
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.saved_seconds = 0.0
+        self.pure = False
+
+class ToolRunner:
+    """Runs act() tools on a shared, bounded thread pool, with timeouts and a result cache for pure tools
+
+    wrap() returns a tool with the same name, docstring and parameters, so
+    act() builds the same schema. Each call runs on the runner's pool, which
+    caps how many tools run at once however many calls act() starts in
+    parallel (max_parallel_tool_calls), and waits at most the tool's timeout.
+    A timed-out call raises, which act() reports back to the model; the
+    worker thread itself cannot be stopped and finishes in the background.
+
+    Results of pure tools are cached by tool name and arguments. The cache
+    holds the future of the first call, so an identical call made while it
+    still runs, as happens within one round, waits for it instead of
+    running again. Calls that raise, time out or whose result keep(result)
+    rejects are not cached. Each hit adds the first call's duration to the
+    time saved.
+    """
+
+    def __init__(self, max_workers=TOOL_MAX_WORKERS, timeout=TOOL_TIMEOUT, cache_size=TOOL_CACHE_SIZE):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def _stats(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats.setdefault(name, ToolStats())
+        return stats
+
+    def _forget(self, key, future):
+        with self.lock:
+            if self.cache.get(key) is future:
+                del self.cache[key]
+
+    def _start(self, name, tool, args, kwargs, future, key=None, keep=None):
+        """Run one call on the pool, completing future with its result and its duration in future.seconds
+        
+        With a key, the call's cache entry is dropped before waiters see the
+        outcome, unless the call succeeded and keep accepts the result.
+        """
+        def run():
+            start = time.perf_counter()
+            error = None
+            try:
+                result = tool(*args, **kwargs)
+            except BaseException as e:
+                result, error = None, e
+            future.seconds = time.perf_counter() - start
+            with self.lock:
+                self._stats(name).seconds += future.seconds
+            if key is not None and (error is not None or (keep is not None and not keep(result))):
+                self._forget(key, future)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        self.pool.submit(run)
+        return future
+
+    def _cached_future(self, name, tool, args, kwargs, keep):
+        """Return (future, hit) for a pure tool call, starting the call on a miss"""
+        key = (name, call_key(args, kwargs))
+        with self.lock:
+            future = self.cache.get(key)
+            if future is not None:
+                self.cache.move_to_end(key)
+                return future, True
+            future = Future()
+            self.cache[key] = future
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return self._start(name, tool, args, kwargs, future, key, keep), False
+
+    def wrap(self, tool, pure=None, timeout=None, keep=None):
+        """Return tool run through the runner; pure defaults to the tool's pure mark, timeout to the runner's"""
+        if pure is None:
+            pure = getattr(tool, "pure", False)
+        limit = timeout if timeout is not None else self.timeout
+        name = getattr(tool, "__name__", repr(tool))
+
+        @functools.wraps(tool)
+        def run_tool(*args, **kwargs):
+            if pure:
+                future, hit = self._cached_future(name, tool, args, kwargs, keep)
+            else:
+                future, hit = self._start(name, tool, args, kwargs, Future()), False
+            with self.lock:
+                stats = self._stats(name)
+                stats.pure = pure
+                stats.calls += 1
+                stats.hits += hit
+            count("tool_calls_total", tool=name, cache="hit" if hit else ("miss" if pure else "off"))
+            try:
+                result = future.result(timeout=limit)
+            except FutureTimeoutError:
+                if pure:
+                    self._forget((name, call_key(args, kwargs)), future)
+                with self.lock:
+                    stats.timeouts += 1
+                raise TimeoutError(f"{name} did not finish within {limit} seconds") from None
+            except Exception:
+                with self.lock:
+                    stats.errors += 1
+                raise
+            if hit:
+                with self.lock:
+                    stats.saved_seconds += getattr(future, "seconds", 0.0)
+            return result
+        return run_tool
+
+    def summary(self):
+        """Per-tool counts: calls, cache hits and hit rate, timeouts, errors, tool time and time saved"""
+        with self.lock:
+            return {name: {"calls": stats.calls, "pure": stats.pure, "hits": stats.hits,
+                           "hit_rate": stats.hits / stats.calls if stats.calls else 0.0,
+                           "timeouts": stats.timeouts, "errors": stats.errors,
+                           "seconds": round(stats.seconds, 3), "saved_seconds": round(stats.saved_seconds, 3)}
+                    for name, stats in sorted(self.stats.items())}
+
+    def report(self):
+        """Print each tool's calls, timeouts and running time, with the cache hit rate and time saved for pure tools"""
+        for name, stats in self.summary().items():
+            cached = f"{stats['hits']} from cache ({stats['hit_rate']:.0%}), " if stats['pure'] else ""
+            saved = f", {stats['saved_seconds']:.2f} s saved" if stats['pure'] else ""
+            print(f"{Fore.MAGENTA}Tool {name}: {stats['calls']} calls, {cached}"
+                  f"{stats['timeouts']} timed out, {stats['seconds']:.2f} s running{saved}{Style.RESET_ALL}")
+
+    def close(self):
+        self.pool.shutdown(wait=False)